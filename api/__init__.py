@@ -0,0 +1,16 @@
+from .bulk import BulkSummary, bulk_import
+from .batch import BatchResults, MAX_BATCH_SIZE
+from .locks import KeyLocks, ReadWriteLock
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, parse_limit
+from .logs import LOG_QUEUE_SIZE, MAX_PAYLOAD_SIZE, Payload, parse_sample_rates, start_logging
+from .schema import Schema, ValidationError
+from .asgi import ASGIAdapter, ASGI_WORKERS, MAX_BODY_SIZE
+from .metrics import Metrics, TopKeys, LATENCY_BUCKETS, TOP_ISBNS
+from .events import AvailabilityHub, AvailabilityStream, Subscription, HEARTBEAT_INTERVAL, MAX_STREAM_ISBNS
+from .export import Exports, StagedImport, export_records, read_export, EXPORT_PAGE_SIZE, EXPORT_VERSION
+from .analytics import CirculationLog, History, loan_days, loan_durations, overdue_loans, top_titles
+from .analytics import ANALYTICS_WINDOW_DAYS, LOAN_PERCENTILES, TOP_TITLES
+from .admission import Admission, RateLimited, RouteBusy, TokenBuckets, RouteLimits
+from .admission import CLIENT_HEADER, DEFAULT_BURST, WRITE_METHODS
+from .idempotency import IdempotencyCache, Outcome
+from .idempotency import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_HEADER, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT, MAX_KEY_LENGTH
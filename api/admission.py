@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+from collections.abc import Callable
+
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+# methods that change the library, only these are admitted or refused
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+# header naming the integration or terminal a request comes from, the client address is used without it
+CLIENT_HEADER = "X-Client-Id"
+# tokens a bucket starts with and can save up, as a number of requests
+DEFAULT_BURST = 20.0
+# buckets kept per limiter, idle ones are dropped first when there are more
+MAX_BUCKETS = 100000
+# seconds a request refused because its route is busy is told to wait
+BUSY_RETRY_AFTER = 1
+
+class TokenBuckets:
+    """a token bucket per key, refilled at rate tokens a second up to burst
+
+    A bucket that has filled up again is the same as a missing one, so when there are too many those are
+    dropped first, then the ones untouched longest.
+    """
+
+    def __init__(self, rate: float, burst: float = DEFAULT_BURST, max_buckets: int = MAX_BUCKETS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate: float = rate
+        self.burst: float = max(burst, 1.0)
+        self.max_buckets: int = max_buckets
+        self.clock: Callable[[], float] = clock
+        # key to tokens left and when they were counted
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str):
+        """takes a token from the key's bucket
+
+        Returns:
+            float: 0 when a token was taken, or else the seconds until the bucket has one
+        """
+        now = self.clock()
+        with self._lock:
+            # taken out and put back so the dict stays in the order buckets were last used
+            bucket = self._buckets.pop(key, None)
+            tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+
+            if bucket is None and len(self._buckets) >= self.max_buckets:
+                self._prune(now)
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+    def _prune(self, now: float):
+        # buckets that have filled up since are dropped, then the longest untouched ones if that isn't enough
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+        for key in list(self._buckets)[:len(self._buckets) - self.max_buckets // 2]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class RateLimited(TooManyRequests):
+    """429 for a client or customer over its rate, reason names which"""
+
+    def __init__(self, description: str, wait: float, reason: str):
+        super().__init__(description, retry_after=max(1, math.ceil(wait)))
+        self.reason: str = reason
+
+class RouteBusy(ServiceUnavailable):
+    """503 for a route already handling as many requests as it may"""
+
+    reason = "concurrency"
+
+    def __init__(self, route: str):
+        super().__init__(f"{route} is handling too many requests", retry_after=BUSY_RETRY_AFTER)
+
+class RouteLimits:
+    """bounds the requests each route handles at once, refusing the rest rather than queueing them"""
+
+    def __init__(self, limit: int):
+        self.limit: int = limit
+        self._in_flight: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self, route: str):
+        """counts a request in, returning False without counting it when the route is at its limit"""
+        with self._lock:
+            in_flight = self._in_flight.get(route, 0)
+            if in_flight >= self.limit:
+                return False
+            self._in_flight[route] = in_flight + 1
+            return True
+
+    def leave(self, route: str):
+        with self._lock:
+            self._in_flight[route] -= 1
+
+    def in_flight(self):
+        with self._lock:
+            return sum(self._in_flight.values())
+
+class Admission:
+    """decides whether to serve a write request before any work is done on it
+
+    Each client and each customer has a token bucket, and each route a bound on the requests it handles at once.
+    Requests over them are refused with a 429 or 503 and a Retry-After, so a flood from one integration is
+    turned away cheaply instead of queueing ahead of everyone else. A rate or limit of 0 turns that check off.
+    """
+
+    def __init__(self, client_rate: float = 0.0, client_burst: float = DEFAULT_BURST, customer_rate: float = 0.0,
+                 customer_burst: float = DEFAULT_BURST, route_concurrency: int = 0):
+        self.clients: TokenBuckets | None = TokenBuckets(client_rate, client_burst) if client_rate > 0 else None
+        self.customers: TokenBuckets | None = \
+            TokenBuckets(customer_rate, customer_burst) if customer_rate > 0 else None
+        self.routes: RouteLimits | None = RouteLimits(route_concurrency) if route_concurrency > 0 else None
+
+    def admit(self, client: str, route: str):
+        """admits a client's request to a route, the caller has to leave() the route once it is handled
+
+        Raises:
+            e: RateLimited(HTTPStatus.TOO_MANY_REQUESTS/429) when the client is over its rate, or
+            RouteBusy(HTTPStatus.SERVICE_UNAVAILABLE/503) when the route is at its limit
+        """
+        if self.clients is not None:
+            wait = self.clients.take(client)
+            if wait:
+                raise RateLimited(f"Client {client} is sending requests too fast", wait, "client_rate")
+        if self.routes is not None and not self.routes.enter(route):
+            raise RouteBusy(route)
+
+    def leave(self, route: str):
+        if self.routes is not None:
+            self.routes.leave(route)
+
+    def in_flight(self):
+        """write requests being handled on routes with a limit"""
+        return 0 if self.routes is None else self.routes.in_flight()
+
+    def admit_customer(self, customer_id: str):
+        """admits a request for a customer, once the customer_id is known from its body
+
+        Raises:
+            e: RateLimited(HTTPStatus.TOO_MANY_REQUESTS/429) when the customer is over its rate
+        """
+        if self.customers is not None:
+            wait = self.customers.take(customer_id)
+            if wait:
+                raise RateLimited(f"Too many requests for customer: {customer_id}", wait, "customer_rate")
@@ -0,0 +1,199 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+from api.export import EXPORT_PAGE_SIZE, iter_pages
+from models.collections.journal import Journal, NULL_JOURNAL
+from models.collections.stores import CheckoutStore
+from storage.columnar import KeyTable
+
+# rows a new log has room for before its columns are first grown
+INITIAL_CAPACITY = 1024
+# reports cover this many days up to today when the request doesn't give from and to
+ANALYTICS_WINDOW_DAYS = 30
+# titles GET /api/analytics/top-titles reports when the request doesn't give a limit
+TOP_TITLES = 10
+# percentiles of loan length GET /api/analytics/loan-durations reports
+LOAN_PERCENTILES = (50, 90, 99)
+
+class _Columns:
+    """int32 columns of one kind of event, written under the log's lock
+
+    A full column is copied into one twice its size rather than resized in place, and rows are never written
+    twice, so the slices a snapshot holds stay valid while requests keep appending.
+    """
+
+    def __init__(self, names: tuple[str, ...], capacity: int):
+        self.size: int = 0
+        self.capacity: int = capacity
+        self.columns: dict[str, np.ndarray] = {name: np.empty(capacity, dtype=np.int32) for name in names}
+
+    def append(self, *values: int):
+        if self.size == self.capacity:
+            self.capacity *= 2
+            for name, column in self.columns.items():
+                grown = np.empty(self.capacity, dtype=np.int32)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        for column, value in zip(self.columns.values(), values):
+            column[self.size] = value
+        self.size += 1
+
+    def snapshot(self):
+        return {name: column[:self.size] for name, column in self.columns.items()}
+
+class History:
+    """the events of a log as they were when it was read, isbns are keys into isbns and dates are ordinal days"""
+
+    def __init__(self, isbns: KeyTable, checkouts: dict[str, np.ndarray], returns: dict[str, np.ndarray]):
+        # the table keeps growing after the snapshot, its keys past key_count aren't in these columns
+        self.isbns: KeyTable = isbns
+        self.key_count: int = len(isbns)
+        self.checkout_isbn: np.ndarray = checkouts["isbn"]
+        self.checkout_day: np.ndarray = checkouts["day"]
+        self.checkout_due: np.ndarray = checkouts["due"]
+        self.return_isbn: np.ndarray = returns["isbn"]
+        self.return_day: np.ndarray = returns["day"]
+        self.return_start: np.ndarray = returns["start"]
+        self.return_due: np.ndarray = returns["due"]
+
+    def isbn(self, key: int):
+        return self.isbns.keys[key]
+
+    def key(self, isbn: str):
+        """key of the isbn, or None when it has no events"""
+        key = self.isbns.ids.get(isbn)
+        return key if key is not None and key < self.key_count else None
+
+    def keys(self, isbns: list[str]):
+        """keys of the isbns that have events, isbns the log has never seen have none to match"""
+        return np.array([key for key in map(self.key, isbns) if key is not None], dtype=np.int32)
+
+    def value(self, values: np.ndarray, isbn: str):
+        """the isbn's entry of an array indexed by key, 0 when it has no events"""
+        key = self.key(isbn)
+        return 0 if key is None else int(values[key])
+
+    def ranked(self, values: np.ndarray, limit: int):
+        """up to limit isbns with the largest positive values of an array indexed by key, ties in key order
+
+        Returns:
+            list[tuple[str, int]]: isbns with their values, the largest first
+        """
+        candidates = np.argpartition(-values, limit - 1)[:limit] if limit < len(values) else np.arange(len(values))
+        ranked = candidates[np.lexsort((candidates, -values[candidates]))]
+        return [(self.isbn(key), int(values[key])) for key in ranked if values[key] > 0]
+
+class CirculationLog:
+    """append only history of checkouts and returns, kept as typed columns so reports are whole column operations
+
+    The stores forget a checkout once it's returned. Here each checkout appends its book and its checkout and
+    due days, and each return appends its own day along with the checkout and due days of the loan it ended,
+    so reports never pair returns with checkouts. The history is kept in memory. A journal, such as the
+    write-ahead log, brings it back after a restart, otherwise load() starts it from the loans that are out.
+    Every change is made inside a journaled mutation while holding the lock.
+    """
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY, journal: Journal | None = None):
+        self._capacity: int = capacity
+        self._lock = threading.Lock()
+        self._journal: Journal = journal or NULL_JOURNAL
+        self._clear()
+
+    def _clear(self):
+        self._isbns: KeyTable = KeyTable()
+        self._checkouts: _Columns = _Columns(("isbn", "day", "due"), self._capacity)
+        self._returns: _Columns = _Columns(("isbn", "day", "start", "due"), self._capacity)
+
+    def _key(self, isbn: str):
+        key = self._isbns.ids.get(isbn)
+        return self._isbns.add(isbn) if key is None else key
+
+    def checked_out(self, isbn: str, checkout_date: date, due_date: date):
+        fields = {"isbn": isbn, "checkout_date": checkout_date.isoformat(), "due_date": due_date.isoformat()}
+        with self._journal.mutation("log_checkout", fields), self._lock:
+            self._checkouts.append(self._key(isbn), checkout_date.toordinal(), due_date.toordinal())
+
+    def returned(self, isbn: str, checkout_date: date, due_date: date, return_date: date):
+        fields = {"isbn": isbn, "checkout_date": checkout_date.isoformat(), "due_date": due_date.isoformat(),
+                  "return_date": return_date.isoformat()}
+        with self._journal.mutation("log_return", fields), self._lock:
+            self._returns.append(self._key(isbn), return_date.toordinal(), checkout_date.toordinal(),
+                                 due_date.toordinal())
+
+    def load(self, checkouts: CheckoutStore, page_size: int = EXPORT_PAGE_SIZE):
+        """logs the checkout of every active loan, so loans made before the log started can be returned into it"""
+        for checkout in iter_pages(checkouts.page_checkouts, page_size):
+            self.checked_out(checkout.isbn, checkout.checkout_date, checkout.due_date)
+
+    def reset(self):
+        with self._journal.mutation("reset_circulation", {}), self._lock:
+            self._clear()
+
+    def snapshot(self):
+        with self._lock:
+            return History(self._isbns, self._checkouts.snapshot(), self._returns.snapshot())
+
+def _matching(column: np.ndarray, keys: np.ndarray | None):
+    return np.ones(len(column), dtype=bool) if keys is None else np.isin(column, keys)
+
+def top_titles(history: History, start: date, end: date, limit: int):
+    """the books checked out most between start and end, both included
+
+    Returns:
+        list[tuple[str, int]]: up to limit isbns with their checkouts, the most first
+    """
+    in_window = (history.checkout_day >= start.toordinal()) & (history.checkout_day <= end.toordinal())
+    return history.ranked(np.bincount(history.checkout_isbn[in_window], minlength=history.key_count), limit)
+
+def loan_days(history: History, start: date, end: date):
+    """days each book was out on loan between start and end, both included, a loan counting its checkout day
+    through its return day and loans still out counting through end
+
+    A loan is [checkout, infinity) less [return + 1, infinity), so the days of the checkouts in the window less
+    the days of the returns are the days on loan, without finding which checkout each return ended.
+
+    Returns:
+        np.ndarray: copy days indexed by isbn key
+    """
+    first, after = start.toordinal(), end.toordinal() + 1
+    out = np.clip(after - np.maximum(history.checkout_day, first), 0, None)
+    back = np.clip(after - np.maximum(history.return_day + 1, first), 0, None)
+    days = (np.bincount(history.checkout_isbn, out, history.key_count) -
+            np.bincount(history.return_isbn, back, history.key_count))
+    return days.astype(np.int64)
+
+def loan_durations(history: History, start: date, end: date, keys: np.ndarray | None = None):
+    """length in days of the loans returned between start and end, both included, of the books with keys or of
+    every book
+
+    Returns:
+        dict: number of returns, mean days and LOAN_PERCENTILES, the statistics are None without returns
+    """
+    returned = ((history.return_day >= start.toordinal()) & (history.return_day <= end.toordinal()) &
+                _matching(history.return_isbn, keys))
+    days = history.return_day[returned] - history.return_start[returned]
+    if not len(days):
+        return {"returns": 0, "mean_days": None, "percentiles": {str(p): None for p in LOAN_PERCENTILES}}
+    percentiles = np.percentile(days, LOAN_PERCENTILES)
+    return {"returns": len(days), "mean_days": float(days.mean()),
+            "percentiles": {str(p): float(value) for p, value in zip(LOAN_PERCENTILES, percentiles)}}
+
+def overdue_loans(history: History, start: date, end: date, keys: np.ndarray | None = None):
+    """what became of the loans due between start and end, both included, of the books with keys or of every book
+
+    Loans still out are counted as every checkout due in the window less every return of one, end should be
+    before today so they are all overdue.
+
+    Returns:
+        dict: loans due, returned on time, returned late and still out
+    """
+    first, last = start.toordinal(), end.toordinal()
+    due = int(np.count_nonzero((history.checkout_due >= first) & (history.checkout_due <= last) &
+                               _matching(history.checkout_isbn, keys)))
+    returned = ((history.return_due >= first) & (history.return_due <= last) &
+                _matching(history.return_isbn, keys))
+    late = int(np.count_nonzero(returned & (history.return_day > history.return_due)))
+    on_time = int(np.count_nonzero(returned)) - late
+    return {"due": due, "returned_on_time": on_time, "returned_late": late, "outstanding": due - on_time - late}
@@ -0,0 +1,308 @@
+import asyncio
+import concurrent.futures
+import io
+import sys
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+# threads running requests at once, further requests wait on the event loop rather than in a thread
+ASGI_WORKERS = 32
+# largest request body the app can read, a larger Content-Length is answered with a 413 before the app runs and
+# reading past it raises a 413 in the app. Paths that read their body a record at a time have no limit
+MAX_BODY_SIZE = 16 * 2 ** 20
+# request bodies up to this are received on the loop before the app runs, the rest of longer ones as it reads them
+BODY_BUFFER_SIZE = 64 * 2 ** 10
+
+type Scope = dict[str, Any]
+type Receive = Callable[[], Any]
+type Send = Callable[[dict], Any]
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input of a request, read by the app on a worker thread
+
+    Starts with the chunks received before the app ran, then receives the rest from the loop as the app reads
+    it, so a long upload is never held in memory whole.
+    """
+
+    def __init__(self, received: bytes, more_body: bool, receive: Receive, loop: asyncio.AbstractEventLoop,
+                 max_size: int | None):
+        super().__init__()
+        self._buffer: bytearray = bytearray(received)
+        self._more_body: bool = more_body
+        self._receive: Receive = receive
+        self._loop: asyncio.AbstractEventLoop = loop
+        # None when the body can be any length
+        self._left: int | None = None if max_size is None else max_size - len(received)
+
+    def readable(self):
+        return True
+
+    async def _next_message(self):
+        return await self._receive()
+
+    def _receive_chunk(self):
+        message = asyncio.run_coroutine_threadsafe(self._next_message(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self._more_body = False
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        if self._left is not None:
+            self._left -= len(chunk)
+            if self._left < 0:
+                self._more_body = False
+                raise RequestEntityTooLarge()
+        self._buffer += chunk
+        self._more_body = message.get("more_body", False)
+
+    def readinto(self, buffer):
+        while not self._buffer and self._more_body:
+            self._receive_chunk()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+class ThreadedBody:
+    """the iterable body of a WSGI response, iterated asynchronously by taking each chunk on a worker thread
+
+    Streamed bodies such as the export call the stores as they go, so only the loop waits for each chunk.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, result: Iterable[bytes], chunks: Iterator[bytes], first: bytes):
+        self.executor: ThreadPoolExecutor = executor
+        self._result: Iterable[bytes] = result
+        self._chunks: Iterator[bytes] = chunks
+        self._first: bytes | None = first
+        self._pending: concurrent.futures.Future | None = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._first is not None:
+            chunk, self._first = self._first, None
+            return chunk
+        self._pending = self.executor.submit(next, self._chunks, None)
+        chunk = await asyncio.wrap_future(self._pending)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def _close(self):
+        # a chunk given up on when the client went away can still be running, the body can't close until it's done
+        if self._pending is not None:
+            concurrent.futures.wait((self._pending,))
+        if hasattr(self._result, "close"):
+            self._result.close()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._close)
+
+class ASGIAdapter:
+    """serves a WSGI app such as the Flask app over ASGI, so connections live on an event loop
+
+    Connections are handled on the loop, so idle keep-alive clients don't hold a thread. Running the app, which
+    calls the blocking storage backends, goes to a bounded pool of threads. Request bodies up to buffer_size are
+    received on the loop first, longer ones are received as the app reads them. Response bodies are sent a chunk
+    at a time, the chunks of iterable bodies taken on a worker thread. Error handling and validation are the
+    app's own, every route behaves as it does under `flask run`.
+    """
+
+    def __init__(self, wsgi_app: Callable, workers: int = ASGI_WORKERS, max_body_size: int = MAX_BODY_SIZE,
+                 buffer_size: int = BODY_BUFFER_SIZE, streamed_paths: Iterable[str] = ()):
+        """
+        Args:
+            streamed_paths (Iterable[str], optional): paths whose handlers read the body a record at a time
+            rather than whole, such as imports, which max_body_size doesn't apply to. Defaults to ().
+        """
+        self.wsgi_app: Callable = wsgi_app
+        self.max_body_size: int = max_body_size
+        self.streamed_paths: frozenset[str] = frozenset(streamed_paths)
+        self.buffer_size: int = buffer_size
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asgi")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        match scope["type"]:
+            case "http":
+                await self._http(scope, receive, send)
+            case "lifespan":
+                await self._lifespan(receive, send)
+            case other:
+                raise ValueError(f"ASGI scope type {other} is not supported")
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _receive_start(self, receive: Receive):
+        """the start of the request body, up to buffer_size or all of it if it is shorter, and whether more of
+        it is to come. None when the client went away before sending it"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+            if not more_body or size >= self.buffer_size:
+                return b"".join(chunks), more_body
+
+    async def _http(self, scope: Scope, receive: Receive, send: Send):
+        content_length = _content_length(scope)
+        max_size = None if scope["path"] in self.streamed_paths else self.max_body_size
+        if content_length is not None and max_size is not None and content_length > max_size:
+            status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+            await _send_response(send, status, [(b"content-type", b"text/plain")], status.phrase.encode())
+            return
+        start = await self._receive_start(receive)
+        if start is None:
+            return
+        received, more_body = start
+
+        loop = asyncio.get_running_loop()
+        body = io.BufferedReader(RequestBody(received, more_body, receive, loop, max_size))
+        if not more_body:
+            content_length = len(received)
+        wsgi_environ = environ(scope, body, content_length)
+        status, headers, content = await loop.run_in_executor(self.executor, self._run, wsgi_environ)
+        if isinstance(content, bytes):
+            await _send_response(send, status, headers, content)
+        else:
+            await self._stream(receive, send, status, headers, content)
+
+    async def _stream(self, receive: Receive, send: Send, status: int, headers: list[tuple[bytes, bytes]],
+                      body: Any):
+        """sends an asynchronously iterable body a chunk at a time until it ends or the client goes away"""
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        chunks = aiter(body)
+        chunk: asyncio.Future | None = None
+        try:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            while True:
+                chunk = asyncio.ensure_future(anext(chunks))
+                await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    return
+                try:
+                    content = chunk.result()
+                except StopAsyncIteration:
+                    break
+                await send({"type": "http.response.body", "body": content, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            if chunk is not None and not chunk.done():
+                chunk.cancel()
+                # the body can only be closed once it has stopped running
+                await asyncio.wait((chunk,))
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            if hasattr(body, "close"):
+                body.close()
+
+    def _run(self, wsgi_environ: dict):
+        """runs the app on a worker thread and takes the first chunk of its body there too
+
+        Bodies that can be iterated asynchronously, such as the availability stream, are returned as they are
+        for the loop to send, so a long lived response doesn't hold the thread. A body whose first chunk is as
+        long as its Content-Length is complete and returned as bytes, which most responses are. Other bodies are
+        returned as a ThreadedBody for the loop to send as each chunk is made.
+        """
+        started: list = []
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+
+        result = self.wsgi_app(wsgi_environ, start_response)
+        if hasattr(result, "__aiter__"):
+            content = result
+        else:
+            complete = True
+            try:
+                chunks = iter(result)
+                # the app can start the response when it makes its first chunk
+                first = next(chunks, None)
+                length = next((value for name, value in started[1] if name.lower() == "content-length"), None)
+                if first is None:
+                    content = b""
+                elif length is not None and int(length) == len(first):
+                    content = first
+                else:
+                    content = ThreadedBody(self.executor, result, chunks, first)
+                    complete = False
+            finally:
+                if complete and hasattr(result, "close"):
+                    result.close()
+
+        status, headers = started
+        return (int(status.split(" ", 1)[0]),
+                [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers], content)
+
+async def _wait_for_disconnect(receive: Receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+def _content_length(scope: Scope):
+    """the Content-Length the client sent, None when it sent none or one that isn't a number"""
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"content-length":
+            return int(value) if value.isdigit() else None
+    return None
+
+async def _send_response(send: Send, status: int, headers: list[tuple[bytes, bytes]], content: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+def environ(scope: Scope, body: io.BufferedIOBase, content_length: int | None):
+    """the WSGI environ of an ASGI http scope, as PEP 3333 lays it out
+
+    wsgi.input ends with the request body whether or not content_length is known, which wsgi.input_terminated
+    tells the app.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    wsgi_environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    if content_length is not None:
+        wsgi_environ["CONTENT_LENGTH"] = str(content_length)
+    if scope.get("client"):
+        wsgi_environ["REMOTE_ADDR"], wsgi_environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        # repeated headers are joined the way a WSGI server joins them
+        wsgi_environ[key] = f"{wsgi_environ[key]},{value}" if key in wsgi_environ else value
+    return wsgi_environ
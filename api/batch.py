@@ -0,0 +1,48 @@
+from http import HTTPStatus
+
+from werkzeug.exceptions import HTTPException
+
+from api.schema import ValidationError
+
+# largest number of items accepted in a single batch request
+MAX_BATCH_SIZE = 100
+
+class BatchResults:
+    """per item results of a batch request, a batch is only applied when no item failed"""
+
+    def __init__(self, size: int):
+        self.results: list[dict | None] = [None] * size
+        self.code: int | None = None
+
+    @property
+    def failed(self):
+        return self.code is not None
+
+    def fail(self, index: int, e: HTTPException):
+        self.results[index] = {"status": e.code, "error": e.description}
+        if isinstance(e, ValidationError):
+            self.results[index]["errors"] = e.errors
+
+        # a bad item in the request is reported before a conflict with the library state
+        if self.code is None or e.code == HTTPStatus.BAD_REQUEST:
+            self.code = e.code
+
+    def succeed(self, index: int, status: int, response: dict):
+        self.results[index] = {"status": status, "result": response}
+
+    def get_status(self, success_status: int):
+        return self.code if self.failed else success_status
+
+    def get_response(self):
+        results = self.results
+        if self.failed:
+            # items that passed their own checks were still not applied
+            results = [result if result is not None and "error" in result else
+                       {"status": HTTPStatus.FAILED_DEPENDENCY,
+                        "error": "Not applied, another item in the batch failed"}
+                       for result in results]
+
+        return {
+            "applied": 0 if self.failed else len(results),
+            "results": results
+        }
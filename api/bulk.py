@@ -0,0 +1,215 @@
+import codecs
+import json
+import re
+from collections.abc import Callable, Iterator
+from typing import Any, IO
+
+from werkzeug.exceptions import HTTPException
+
+# sizes are in bytes, batches in records
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 1024 * 1024
+BULK_BATCH_SIZE = 1000
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = b" \t\r\n"
+_NON_WHITESPACE = re.compile(r"[^ \t\r\n]|$")
+
+class RecordError(Exception):
+    pass
+
+class BulkSummary:
+    # only the first errors are kept so the summary stays small for bad uploads
+    MAX_ERRORS = 100
+
+    def __init__(self):
+        self.received: int = 0
+        self.applied: int = 0
+        self.failed: int = 0
+        self.errors: list[dict] = []
+
+    def add_error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < BulkSummary.MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def get_response(self):
+        return {
+            "received": self.received,
+            "applied": self.applied,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+def _iter_ndjson(stream: IO[bytes], head: bytes) -> Iterator[tuple[int, Any]]:
+    """yields one decoded record per non-blank line of an NDJSON body
+
+    Args:
+        stream (IO[bytes]): request body positioned after `head`
+        head (bytes): bytes already consumed from the stream while sniffing the format
+
+    Yields:
+        tuple[int, Any]: line number and decoded record, or a RecordError in place of the record
+    """
+    line_no = 0
+    pending = head
+    while True:
+        newline = pending.find(b"\n")
+        if newline < 0 and len(pending) <= MAX_RECORD_SIZE:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            if chunk:
+                pending += chunk
+                continue
+        if newline < 0 and not pending:
+            return
+
+        line_no += 1
+        if newline < 0 and len(pending) > MAX_RECORD_SIZE:
+            # drop the rest of an oversized line without buffering it
+            while newline < 0:
+                pending = stream.read(READ_CHUNK_SIZE)
+                if not pending:
+                    break
+                newline = pending.find(b"\n")
+            pending = pending[newline + 1:] if newline >= 0 else b""
+            yield line_no, RecordError(f"record larger than {MAX_RECORD_SIZE} bytes")
+            continue
+
+        line, pending = (pending, b"") if newline < 0 else (pending[:newline], pending[newline + 1:])
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, RecordError(f"invalid JSON: {e}")
+
+def _iter_json_array(stream: IO[bytes], head: bytes) -> Iterator[tuple[int, Any]]:
+    """yields the elements of a top level JSON array one at a time without decoding the whole body
+
+    Args:
+        stream (IO[bytes]): request body positioned after `head`
+        head (bytes): bytes already consumed from the stream, starting at the opening `[`
+
+    Yields:
+        tuple[int, Any]: element number and decoded element, or a RecordError in place of the element
+    """
+    # incremental decoder keeps multi-byte characters that are split across chunks
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = decoder.decode(head[1:])
+    pos = 0
+    eof = False
+    element = 0
+    expect_value = True
+
+    def fill():
+        nonlocal text, pos, eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        text = text[pos:] + decoder.decode(chunk, final=eof)
+        pos = 0
+
+    while True:
+        pos = _NON_WHITESPACE.search(text, pos).start()
+        if pos == len(text):
+            if eof:
+                yield element + 1, RecordError("unexpected end of array")
+                return
+            fill()
+            continue
+
+        char = text[pos]
+        if char == "]" and (not expect_value or element == 0):
+            return
+        if not expect_value:
+            if char != ",":
+                yield element + 1, RecordError(f"expected ',' or ']' but found {char!r}")
+                return
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            value, end = _decoder.raw_decode(text, pos)
+            # a bare number may decode early when it is cut off at the end of the buffer
+            cut_off = end == len(text) and not eof
+        except ValueError as e:
+            # the element may just be cut off at the end of the buffer
+            if not eof and len(text) - pos <= MAX_RECORD_SIZE:
+                fill()
+                continue
+            yield element + 1, RecordError(f"invalid JSON: {e}")
+            return
+
+        if cut_off:
+            fill()
+            continue
+
+        pos = end
+        element += 1
+        expect_value = False
+        yield element, value
+
+def iter_records(stream: IO[bytes]) -> Iterator[tuple[int, Any]]:
+    """sniffs whether the body is a JSON array or NDJSON and yields its records one at a time
+
+    Args:
+        stream (IO[bytes]): request body
+
+    Yields:
+        tuple[int, Any]: record number and decoded record, or a RecordError in place of the record
+    """
+    head = b""
+    while not head.lstrip(_WHITESPACE):
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        head += chunk
+
+    head = head.lstrip(_WHITESPACE)
+    if head.startswith(b"["):
+        yield from _iter_json_array(stream, head)
+    else:
+        yield from _iter_ndjson(stream, head)
+
+def bulk_import(stream: IO[bytes],
+                validate: Callable[[Any], dict],
+                apply_batch: Callable[[list[dict]], None],
+                batch_size: int = BULK_BATCH_SIZE):
+    """validates records from a streamed body and applies them in batches, only holding a single batch
+    of records in memory at a time
+
+    Args:
+        stream (IO[bytes]): request body as NDJSON or a JSON array
+        validate (Callable[[Any], dict]): turns a raw record into sanitized attributes, raising HTTPException when invalid
+        apply_batch (Callable[[list[dict]], None]): applies a list of sanitized records
+        batch_size (int, optional): number of records applied at once. Defaults to BULK_BATCH_SIZE.
+
+    Returns:
+        BulkSummary: counts of received, applied, and failed records with the first errors
+    """
+    summary = BulkSummary()
+    batch: list[dict] = []
+
+    for line, record in iter_records(stream):
+        summary.received += 1
+        if isinstance(record, RecordError):
+            summary.add_error(line, str(record))
+            continue
+
+        try:
+            batch.append(validate(record))
+        except HTTPException as e:
+            summary.add_error(line, e.description)
+            continue
+
+        if len(batch) >= batch_size:
+            apply_batch(batch)
+            summary.applied += len(batch)
+            batch = []
+
+    if batch:
+        apply_batch(batch)
+        summary.applied += len(batch)
+
+    return summary
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from collections.abc import Callable, Iterable
+
+from flask import json
+
+# books one stream can watch, which also bounds what a subscriber has buffered
+MAX_STREAM_ISBNS = 100
+# seconds between comments sent on a quiet stream, so proxies and clients don't time it out
+HEARTBEAT_INTERVAL = 15.0
+
+class Subscription:
+    """availability changes waiting to be sent to one stream
+
+    Changes are kept per isbn, a newer one replaces the one not sent yet, so a slow consumer gets the latest
+    value of each book rather than every step and its buffer never grows past the books it watches.
+    """
+
+    def __init__(self, isbns: Iterable[str]):
+        self.isbns: tuple[str, ...] = tuple(dict.fromkeys(isbns))
+        self._pending: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # set while the stream waits on an event loop, wakes the loop from the publishing thread
+        self._wake: Callable[[], None] | None = None
+
+    def offer(self, isbn: str, available_copies: int):
+        """buffers a change, never blocking the request that made it"""
+        with self._lock:
+            self._pending[isbn] = available_copies
+            self._ready.set()
+            wake = self._wake
+        if wake is not None:
+            try:
+                wake()
+            except RuntimeError:
+                # the stream's loop closed while it waited, there is no one left to wake
+                pass
+
+    def take(self):
+        """the latest change of each book buffered since the last take"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._ready.clear()
+        return pending
+
+    def wait(self, timeout: float):
+        """waits on this thread for changes, returning an empty dict when timeout passes first"""
+        self._ready.wait(timeout)
+        return self.take()
+
+    async def wait_async(self, timeout: float):
+        """waits on the event loop for changes, returning an empty dict when timeout passes first"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        with self._lock:
+            if self._pending:
+                ready.set()
+            self._wake = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except TimeoutError:
+            pass
+        finally:
+            self._wake = None
+        return self.take()
+
+class AvailabilityHub:
+    """fans the available copies of books out to the streams watching them"""
+
+    def __init__(self):
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, isbns: Iterable[str]):
+        subscription = Subscription(isbns)
+        with self._lock:
+            for isbn in subscription.isbns:
+                self._subscribers.setdefault(isbn, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for isbn in subscription.isbns:
+                subscribers = self._subscribers.get(isbn)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[isbn]
+
+    def watched(self, isbn: str):
+        """whether any stream watches the isbn, read without the lock so unwatched books cost a lookup"""
+        return isbn in self._subscribers
+
+    def count(self):
+        """streams open, a stream watching several books is counted once"""
+        with self._lock:
+            return len({subscription for subscribers in self._subscribers.values() for subscription in subscribers})
+
+    def publish(self, isbn: str, available_copies: int):
+        if not self.watched(isbn):
+            return
+        with self._lock:
+            subscribers = tuple(self._subscribers.get(isbn, ()))
+        for subscription in subscribers:
+            subscription.offer(isbn, available_copies)
+
+class AvailabilityStream:
+    """Server-Sent Events body of a subscription, starting with the current availability of its books
+
+    Servers that iterate it normally wait for changes on their thread. It can also be iterated asynchronously,
+    which api/asgi.py does so open streams wait on the event loop instead of holding a thread each.
+    """
+
+    def __init__(self, hub: AvailabilityHub, subscription: Subscription, current: dict[str, int],
+                 heartbeat: float = HEARTBEAT_INTERVAL):
+        self.hub: AvailabilityHub = hub
+        self.subscription: Subscription = subscription
+        self.current: dict[str, int] = current
+        self.heartbeat: float = heartbeat
+
+    def __iter__(self):
+        yield _events(self.current)
+        while True:
+            changes = self.subscription.wait(self.heartbeat)
+            yield _events(changes) if changes else b": keep-alive\n\n"
+
+    async def __aiter__(self):
+        yield _events(self.current)
+        while True:
+            changes = await self.subscription.wait_async(self.heartbeat)
+            yield _events(changes) if changes else b": keep-alive\n\n"
+
+    def close(self):
+        self.hub.unsubscribe(self.subscription)
+
+def _events(changes: dict[str, int]):
+    return b"".join(b"event: availability\ndata: " +
+                    json.dumps({"isbn": isbn, "available_copies": available_copies}).encode() + b"\n\n"
+                    for isbn, available_copies in changes.items())
@@ -0,0 +1,333 @@
+import threading
+from collections.abc import Callable, Iterator
+from datetime import date, datetime
+from itertools import batched
+from typing import Any, IO
+
+from flask import json
+from werkzeug.exceptions import HTTPException
+
+from api.bulk import BULK_BATCH_SIZE, BulkSummary, RecordError, iter_records
+from api.schema import Schema, ValidationError
+from models.collections.holds import Holds, HOLD_ID_PREFIX
+from models.collections.stores import BookStore, CustomerStore, CheckoutStore, Position
+from models.objects import AttributeList, Book, Customer, Checkout, Hold, identity
+
+# bump when records change in a way older imports can't read
+EXPORT_VERSION = 2
+# versions this import still reads, version 1 exports had no holds
+IMPORT_VERSIONS = (1, 2)
+# books, customers or checkouts read from a store at a time while exporting
+EXPORT_PAGE_SIZE = 1000
+
+BOOK_SCHEMA = Schema(Book.REQUIRED_ATTRIBUTES)
+CUSTOMER_SCHEMA = Schema(Customer.REQUIRED_ATTRIBUTES)
+# unlike a new checkout, an exported one can be overdue
+CHECKOUT_ATTRIBUTES: AttributeList = [("checkout_id", str, identity, bool),
+                                      ("isbn", str, identity, bool),
+                                      ("customer_id", str, identity, bool),
+                                      ("checkout_date", str, date.fromisoformat, lambda x: True),
+                                      ("due_date", str, date.fromisoformat, lambda x: True)]
+CHECKOUT_SCHEMA = Schema(CHECKOUT_ATTRIBUTES)
+RETURN_SCHEMA = Schema([("isbn", str, identity, bool), ("customer_id", str, identity, bool)])
+HOLD_SCHEMA = Schema([("hold_id", str, identity, bool),
+                      ("isbn", str, identity, bool),
+                      ("customer_id", str, identity, bool),
+                      ("placed_at", str, datetime.fromisoformat, lambda x: True)])
+HOLD_READY_SCHEMA = Schema([("hold_id", str, identity, bool),
+                            ("expires_at", str, datetime.fromisoformat, lambda x: True)])
+HOLD_REMOVED_SCHEMA = Schema([("hold_id", str, identity, bool)])
+
+def book_record(book: Book):
+    return {"type": "book", "title": book.title, "author": book.author, "isbn": book.isbn, "copies": book.copies}
+
+def customer_record(customer: Customer):
+    return {"type": "customer", "name": customer.name, "email": customer.email, "customer_id": customer.customer_id}
+
+def checkout_record(checkout: Checkout):
+    return {"type": "checkout", **checkout.get_record()}
+
+def return_record(isbn: str, customer_id: str):
+    return {"type": "return", "isbn": isbn, "customer_id": customer_id}
+
+def hold_record(hold: Hold):
+    return {"type": "hold", **hold.get_record()}
+
+def hold_ready_record(hold: Hold):
+    return {"type": "hold_ready", "hold_id": hold.hold_id, "expires_at": hold.expires_at.isoformat()}
+
+def hold_removed_record(hold: Hold):
+    return {"type": "hold_removed", "hold_id": hold.hold_id}
+
+class ChangeLog:
+    """changes made while one export reads the stores, in the order they were made"""
+
+    def __init__(self):
+        self._records: list[dict] = []
+        self._lock = threading.Lock()
+
+    def append(self, record: dict):
+        with self._lock:
+            self._records.append(record)
+
+    def take(self):
+        with self._lock:
+            records, self._records = self._records, []
+        return records
+
+class Exports:
+    """hands the changes requests make to the exports running at the time
+
+    Handlers record each change after making it, holding the locks of the books and customers it touched, so
+    the changes to each of them are logged in order. Nothing is recorded, or even built, while no export runs.
+    """
+
+    def __init__(self):
+        self._logs: set[ChangeLog] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._logs)
+
+    def open(self):
+        log = ChangeLog()
+        with self._lock:
+            self._logs.add(log)
+        return log
+
+    def close(self, log: ChangeLog):
+        """stops logging changes for an export, returning the ones it hasn't taken yet"""
+        with self._lock:
+            self._logs.discard(log)
+        return log.take()
+
+    def record(self, record: dict):
+        with self._lock:
+            logs = tuple(self._logs)
+        for log in logs:
+            log.append(record)
+
+def iter_pages(page: Callable[[Position | None, int], Iterator[tuple[Position, Any]]], page_size: int):
+    """the items of a store, read a page of page_size at a time"""
+    after = None
+    while True:
+        items = list(page(after, page_size))
+        # a page can come back short when items on it were removed while it was read, only an empty one is the end
+        if not items:
+            return
+        yield from (item for _, item in items)
+        after = items[-1][0]
+
+def export_records(exports: Exports, library: BookStore, customers: CustomerStore, checkouts: CheckoutStore,
+                   holds: Holds, page_size: int = EXPORT_PAGE_SIZE):
+    """the whole library as NDJSON lines, encoded a page of each store at a time
+
+    The stores are read without locks while requests keep changing them, and every change made meanwhile is
+    logged and added after them. Imports apply records in order with the last record of a book, customer,
+    checkout or hold winning, so what they restore is the library as it was when the log was closed. The caller
+    keeps imports out while the records are read, then sends them once imports can run again, so a slow
+    client never holds up an import.
+
+    Returns:
+        list[bytes]: chunks of lines, a header first and an end record last
+    """
+    log = exports.open()
+    try:
+        chunks = [_line({"type": "export", "version": EXPORT_VERSION, "exported_at": datetime.now().isoformat()})]
+        for items, record in ((iter_pages(library.page_books, page_size), book_record),
+                              (iter_pages(customers.page_customers, page_size), customer_record),
+                              (iter_pages(checkouts.page_checkouts, page_size), checkout_record)):
+            chunks += [b"".join(_line(record(item)) for item in page) for page in batched(items, page_size)]
+        # holds are few next to the other records, so they're copied at once rather than paged
+        for hold in holds.get_holds():
+            chunks.append(_line(hold_record(hold)))
+            if hold.expires_at is not None:
+                chunks.append(_line(hold_ready_record(hold)))
+    finally:
+        changes = exports.close(log)
+    if changes:
+        chunks.append(b"".join(_line(record) for record in changes))
+    chunks.append(_line({"type": "end"}))
+    return chunks
+
+def _hold_number(record: dict):
+    number = record["hold_id"].removeprefix(HOLD_ID_PREFIX)
+    return int(number) if number.isdigit() else 0
+
+def _line(record: dict):
+    return json.dumps(record).encode() + b"\n"
+
+class StagedImport:
+    """the records of an export, read and validated before any store is touched
+
+    Later records of a book, customer, checkout or hold replace earlier ones as they are read, and a reset
+    drops what was read before it, so only the library as the export ended is kept. Reading the body doesn't
+    need any lock, the stores are only locked while apply() restores it.
+    """
+
+    def __init__(self, batch_size: int = BULK_BATCH_SIZE):
+        self.batch_size: int = batch_size
+        self.summary: BulkSummary = BulkSummary()
+        self.books: dict[str, dict] = {}
+        self.customers: dict[str, dict] = {}
+        # checkouts can name books and customers that come later in the log, so they're applied last.
+        # returns are by isbn and customer_id, like POST /api/returns
+        self.active: dict[tuple[str, str], tuple[int, dict]] = {}
+        # holds are placed after the checkouts, so the copies they set aside are the ones left over
+        self.holds: dict[str, tuple[int, dict]] = {}
+        self.ended: bool = False
+
+    def read(self, line: int, record: Any):
+        if not isinstance(record, dict):
+            raise RecordError("record is not an object")
+        record_type = record.get("type")
+        fields = {name: value for name, value in record.items() if name != "type"}
+        match record_type:
+            case "export":
+                if record.get("version") not in IMPORT_VERSIONS:
+                    raise RecordError(f"export version {record.get('version')} is not one of {IMPORT_VERSIONS}")
+            case "book":
+                book = BOOK_SCHEMA.validate(fields)
+                # copies only grow, so a later record of a book has at least the copies of an earlier one
+                self.books.pop(book["isbn"], None)
+                self.books[book["isbn"]] = book
+            case "customer":
+                customer = CUSTOMER_SCHEMA.validate(fields)
+                self.customers.pop(customer["customer_id"], None)
+                self.customers[customer["customer_id"]] = customer
+            case "checkout":
+                checkout = CHECKOUT_SCHEMA.validate(fields)
+                key = (checkout["isbn"], checkout["customer_id"])
+                self.active.pop(key, None)
+                self.active[key] = (line, checkout)
+            case "return":
+                returned = RETURN_SCHEMA.validate(fields)
+                self.active.pop((returned["isbn"], returned["customer_id"]), None)
+            case "hold":
+                hold = HOLD_SCHEMA.validate(fields)
+                hold["expires_at"] = None
+                self.holds.pop(hold["hold_id"], None)
+                self.holds[hold["hold_id"]] = (line, hold)
+            case "hold_ready":
+                ready = HOLD_READY_SCHEMA.validate(fields)
+                if ready["hold_id"] not in self.holds:
+                    raise RecordError(f"hold {ready['hold_id']} is not placed")
+                self.holds[ready["hold_id"]][1]["expires_at"] = ready["expires_at"]
+            case "hold_removed":
+                removed = HOLD_REMOVED_SCHEMA.validate(fields)
+                self.holds.pop(removed["hold_id"], None)
+            case "reset":
+                self.books.clear()
+                self.customers.clear()
+                self.active.clear()
+                self.holds.clear()
+            case "end":
+                self.ended = True
+            case _:
+                raise RecordError(f"type {record_type} is not book, customer, checkout, return, hold or reset")
+
+    def apply(self, library: BookStore, customers: CustomerStore, checkouts: CheckoutStore, holds: Holds):
+        """restores the records read into the stores, which the caller has emptied and keeps locked
+
+        Returns:
+            BulkSummary: counts of received, applied, and failed records with the first errors
+        """
+        books = list(self.books.values())
+        for start in range(0, len(books), self.batch_size):
+            library.add_books(books[start:start + self.batch_size])
+        new_customers = list(self.customers.values())
+        for start in range(0, len(new_customers), self.batch_size):
+            customers.add_customers(new_customers[start:start + self.batch_size])
+        self._add_checkouts(library, customers, checkouts)
+        self._add_holds(library, customers, holds)
+        return self.summary
+
+    def _add_checkouts(self, library: BookStore, customers: CustomerStore, checkouts: CheckoutStore):
+        items = list(self.active.values())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            new_checkouts = []
+            for line, record in batch:
+                try:
+                    new_checkouts.append((line, self._checkout(library, customers, record)))
+                except HTTPException as e:
+                    self.summary.add_error(line, e.description)
+            try:
+                checkouts.add_checkouts([checkout for _, checkout in new_checkouts])
+            except HTTPException:
+                # one of them was refused, add them one at a time to find which
+                for line, checkout in new_checkouts:
+                    try:
+                        checkouts.add_checkout(checkout)
+                    except HTTPException as e:
+                        self.summary.add_error(line, e.description)
+                        continue
+                    self._added(checkout)
+            else:
+                for _, checkout in new_checkouts:
+                    self._added(checkout)
+
+    def _add_holds(self, library: BookStore, customers: CustomerStore, holds: Holds):
+        # placed in the order they were first placed, so each isbn's queue comes back in the same order
+        items = sorted(self.holds.values(), key=lambda item: (item[1]["placed_at"], _hold_number(item[1])))
+        for line, record in items:
+            try:
+                book = library.get_book(record["isbn"])
+                customers.get_customer(record["customer_id"])
+            except HTTPException as e:
+                self.summary.add_error(line, e.description)
+                continue
+            if record["expires_at"] is not None and book.available_copies - holds.reserved(book.isbn) < 1:
+                self.summary.add_error(line, f"no copy of {book.isbn} is left for hold {record['hold_id']}")
+                continue
+            holds.place(record["isbn"], record["customer_id"], record["placed_at"], record["hold_id"])
+            if record["expires_at"] is not None:
+                holds.set_ready(record["hold_id"], record["expires_at"])
+            self.summary.applied += 1
+
+    @staticmethod
+    def _checkout(library: BookStore, customers: CustomerStore, record: dict):
+        book = library.get_book(record["isbn"])
+        customer = customers.get_customer(record["customer_id"])
+        return Checkout(book, customer, record["isbn"], record["customer_id"], record["due_date"],
+                        checkout_id=record["checkout_id"], checkout_date=record["checkout_date"])
+
+    def _added(self, checkout: Checkout):
+        self.summary.applied += 1
+        # new checkouts must not reuse the ids of restored ones
+        Checkout.ids.observe(checkout.checkout_id)
+
+def read_export(stream: IO[bytes], batch_size: int = BULK_BATCH_SIZE):
+    """reads and validates an NDJSON body as export_records writes it, without touching any store
+
+    Args:
+        stream (IO[bytes]): request body
+        batch_size (int, optional): books, customers or checkouts applied at once. Defaults to BULK_BATCH_SIZE.
+
+    Returns:
+        StagedImport: the records to apply, its summary already has the records that failed to read and an
+        export that doesn't end with its end record as an error
+    """
+    staged = StagedImport(batch_size)
+    summary = staged.summary
+    line = 0
+    for line, record in iter_records(stream):
+        summary.received += 1
+        if isinstance(record, RecordError):
+            summary.add_error(line, str(record))
+            continue
+        try:
+            staged.read(line, record)
+        except RecordError as e:
+            summary.add_error(line, str(e))
+            continue
+        except ValidationError as e:
+            summary.add_error(line, e.description)
+            continue
+        if record.get("type") in ("book", "customer"):
+            summary.applied += 1
+
+    if not staged.ended:
+        summary.add_error(line + 1, "export ended before its end record")
+    return staged
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from http import HTTPStatus
+
+from werkzeug.exceptions import HTTPException
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# responses kept, the least recently used is dropped past this
+IDEMPOTENCY_CACHE_SIZE = 10000
+# seconds a response is replayed for after it was made
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# seconds a retry waits for the request it duplicates to finish
+IDEMPOTENCY_WAIT = 30.0
+# longest key a client may send
+MAX_KEY_LENGTH = 255
+
+class Outcome:
+    """the response to a request made with an idempotency key, set once the first request with the key is handled"""
+
+    __slots__ = ("done", "status", "headers", "body", "expires_at")
+
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.status: int = 0
+        self.headers: list[tuple[str, str]] = []
+        self.body: bytes = b""
+        self.expires_at: float = 0.0
+
+class IdempotencyCache:
+    """responses to requests made with an idempotency key, so retries get the first response instead of
+    repeating the request
+
+    The first request with a key is handled as usual and its response stored. Retries made while it is being
+    handled wait for it rather than running alongside it. Responses are dropped after ttl seconds, and the least
+    recently used once there are more than max_entries. Keys of requests still being handled are never dropped,
+    so the cache can go over max_entries by the number of requests in flight.
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL,
+                 wait: float = IDEMPOTENCY_WAIT, clock: Callable[[], float] = time.monotonic):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.wait: float = wait
+        self.clock: Callable[[], float] = clock
+        self._outcomes: OrderedDict[str, Outcome] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key: str):
+        """finds the response to an earlier request with the key, or claims the key for this request
+
+        Raises:
+            e: HTTPException(HTTPStatus.CONFLICT/409) when the request with the key is still being handled after
+            waiting for it
+
+        Returns:
+            Outcome | None: the earlier response, or None when this request has to be handled and then given to
+            finish() or abandon()
+        """
+        deadline = self.clock() + self.wait
+        while True:
+            with self._lock:
+                outcome = self._outcomes.get(key)
+                if outcome is not None and outcome.done.is_set() and outcome.expires_at <= self.clock():
+                    del self._outcomes[key]
+                    outcome = None
+                if outcome is None:
+                    self._outcomes[key] = Outcome()
+                    self._evict()
+                    return None
+                self._outcomes.move_to_end(key)
+
+            if outcome.done.wait(max(0.0, deadline - self.clock())):
+                # abandoned outcomes are set too, but are no longer in the cache, so the retry claims the key
+                if outcome.status:
+                    return outcome
+                continue
+
+            e = HTTPException(f"A request with {IDEMPOTENCY_HEADER}: {key} is still being handled")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+    def finish(self, key: str, status: int, headers: list[tuple[str, str]], body: bytes):
+        with self._lock:
+            outcome = self._outcomes.get(key)
+            if outcome is None or outcome.done.is_set():
+                # cleared while the request was handled
+                outcome = Outcome()
+            outcome.status, outcome.headers, outcome.body = status, headers, body
+            outcome.expires_at = self.clock() + self.ttl
+        outcome.done.set()
+
+    def abandon(self, key: str):
+        """gives up the key without a response to replay, the next request with it is handled"""
+        with self._lock:
+            outcome = self._outcomes.get(key)
+            if outcome is not None and not outcome.done.is_set():
+                del self._outcomes[key]
+        if outcome is not None:
+            outcome.done.set()
+
+    def reset(self):
+        """forgets every key, requests still being handled with one keep their response to themselves and the
+        retries waiting for them are handled again"""
+        with self._lock:
+            outcomes, self._outcomes = self._outcomes, OrderedDict()
+        for outcome in outcomes.values():
+            outcome.done.set()
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    def _evict(self):
+        # requests still being handled are kept, their retries wait on them and finish() completes them in place
+        running = []
+        while len(self._outcomes) > self.max_entries:
+            key, outcome = self._outcomes.popitem(last=False)
+            if not outcome.done.is_set():
+                running.append((key, outcome))
+        for key, outcome in reversed(running):
+            self._outcomes[key] = outcome
+            self._outcomes.move_to_end(key, last=False)
@@ -0,0 +1,83 @@
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, ExitStack
+
+# number of locks isbns and customer_ids are spread over, keys that share a lock just wait on each other
+LOCK_STRIPES = 1024
+
+class KeyLocks:
+    """striped per-isbn and per-customer locks
+
+    Locks are always taken in the same order, isbns before customers and each in stripe order, so
+    two requests that need overlapping keys can't deadlock.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self.stripes: int = stripes
+        self._isbn_locks = [threading.Lock() for _ in range(stripes)]
+        self._customer_locks = [threading.Lock() for _ in range(stripes)]
+
+    @contextmanager
+    def hold(self, isbns: Iterable[str] = (), customer_ids: Iterable[str] = ()) -> Iterator[None]:
+        """holds the locks for every given isbn and customer_id for the duration of the block
+
+        Args:
+            isbns (Iterable[str], optional): isbns whose books are read then changed. Defaults to ().
+            customer_ids (Iterable[str], optional): customer_ids whose customers are read then changed. Defaults to ().
+        """
+        isbn_stripes = sorted({hash(isbn) % self.stripes for isbn in isbns})
+        customer_stripes = sorted({hash(customer_id) % self.stripes for customer_id in customer_ids})
+
+        with ExitStack() as stack:
+            for stripe in isbn_stripes:
+                stack.enter_context(self._isbn_locks[stripe])
+            for stripe in customer_stripes:
+                stack.enter_context(self._customer_locks[stripe])
+            yield
+
+    @contextmanager
+    def hold_all(self) -> Iterator[None]:
+        """holds every lock, for changes that touch the whole library such as a reset"""
+        with ExitStack() as stack:
+            for lock in self._isbn_locks + self._customer_locks:
+                stack.enter_context(lock)
+            yield
+
+class ReadWriteLock:
+    """lock that many threads can share, or one thread can hold exclusively
+
+    Waiting exclusive holders stop new shared holders from getting in so they aren't starved.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared: int = 0
+        self._exclusive: bool = False
+        self._exclusive_waiting: int = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and not self._exclusive_waiting)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                if not self._shared:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._condition:
+            self._exclusive_waiting += 1
+            self._condition.wait_for(lambda: not self._exclusive and not self._shared)
+            self._exclusive_waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
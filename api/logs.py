@@ -0,0 +1,161 @@
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, TextIO
+
+from flask import g, has_request_context, request
+
+# records waiting for the writer, more than this and new records are dropped rather than slowing requests down
+LOG_QUEUE_SIZE = 10000
+# characters of a payload that make it into a log line
+MAX_PAYLOAD_SIZE = 1024
+
+class Payload:
+    """request or response data passed as a log argument, only serialised if the record is written"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value: Any = value
+
+    def render(self, max_size: int):
+        """the value as text, cut down to max_size characters"""
+        if isinstance(self.value, bytes):
+            text = self.value.decode(errors="replace")
+        elif isinstance(self.value, str):
+            text = self.value
+        else:
+            text = json.dumps(self.value, default=str)
+
+        if len(text) > max_size:
+            return f"{text[:max_size]}... ({len(text)} characters)"
+        return text
+
+    def __str__(self):
+        return self.render(MAX_PAYLOAD_SIZE)
+
+class StructuredFormatter(logging.Formatter):
+    """formats records as json lines with the route they were logged on, on the writer thread"""
+
+    def __init__(self, max_payload_size: int = MAX_PAYLOAD_SIZE):
+        super().__init__()
+        self.max_payload_size: int = max_payload_size
+
+    def format(self, record: logging.LogRecord):
+        message = record.msg
+        if record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            message = message % tuple(a.render(self.max_payload_size) if isinstance(a, Payload) else a for a in args)
+
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "method": getattr(record, "method", None),
+            "path": getattr(record, "path", None),
+            "route": getattr(record, "route", None),
+            "message": message
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RouteSampler(logging.Filter):
+    """keeps the records of a sample of each route's requests, and every warning and error
+
+    The decision is made once per request so a sampled request keeps all of its records. Runs on the request
+    thread, so it also copies the route onto the record for the writer.
+    """
+
+    def __init__(self, rates: dict[str, float], default_rate: float = 1.0):
+        super().__init__()
+        self.rates: dict[str, float] = rates
+        self.default_rate: float = default_rate
+
+    def filter(self, record: logging.LogRecord):
+        if not has_request_context():
+            return True
+
+        record.method = request.method
+        record.path = request.path
+        record.route = request.endpoint
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if "log_sampled" not in g:
+            rate = self.rates.get(request.endpoint, self.default_rate)
+            g.log_sampled = rate >= 1 or random.random() < rate
+        return g.log_sampled
+
+class BoundedQueueHandler(QueueHandler):
+    """hands records to the writer thread as they are, dropping them when its queue is full"""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped: int = 0
+        self._unreported: int = 0
+        # request threads log at the same time, nothing waits under it as the queue is never waited on
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord):
+        # QueueHandler formats here, on the request thread, the writer's formatter does it instead
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        with self._dropped_lock:
+            try:
+                if self._unreported:
+                    dropped = logging.makeLogRecord({"name": record.name, "levelno": logging.WARNING,
+                                                     "levelname": "WARNING",
+                                                     "msg": "dropped %s log records, the log queue was full",
+                                                     "args": (self._unreported,)})
+                    self.queue.put_nowait(dropped)
+                    self._unreported = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self._unreported += 1
+
+def parse_sample_rates(rates: str):
+    """parses comma separated endpoint=rate pairs, such as "get_book=0.01,get_customer=0.1"
+
+    Raises:
+        ValueError: when a pair isn't an endpoint and a number
+    """
+    parsed: dict[str, float] = {}
+    for pair in filter(None, (pair.strip() for pair in rates.split(","))):
+        endpoint, _, rate = pair.partition("=")
+        parsed[endpoint.strip()] = float(rate)
+    return parsed
+
+def start_logging(logger: logging.Logger, queue_size: int = LOG_QUEUE_SIZE, max_payload_size: int = MAX_PAYLOAD_SIZE,
+                  rates: dict[str, float] | None = None, default_rate: float = 1.0, stream: TextIO = sys.stderr):
+    """replaces the logger's handlers with one that queues records for a background writer
+
+    Args:
+        logger (logging.Logger): logger of the app
+        queue_size (int, optional): most records waiting to be written. Defaults to LOG_QUEUE_SIZE.
+        max_payload_size (int, optional): most characters written of each Payload. Defaults to MAX_PAYLOAD_SIZE.
+        rates (dict[str, float] | None, optional): share of requests logged per endpoint. Defaults to None.
+        default_rate (float, optional): share of requests logged for other endpoints. Defaults to 1.0.
+        stream (TextIO, optional): where the writer writes. Defaults to sys.stderr.
+
+    Returns:
+        QueueListener: the writer, stop it to write out what is left in the queue
+    """
+    records: queue.Queue = queue.Queue(queue_size)
+
+    handler = BoundedQueueHandler(records)
+    handler.addFilter(RouteSampler(rates or {}, default_rate))
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+
+    writer = logging.StreamHandler(stream)
+    writer.setFormatter(StructuredFormatter(max_payload_size))
+    listener = QueueListener(records, writer)
+    listener.start()
+    return listener
@@ -0,0 +1,200 @@
+import threading
+from bisect import bisect_left
+from collections.abc import Iterable
+
+# upper bounds in seconds of the latency histogram buckets, +Inf is added after them
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# hottest isbns reported, each sketch keeps a few times as many candidates
+TOP_ISBNS = 10
+SKETCH_FACTOR = 4
+
+class TopKeys:
+    """space-saving sketch of the most frequent keys in bounded memory
+
+    When it is full, a new key takes over the least frequent key's count, so counts are upper bounds and any
+    key more frequent than 1/capacity of everything added is always kept.
+    """
+
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self.counts: dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            smallest = min(counts, key=counts.__getitem__)
+            counts[key] = counts.pop(smallest) + count
+
+    def merge(self, counts: dict[str, int]):
+        """adds the counts of another sketch, keeping the capacity largest"""
+        merged = dict(self.counts)
+        for key, count in counts.items():
+            merged[key] = merged.get(key, 0) + count
+        self.counts = dict(sorted(merged.items(), key=lambda item: -item[1])[:self.capacity])
+
+    def top(self, n: int):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+class _Shard:
+    """what one thread recorded, only that thread writes to it"""
+
+    __slots__ = ("requests", "latencies", "rejections", "shed", "isbns")
+
+    def __init__(self, sketch_capacity: int):
+        # (route, method, status) to count
+        self.requests: dict[tuple[str, str, int], int] = {}
+        # route to the count in each bucket, then the sum and count of every latency
+        self.latencies: dict[str, list[float]] = {}
+        self.rejections: dict[str, int] = {}
+        # (route, reason) to count of requests refused before they were handled
+        self.shed: dict[tuple[str, str], int] = {}
+        self.isbns: TopKeys = TopKeys(sketch_capacity)
+
+    def merge(self, other: "_Shard"):
+        # dict() and list() copy in one step under the GIL, so a shard can be read while its thread writes
+        for key, count in dict(other.requests).items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        for route, counts in dict(other.latencies).items():
+            counts = list(counts)
+            mine = self.latencies.setdefault(route, [0] * len(counts))
+            for i, count in enumerate(counts):
+                mine[i] += count
+        for reason, count in dict(other.rejections).items():
+            self.rejections[reason] = self.rejections.get(reason, 0) + count
+        for key, count in dict(other.shed).items():
+            self.shed[key] = self.shed.get(key, 0) + count
+        self.isbns.merge(dict(other.isbns.counts))
+
+class _Owner:
+    """kept in a thread's local storage, hands the thread's shard to the retired totals when the thread ends"""
+
+    __slots__ = ("metrics", "shard")
+
+    def __init__(self, metrics: "Metrics", shard: _Shard):
+        self.metrics: Metrics = metrics
+        self.shard: _Shard = shard
+
+    def __del__(self):
+        self.metrics._retire(self.shard)
+
+class Metrics:
+    """request and domain metrics in the Prometheus text format
+
+    Each thread records into its own shard without locking, a scrape adds the shards up. The lock is only taken
+    the first time a thread records and when it ends, never per request.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS, top_isbns: int = TOP_ISBNS):
+        self.buckets: tuple[float, ...] = buckets
+        self.top_isbns: int = top_isbns
+        self._sketch_capacity: int = top_isbns * SKETCH_FACTOR
+        self._local = threading.local()
+        self._live: set[_Shard] = set()
+        self._retired: _Shard = _Shard(self._sketch_capacity)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            shard = _Shard(self._sketch_capacity)
+            with self._lock:
+                self._live.add(shard)
+            owner = self._local.owner = _Owner(self, shard)
+        return owner.shard
+
+    def _retire(self, shard: _Shard):
+        with self._lock:
+            self._live.discard(shard)
+            self._retired.merge(shard)
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float):
+        shard = self._shard()
+        key = (route, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+
+        latencies = shard.latencies.get(route)
+        if latencies is None:
+            latencies = shard.latencies[route] = [0] * (len(self.buckets) + 3)
+        latencies[bisect_left(self.buckets, seconds)] += 1
+        latencies[-2] += seconds
+        latencies[-1] += 1
+
+    def reject_checkout(self, reason: str):
+        shard = self._shard()
+        shard.rejections[reason] = shard.rejections.get(reason, 0) + 1
+
+    def shed_request(self, route: str, reason: str):
+        shard = self._shard()
+        key = (route, reason)
+        shard.shed[key] = shard.shed.get(key, 0) + 1
+
+    def touch_isbn(self, isbn: str):
+        self._shard().isbns.add(isbn)
+
+    def snapshot(self):
+        """everything recorded so far by every thread, added up"""
+        total = _Shard(self._sketch_capacity)
+        with self._lock:
+            total.merge(self._retired)
+            live = list(self._live)
+        for shard in live:
+            total.merge(shard)
+        return total
+
+    def render(self, gauges: Iterable[tuple[str, str, float]] = ()):
+        """the metrics in the Prometheus text format
+
+        Args:
+            gauges (Iterable[tuple[str, str, float]], optional): name, help and value of gauges read at scrape
+            time. Defaults to ().
+
+        Returns:
+            str: text exposition of every metric
+        """
+        total = self.snapshot()
+        lines = ["# HELP library_http_requests_total Requests served by route, method and status.",
+                 "# TYPE library_http_requests_total counter"]
+        for (route, method, status), count in sorted(total.requests.items()):
+            lines.append(f"library_http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+        lines += ["# HELP library_http_request_duration_seconds Time to handle a request by route.",
+                  "# TYPE library_http_request_duration_seconds histogram"]
+        for route, counts in sorted(total.latencies.items()):
+            cumulative = 0
+            for bound, count in zip((*map(str, self.buckets), "+Inf"), counts):
+                cumulative += count
+                lines.append(f"library_http_request_duration_seconds_bucket{_labels(route=route, le=bound)} "
+                             f"{cumulative}")
+            lines.append(f"library_http_request_duration_seconds_sum{_labels(route=route)} {counts[-2]}")
+            lines.append(f"library_http_request_duration_seconds_count{_labels(route=route)} {counts[-1]}")
+
+        lines += ["# HELP library_checkout_rejections_total Checkouts refused with a 409 by reason.",
+                  "# TYPE library_checkout_rejections_total counter"]
+        for reason, count in sorted(total.rejections.items()):
+            lines.append(f"library_checkout_rejections_total{_labels(reason=reason)} {count}")
+
+        lines += ["# HELP library_shed_requests_total Write requests refused by admission control by route and reason.",
+                  "# TYPE library_shed_requests_total counter"]
+        for (route, reason), count in sorted(total.shed.items()):
+            lines.append(f"library_shed_requests_total{_labels(route=route, reason=reason)} {count}")
+
+        lines += [f"# HELP library_hot_isbn_requests Estimated reads and checkouts of the {self.top_isbns} most "
+                  "requested books.",
+                  "# TYPE library_hot_isbn_requests gauge"]
+        for isbn, count in total.isbns.top(self.top_isbns):
+            lines.append(f"library_hot_isbn_requests{_labels(isbn=isbn)} {count}")
+
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+def _labels(**labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
@@ -0,0 +1,58 @@
+import base64
+import json
+from http import HTTPStatus
+
+from werkzeug.exceptions import HTTPException
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(position: list):
+    """turns the position of the last item of a page into an opaque cursor for the next page
+
+    Args:
+        position (list): json serializable values that locate the last item
+
+    Returns:
+        str: url safe cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(cursor: str, size: int):
+    """turns a cursor from encode_cursor back into the position it was made from
+
+    Args:
+        cursor (str): cursor given by the client
+        size (int): number of values the position should have
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when the cursor wasn't made by encode_cursor
+
+    Returns:
+        list: values that locate the last item of the previous page
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        position = None
+
+    if not isinstance(position, list) or len(position) != size:
+        e = HTTPException(f"Cursor {cursor} is not valid!")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+    return position
+
+def parse_limit(limit: str | None, default: int = DEFAULT_PAGE_SIZE):
+    """parses the page size asked for by the client, defaulting to default
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when it isn't a number between 1 and MAX_PAGE_SIZE
+    """
+    if limit is None:
+        return default
+
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+        e = HTTPException(f"limit must be a number between 1 and {MAX_PAGE_SIZE}, not {limit}")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+    return int(limit)
@@ -0,0 +1,94 @@
+from collections.abc import Callable
+from http import HTTPStatus
+from typing import Any
+
+from werkzeug.exceptions import HTTPException
+
+from models.objects import AttributeList, identity
+
+# json types as python parses them, named the way clients see them
+TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "a boolean", list: "an array",
+              dict: "an object"}
+
+_MISSING = object()
+
+class ValidationError(HTTPException):
+    """400 that lists every field of the body that failed, rather than the first"""
+    code = HTTPStatus.BAD_REQUEST
+
+    def __init__(self, errors: list[dict]):
+        super().__init__("Attribute validation failed! " + ", ".join(error["error"] for error in errors))
+        self.errors: list[dict] = errors
+
+class Schema:
+    """validator for the bodies of one kind of object, compiled once from the object's REQUIRED_ATTRIBUTES"""
+
+    def __init__(self, attributes: AttributeList):
+        self.fields: tuple[str, ...] = tuple(attribute[0] for attribute in attributes)
+        self._check: Callable[[Any], tuple[dict | None, list[dict] | None]] = self._compile(attributes)
+
+    @staticmethod
+    def _compile(attributes: AttributeList):
+        # identity transforms are dropped and everything the loop needs is bound to locals up front
+        fields = tuple((name, json_type, TYPE_NAMES.get(json_type, json_type.__name__),
+                        None if transform is identity else transform, validator)
+                       for name, json_type, transform, validator in attributes)
+        known = frozenset(name for name, *_ in fields)
+        count = len(fields)
+        missing = _MISSING
+
+        def check(body: Any):
+            if type(body) is not dict:
+                return None, [{"field": None, "error": f"{json_summary(body)} is not an object"}]
+
+            values = {}
+            errors = []
+            for name, json_type, type_name, transform, validator in fields:
+                value = body.get(name, missing)
+                if value is missing:
+                    errors.append({"field": name, "error": f"{name} is missing"})
+                    continue
+                if type(value) is not json_type:
+                    errors.append({"field": name, "error": f"{name} must be {type_name}"})
+                    continue
+                if transform is not None:
+                    try:
+                        value = transform(value)
+                    except (TypeError, ValueError) as e:
+                        errors.append({"field": name, "error": f"{name} is not valid: {e}"})
+                        continue
+                if not validator(value):
+                    errors.append({"field": name, "error": f"{name} failed check"})
+                    continue
+                values[name] = value
+
+            # with every field present, a body of the same size can't have any others
+            if len(body) != count or errors:
+                errors += [{"field": name, "error": f"{name} is not a known attribute"}
+                           for name in body if name not in known]
+
+            if errors:
+                return None, errors
+            return values, None
+
+        return check
+
+    def check(self, body: Any):
+        """returns the validated and transformed attributes of body and None, or None and every error in it"""
+        return self._check(body)
+
+    def validate(self, body: Any):
+        """returns the validated and transformed attributes of body
+
+        Raises:
+            ValidationError: HTTPException(HTTPStatus.BAD_REQUEST/400) with every error in body
+        """
+        values, errors = self._check(body)
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+def json_summary(value: Any, max_size: int = 100):
+    """short text of a value for error messages, so a huge body doesn't end up in the response"""
+    text = repr(value)
+    return text if len(text) <= max_size else f"{text[:max_size]}..."
@@ -1,18 +1,290 @@
-from datetime import date
+import atexit
+import os
+import time
+from collections.abc import Callable, Iterable, Iterator
+from datetime import date, datetime, timedelta
 from http import HTTPStatus
+from typing import Any
 
 from werkzeug.exceptions import HTTPException
-from flask import Flask, json, request, Response
+from flask import Flask, g, json, request, Response
 
-from models import Book, Customer, Checkout, Return, Books, Customers, Checkouts
+from api import BatchResults, Exports, KeyLocks, ReadWriteLock, MAX_BATCH_SIZE, bulk_import, encode_cursor, decode_cursor, parse_limit
+from api import Schema, ValidationError
+from api import LOG_QUEUE_SIZE, MAX_PAYLOAD_SIZE, Payload, parse_sample_rates, start_logging
+from api import Metrics, TOP_ISBNS
+from api import AvailabilityHub, AvailabilityStream, HEARTBEAT_INTERVAL, MAX_STREAM_ISBNS
+from api import EXPORT_PAGE_SIZE, export_records, read_export
+from api import Admission, RateLimited, RouteBusy, CLIENT_HEADER, DEFAULT_BURST, WRITE_METHODS
+from api import IdempotencyCache, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_HEADER, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT, MAX_KEY_LENGTH
+from api import ANALYTICS_WINDOW_DAYS, TOP_TITLES, CirculationLog, History, loan_days, loan_durations, overdue_loans, top_titles
+from api.export import book_record, customer_record, checkout_record, return_record
+from api.export import hold_record, hold_ready_record, hold_removed_record
+from models import Book, Customer, Checkout, Return, BookStore, CustomerStore, CheckoutStore, Books, Customers, Checkouts
+from models import Hold, Holds
+from models.objects import READY, encode_response
+from models import IdAllocator, SequentialIds, TimeOrderedIds, LeasedIds, FileCounter, WorkerLease
+from models.objects.ids import ID_BLOCK_SIZE
+from models.collections import DEFAULT_SEARCH_LIMIT, PICKUP_WINDOW, Position
+from storage import Persistence, WriteAheadLog, SNAPSHOT_INTERVAL, SQLiteEngine, SQLiteBooks, SQLiteCustomers, SQLiteCheckouts
+from storage import SharedRegion, SharedBooks, SharedCustomers, SharedCheckouts, ColumnarBooks, ColumnarCustomers, ColumnarCheckouts
 
 app = Flask(__name__)
 
 MAX_BOOKS_CHECKED_OUT = 5
 
-library: Books = Books()
-customers: Customers = Customers()
-checkouts: Checkouts = Checkouts()
+# request bodies are checked against these, compiled once from each class's REQUIRED_ATTRIBUTES
+SCHEMAS: dict[type, Schema] = {object_type: Schema(object_type.REQUIRED_ATTRIBUTES)
+                               for object_type in (Book, Customer, Checkout, Return, Hold)}
+
+# "memory" keeps the library in dicts, "sqlite" keeps it in the database at LIBRARY_SQLITE_PATH which
+# can be larger than memory and shared by several server processes, "shared" keeps books, customers and checkouts
+# in a memory-mapped file at LIBRARY_SHARED_PATH so worker processes on one host share the library, "columnar"
+# keeps the library in memory as typed arrays, a fraction of the size of "memory" for large catalogues
+STORAGE: str = os.environ.get("LIBRARY_STORAGE", "memory")
+SQLITE_PATH: str = os.environ.get("LIBRARY_SQLITE_PATH", "library.db")
+SHARED_PATH: str = os.environ.get("LIBRARY_SHARED_PATH", "/dev/shm/library")
+SHARED_BOOK_CAPACITY: int = int(os.environ.get("LIBRARY_SHARED_BOOK_CAPACITY", 100000))
+SHARED_CUSTOMER_CAPACITY: int = int(os.environ.get("LIBRARY_SHARED_CUSTOMER_CAPACITY", 100000))
+
+# setting LIBRARY_WAL_DIR keeps the in memory library across restarts by logging every change to that directory
+WAL_DIR: str | None = os.environ.get("LIBRARY_WAL_DIR")
+WAL_DURABLE: bool = os.environ.get("LIBRARY_WAL_DURABLE", "0") == "1"
+WAL_SNAPSHOT_INTERVAL: int = int(os.environ.get("LIBRARY_WAL_SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL))
+
+# "sequential" checkout ids count from 1 in each process, "time" ids are made from the time, a worker id and a
+# sequence, "leased" ids are numbered densely from blocks of LIBRARY_ID_BLOCK_SIZE leased from the counter at
+# LIBRARY_ID_COUNTER_PATH. The sqlite backend numbers checkouts itself. "time" ids only differ between processes
+# with different worker ids: each process leases one from the file at LIBRARY_WORKER_LEASE_PATH, which processes
+# on one host share, unless LIBRARY_WORKER_ID sets it, which workers on different hosts need
+CHECKOUT_IDS: str = os.environ.get("LIBRARY_CHECKOUT_IDS", "time" if STORAGE == "shared" else "sequential")
+WORKER_ID: int | None = int(os.environ["LIBRARY_WORKER_ID"]) if "LIBRARY_WORKER_ID" in os.environ else None
+WORKER_LEASE_PATH: str = os.environ.get("LIBRARY_WORKER_LEASE_PATH", "worker_ids")
+ID_COUNTER_PATH: str = os.environ.get("LIBRARY_ID_COUNTER_PATH", "checkout_ids")
+ID_BLOCK: int = int(os.environ.get("LIBRARY_ID_BLOCK_SIZE", ID_BLOCK_SIZE))
+
+# log records are written by a background thread, LIBRARY_LOG_SAMPLE_RATES keeps only a share of the requests
+# of busy endpoints, e.g. "get_book=0.01,get_customer=0.1", and LIBRARY_LOG_SAMPLE_RATE of the others
+LOG_QUEUE: int = int(os.environ.get("LIBRARY_LOG_QUEUE_SIZE", LOG_QUEUE_SIZE))
+LOG_MAX_PAYLOAD: int = int(os.environ.get("LIBRARY_LOG_MAX_PAYLOAD", MAX_PAYLOAD_SIZE))
+LOG_SAMPLE_RATE: float = float(os.environ.get("LIBRARY_LOG_SAMPLE_RATE", 1.0))
+LOG_SAMPLE_RATES: dict[str, float] = parse_sample_rates(os.environ.get("LIBRARY_LOG_SAMPLE_RATES", ""))
+
+log_writer = start_logging(app.logger, LOG_QUEUE, LOG_MAX_PAYLOAD, LOG_SAMPLE_RATES, LOG_SAMPLE_RATE)
+atexit.register(log_writer.stop)
+
+# GET /api/metrics reports the LIBRARY_METRICS_TOP_ISBNS most requested books
+METRICS_TOP_ISBNS: int = int(os.environ.get("LIBRARY_METRICS_TOP_ISBNS", TOP_ISBNS))
+metrics: Metrics = Metrics(top_isbns=METRICS_TOP_ISBNS)
+
+# GET /api/books/availability/stream sends a comment every LIBRARY_STREAM_HEARTBEAT seconds when nothing changed
+STREAM_HEARTBEAT: float = float(os.environ.get("LIBRARY_STREAM_HEARTBEAT", HEARTBEAT_INTERVAL))
+availability: AvailabilityHub = AvailabilityHub()
+
+# write requests get a 429 when their client goes over LIBRARY_CLIENT_RATE a second, or the customer they are for over
+# LIBRARY_CUSTOMER_RATE, after bursts of LIBRARY_CLIENT_BURST and LIBRARY_CUSTOMER_BURST, and a 503 when their route is
+# already handling LIBRARY_ROUTE_CONCURRENCY of them. Clients are named by the LIBRARY_CLIENT_HEADER header, or else
+# by their address. 0 turns a check off, they are all off by default
+CLIENT_ID_HEADER: str = os.environ.get("LIBRARY_CLIENT_HEADER", CLIENT_HEADER)
+CLIENT_RATE: float = float(os.environ.get("LIBRARY_CLIENT_RATE", 0))
+CLIENT_BURST: float = float(os.environ.get("LIBRARY_CLIENT_BURST", DEFAULT_BURST))
+CUSTOMER_RATE: float = float(os.environ.get("LIBRARY_CUSTOMER_RATE", 0))
+CUSTOMER_BURST: float = float(os.environ.get("LIBRARY_CUSTOMER_BURST", DEFAULT_BURST))
+ROUTE_CONCURRENCY: int = int(os.environ.get("LIBRARY_ROUTE_CONCURRENCY", 0))
+admission: Admission = Admission(CLIENT_RATE, CLIENT_BURST, CUSTOMER_RATE, CUSTOMER_BURST, ROUTE_CONCURRENCY)
+
+# a POST with an Idempotency-Key header that its client already sent to the same path gets the first response back
+# for LIBRARY_IDEMPOTENCY_TTL seconds, from a cache of the last LIBRARY_IDEMPOTENCY_CACHE_SIZE of them. A retry sent
+# while the first is still handled waits up to LIBRARY_IDEMPOTENCY_WAIT seconds for it
+IDEMPOTENCY_SIZE: int = int(os.environ.get("LIBRARY_IDEMPOTENCY_CACHE_SIZE", IDEMPOTENCY_CACHE_SIZE))
+IDEMPOTENCY_SECONDS: float = float(os.environ.get("LIBRARY_IDEMPOTENCY_TTL", IDEMPOTENCY_TTL))
+IDEMPOTENCY_WAIT_SECONDS: float = float(os.environ.get("LIBRARY_IDEMPOTENCY_WAIT", IDEMPOTENCY_WAIT))
+idempotency: IdempotencyCache = IdempotencyCache(IDEMPOTENCY_SIZE, IDEMPOTENCY_SECONDS, IDEMPOTENCY_WAIT_SECONDS)
+
+# a copy set aside for a hold waits LIBRARY_HOLD_PICKUP_HOURS for its customer before going to the next hold
+HOLD_PICKUP_HOURS: float = float(os.environ.get("LIBRARY_HOLD_PICKUP_HOURS", PICKUP_WINDOW / timedelta(hours=1)))
+
+ids: IdAllocator
+if CHECKOUT_IDS == "sequential":
+    ids = SequentialIds()
+elif CHECKOUT_IDS == "time" and WORKER_ID is not None:
+    ids = TimeOrderedIds(WORKER_ID)
+elif CHECKOUT_IDS == "time":
+    worker_lease = WorkerLease(WORKER_LEASE_PATH)
+    ids = TimeOrderedIds(worker_lease.acquire())
+    # servers that load the app and then fork workers would otherwise give them all the parent's worker id
+    os.register_at_fork(after_in_child=lambda: setattr(ids, "worker_id", worker_lease.acquire()))
+elif CHECKOUT_IDS == "leased":
+    ids = LeasedIds(FileCounter(ID_COUNTER_PATH), ID_BLOCK)
+else:
+    raise ValueError(f"Unknown LIBRARY_CHECKOUT_IDS: {CHECKOUT_IDS}, expected sequential, time or leased")
+Checkout.ids = ids
+
+library: BookStore
+customers: CustomerStore
+checkouts: CheckoutStore
+
+# requests that read then change a book or customer hold its lock, the server can then run threaded
+locks: KeyLocks = KeyLocks()
+# exports read LIBRARY_EXPORT_PAGE_SIZE books, customers or checkouts at a time and log the changes made
+# meanwhile, an import waits for exports reading the stores and new ones wait for it to be applied
+EXPORT_PAGE: int = int(os.environ.get("LIBRARY_EXPORT_PAGE_SIZE", EXPORT_PAGE_SIZE))
+exports: Exports = Exports()
+restore_gate: ReadWriteLock = ReadWriteLock()
+# only the memory backend logs to LIBRARY_WAL_DIR
+persistence: Persistence | None = None
+
+if STORAGE == "sqlite":
+    engine = SQLiteEngine(SQLITE_PATH)
+    library = SQLiteBooks(engine)
+    customers = SQLiteCustomers(engine)
+    checkouts = SQLiteCheckouts(engine, MAX_BOOKS_CHECKED_OUT)
+    atexit.register(engine.close)
+elif STORAGE == "shared":
+    region = SharedRegion(SHARED_PATH, SHARED_BOOK_CAPACITY, SHARED_CUSTOMER_CAPACITY, MAX_BOOKS_CHECKED_OUT)
+    library = SharedBooks(region)
+    customers = SharedCustomers(region, MAX_BOOKS_CHECKED_OUT)
+    checkouts = SharedCheckouts(region, library, customers)
+    atexit.register(region.close)
+elif STORAGE == "memory":
+    if WAL_DIR:
+        persistence = Persistence(WriteAheadLog(WAL_DIR, durable=WAL_DURABLE), WAL_SNAPSHOT_INTERVAL)
+
+    library = Books(persistence)
+    customers = Customers(persistence)
+    checkouts = Checkouts(persistence)
+elif STORAGE == "columnar":
+    library = ColumnarBooks()
+    customers = ColumnarCustomers()
+    checkouts = ColumnarCheckouts(library, customers)
+else:
+    raise ValueError(f"Unknown LIBRARY_STORAGE: {STORAGE}, expected memory, sqlite, shared or columnar")
+
+# holds are kept in memory by every backend, copies set aside for them are counted there rather than on the book
+holds: Holds = Holds(timedelta(hours=HOLD_PICKUP_HOURS), persistence)
+# every checkout and return is also appended to the circulation history that GET /api/analytics reports on,
+# it is kept in memory by every backend. The write-ahead log brings it back whole, otherwise it starts with the
+# loans that are out when the server starts
+circulation: CirculationLog = CirculationLog(journal=persistence)
+
+if persistence is not None:
+    persistence.recover(library, customers, checkouts, holds, circulation)
+    atexit.register(persistence.close)
+else:
+    circulation.load(checkouts)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def admit_request():
+    """refuses a write request over its client's rate or its route's limit, before its body is read"""
+    if request.method not in WRITE_METHODS or request.url_rule is None:
+        return
+    route = request.url_rule.rule
+    try:
+        admission.admit(request_client(), route)
+    except (RateLimited, RouteBusy) as e:
+        metrics.shed_request(route, e.reason)
+        raise
+    g.admitted_route = route
+
+@app.teardown_request
+def release_route(_: BaseException | None):
+    if "admitted_route" in g:
+        admission.leave(g.pop("admitted_route"))
+
+def request_client():
+    return request.headers.get(CLIENT_ID_HEADER) or request.remote_addr or "unknown"
+
+@app.before_request
+def replay_idempotent():
+    """answers a POST retried with the same Idempotency-Key with the response to the first one, waiting for it
+    when it is still being handled, so a retried checkout doesn't make a second checkout
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when the key is too long, or
+        HTTPException(HTTPStatus.CONFLICT/409) when the first request is still being handled after waiting for it
+
+    Returns:
+        Response | None: the first response, or None when this request is the first with its key
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if request.method != "POST" or request.url_rule is None or not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        e = HTTPException(f"{IDEMPOTENCY_HEADER} is longer than {MAX_KEY_LENGTH} characters")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+
+    # keys are only unique to the client that made them, and a key sent to another path is another request
+    scoped_key = f"{request_client()}\n{request.path}\n{key}"
+    outcome = idempotency.begin(scoped_key)
+    if outcome is None:
+        g.idempotency_key = scoped_key
+        return None
+    app.logger.info("replay_idempotent: replayed %s %s", request.path, Payload({IDEMPOTENCY_HEADER: key}))
+    response = Response(outcome.body, status=outcome.status, headers=outcome.headers)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+@app.after_request
+def store_idempotent(response: Response):
+    """keeps the response to a POST with an Idempotency-Key for its retries, unless retrying could get another
+    one: server errors, refusals to come back later and streamed responses are not kept"""
+    if "idempotency_key" not in g:
+        return response
+    key = g.pop("idempotency_key")
+    status = response.status_code
+    if status >= HTTPStatus.INTERNAL_SERVER_ERROR or status == HTTPStatus.TOO_MANY_REQUESTS or response.is_streamed:
+        idempotency.abandon(key)
+    else:
+        headers = [(name, value) for name, value in response.headers.items() if name != "Content-Length"]
+        idempotency.finish(key, status, headers, response.get_data())
+    return response
+
+@app.teardown_request
+def release_idempotency_key(_: BaseException | None):
+    # a request that failed without a response lets its retries through
+    if "idempotency_key" in g:
+        idempotency.abandon(g.pop("idempotency_key"))
+
+def admit_customers(body: Any):
+    """refuses a write request for a customer over its rate, as soon as the parsed body names them and before
+    it is validated
+
+    Raises:
+        e: RateLimited(HTTPStatus.TOO_MANY_REQUESTS/429) when a customer is over its rate
+    """
+    items = body if isinstance(body, list) else [body]
+    customer_ids = [item["customer_id"] for item in items
+                    if isinstance(item, dict) and isinstance(item.get("customer_id"), str)]
+    for customer_id in dict.fromkeys(customer_ids):
+        try:
+            admission.admit_customer(customer_id)
+        except RateLimited as e:
+            metrics.shed_request(request.url_rule.rule, e.reason)
+            raise
+
+@app.before_request
+def expire_holds():
+    """gives the copies of holds that weren't picked up in time to the next holds, before the request sees them"""
+    for hold in holds.expire(datetime.now()):
+        app.logger.info("expire_holds: hold expired %s", Payload(hold.get_response()))
+        with locks.hold(isbns=[hold.isbn]):
+            if exports.active:
+                exports.record(hold_removed_record(hold))
+            allocate_holds(hold.isbn)
+            publish_availability([hold.isbn])
+
+@app.after_request
+def record_request(response: Response):
+    """counts the request and its latency under its route, so paths with ids don't each get their own series"""
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - g.request_start)
+    return response
 
 @app.errorhandler(HTTPException)
 def handle_exception(e: HTTPException):
@@ -24,26 +296,52 @@ def handle_exception(e: HTTPException):
     Returns:
         Response: response to be given back to the client
     """
-    app.logger.error(str(e))
+    app.logger.error("%s", e)
     response = e.get_response()
-    response.data = json.dumps({
+    body = {
         "code": e.code,
         "name": e.name,
         "description": e.description,
-    })
+    }
+    # invalid bodies list every attribute that failed
+    if isinstance(e, ValidationError):
+        body["errors"] = e.errors
+    response.data = json.dumps(body)
     response.content_type = "application/json"
     return response
 
-def parse_validate_request(object_type: type[Book|Customer|Checkout|Return]):
+def validate_attributes(object_type: type[Book|Customer|Checkout|Return|Hold], body):
+    """checks the presence and types of the required attributes in an already parsed body, transforming them,
+    and then validating them, with the schema compiled for object_type
+
+    Args:
+        object_type (type[Book | Customer | Checkout | Return | Hold]): classes that have the
+        REQUIRED_ATTRIBUTES AttributeList to allow checking of attributes
+        body (Any): parsed json body of a request or of a single record in a bulk request
+
+    Raises:
+        e: ValidationError(HTTPStatus.BAD_REQUEST/400) listing every attribute that failed and every unknown one
+
+    Returns:
+        dict: a dict containing any relevant, sanitized, and validated parts of the body
+    """
+    schema = SCHEMAS.get(object_type)
+    if schema is None:
+        # subclasses, such as the ones tests swap in, get compiled the first time they are seen
+        schema = SCHEMAS[object_type] = Schema(object_type.REQUIRED_ATTRIBUTES)
+    return schema.validate(body)
+
+def parse_validate_request(object_type: type[Book|Customer|Checkout|Return|Hold]):
     """takes global `request` object and parses to json before checking the presence of required
     attributes, transforming them, and then validating them
 
     Args:
-        object_type (type[Book | Customer | Checkout | Return]): classes that have the 
+        object_type (type[Book | Customer | Checkout | Return | Hold]): classes that have the 
         REQUIRED_ATTRIBUTES AttributeList to allow checking of attributes
 
     Raises:
-        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when any checks fail
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when any checks fail, or
+        RateLimited(HTTPStatus.TOO_MANY_REQUESTS/429) when the customer is over its rate
 
     Returns:
         dict: a dict containing any relevant, sanitized, and validated parts of the request
@@ -51,32 +349,134 @@ def parse_validate_request(object_type: type[Book|Customer|Checkout|Return]):
     # attempt to retrieve json from request body
     body = request.json
 
-    app.logger.info(f"{request.path}: called with {body}")
+    app.logger.info("%s: called with %s", request.path, Payload(body))
+    admit_customers(body)
 
-    ret_dict = {}
+    return validate_attributes(object_type, body)
 
-    # check all required book attributes in request
-    for attr, transformer, validator in object_type.REQUIRED_ATTRIBUTES:
-        if attr not in body:
-            e = HTTPException(f"Attribute retrieval failed! {attr} not in {body}")
-            e.code = HTTPStatus.BAD_REQUEST
-            raise e
+def parse_validate_batch_request(object_type: type[Checkout|Return]):
+    """takes global `request` object and parses to a json array before validating each item in it
+
+    Args:
+        object_type (type[Checkout | Return]): classes that have the REQUIRED_ATTRIBUTES AttributeList
+        to allow checking of attributes
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when the body is not a non-empty array, or
+        RateLimited(HTTPStatus.TOO_MANY_REQUESTS/429) when a customer is over its rate
+
+    Returns:
+        tuple[list[dict | None], BatchResults]: validated items, None for items that failed validation, and
+        the results with those failures recorded
+    """
+    body = request.json
 
+    app.logger.info("%s: called with %s", request.path, Payload(body))
+    admit_customers(body)
+
+    if not isinstance(body, list) or not body:
+        e = HTTPException(f"Batch retrieval failed! {body} is not a non-empty array")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+
+    if len(body) > MAX_BATCH_SIZE:
+        e = HTTPException(f"Batch retrieval failed! Cannot process more than {MAX_BATCH_SIZE} items at once")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+
+    results = BatchResults(len(body))
+    items: list[dict | None] = []
+    for index, item in enumerate(body):
         try:
-            attr_value = transformer(body[attr])
-        except Exception as e:
-            new_e = HTTPException(f"Attribute transform failed! Error details: {e}")
-            new_e.code = HTTPStatus.BAD_REQUEST
-            raise new_e from e
+            items.append(validate_attributes(object_type, item))
+        except HTTPException as e:
+            results.fail(index, e)
+            items.append(None)
 
-        if not validator(attr_value):
-            e = HTTPException(f"Attribute validation failed! {attr} in {body} failed check!")
-            e.code = HTTPStatus.BAD_REQUEST
-            raise e
+    return items, results
 
-        ret_dict[attr] = attr_value
+def bulk_import_request(object_type: type[Book|Customer], apply_batch):
+    """streams records out of the global `request` body, validating each one and applying them in batches
+
+    Args:
+        object_type (type[Book | Customer]): classes that have the REQUIRED_ATTRIBUTES AttributeList
+        apply_batch (Callable[[list[dict]], None]): collection method that applies a batch of records
+
+    Returns:
+        Response: response to client with the import summary in body and code HTTPStatus.OK(200)
+    """
+    def apply_locked_batch(batch: list[dict]):
+        isbns = [record["isbn"] for record in batch if "isbn" in record]
+        customer_ids = [record["customer_id"] for record in batch if "customer_id" in record]
+        with locks.hold(isbns=isbns, customer_ids=customer_ids):
+            apply_batch(batch)
+            publish_availability(isbns)
+            if exports.active:
+                for isbn in dict.fromkeys(isbns):
+                    exports.record(book_record(library.get_book(isbn)))
+                for customer_id in dict.fromkeys(customer_ids):
+                    exports.record(customer_record(customers.get_customer(customer_id)))
+
+    summary = bulk_import(request.stream, lambda record: validate_attributes(object_type, record), apply_locked_batch)
+
+    app.logger.info("%s: received %s, applied %s, failed %s", request.path, summary.received, summary.applied,
+                    summary.failed)
+    return Response(json.dumps(summary.get_response()), status=HTTPStatus.OK, mimetype='application/json')
+
+def publish_availability(isbns: Iterable[str]):
+    """pushes the available copies of changed books to the streams watching them, the caller holds the isbns'
+    locks so streams see changes in the order they were made
+
+    Args:
+        isbns (Iterable[str]): isbns of books whose copies were checked out, returned or added
+    """
+    for isbn in dict.fromkeys(isbns):
+        if availability.watched(isbn):
+            availability.publish(isbn, available_copies(library.get_book(isbn)))
 
-    return ret_dict
+def available_copies(book: Book):
+    """copies of a book free to check out, copies set aside for ready holds only go to their customers"""
+    return book.available_copies - holds.reserved(book.isbn)
+
+def book_response(book: Book):
+    """the response of a book with available_copies counting only copies free to check out"""
+    response = book.get_response()
+    response["available_copies"] = available_copies(book)
+    return response
+
+def encode_book(book: Book):
+    """the json response of a book and its ETag, as the book caches it while none of its copies are set aside"""
+    if not holds.reserved(book.isbn):
+        return book.encode()
+    return encode_response(book_response(book))
+
+def can_take_hold(customer_id: str):
+    """whether a customer has room under the checkout limit for another copy, counting copies set aside for them"""
+    try:
+        customer = customers.get_customer(customer_id)
+    except HTTPException:
+        return False
+    return customer.checkouts + holds.ready_count(customer_id) < MAX_BOOKS_CHECKED_OUT
+
+def allocate_holds(isbn: str):
+    """sets the free copies of a book aside for the holds waiting on it, oldest first, the caller holds the
+    isbn's lock
+
+    Args:
+        isbn (str): unique isbn of book whose copies were returned, added or given up by a hold
+    """
+    if not holds.has_waiting(isbn):
+        return
+
+    book: Book = library.get_book(isbn)
+    now = datetime.now()
+    for _ in range(available_copies(book)):
+        hold = holds.allocate(isbn, can_take_hold, now)
+        if hold is None:
+            break
+        if exports.active:
+            exports.record(hold_ready_record(hold))
+        app.logger.info("allocate_holds: hold ready %s", Payload(hold.get_response()))
 
 @app.post("/api/books")
 def add_book():
@@ -94,24 +494,187 @@ def add_book():
     copies: int = body["copies"]
 
     # add book to library
-    book = library.add_book(title, author, isbn, copies)
+    with locks.hold(isbns=[isbn]):
+        book = library.add_book(title, author, isbn, copies)
+        allocate_holds(isbn)
+        publish_availability([isbn])
+        if exports.active:
+            exports.record(book_record(book))
 
-    app.logger.info(f"add_book: book created {str(book)}")
-    return Response(str(book), status=HTTPStatus.CREATED, mimetype='application/json')
+    body, _ = encode_book(book)
+    app.logger.info("add_book: book created %s", Payload(body))
+    return Response(body, status=HTTPStatus.CREATED, mimetype='application/json')
+
+@app.post("/api/books/bulk")
+def add_books_bulk():
+    """adds many books to library from an NDJSON or JSON array body, existing isbns get more copies
+
+    Returns:
+        Response: response to client with the import summary in body and code HTTPStatus.OK(200)
+    """
+    return bulk_import_request(Book, library.add_books)
+
+def listing_response(name: str, page: Callable[[Position | None, int], Iterator[tuple[Position, Any]]],
+                     respond: Callable[[Any], dict] | None = None):
+    """streams a page of a collection from the `cursor` and `limit` arguments of the global `request` object
+
+    Args:
+        name (str): key of the items in the response body
+        page (Callable): page_books, page_customers or page_checkouts of a store
+        respond (Callable | None, optional): builds the response of an item. Defaults to its get_response.
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when the cursor or limit isn't valid
+
+    Returns:
+        Response: response to client with the items and the cursor of the next page, or null on the last page,
+        in body and code HTTPStatus.OK(200)
+    """
+    limit = parse_limit(request.args.get("limit"))
+
+    after = None
+    if "cursor" in request.args:
+        after = decode_cursor(request.args["cursor"], 1)[0]
+    try:
+        # one more than asked for tells whether there is a next page
+        items = page(after, limit + 1)
+    except ValueError as e:
+        new_e = HTTPException(f"Cursor {request.args['cursor']} is not valid!")
+        new_e.code = HTTPStatus.BAD_REQUEST
+        raise new_e from e
+
+    def generate():
+        yield f'{{"{name}": ['
+        last = None
+        next_cursor = None
+        for count, (position, item) in enumerate(items):
+            if count == limit:
+                next_cursor = encode_cursor([last])
+                break
+            yield (", " if count else "") + json.dumps(item.get_response() if respond is None else respond(item))
+            last = position
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+    app.logger.info("%s: streaming up to %s %s", request.path, limit, name)
+    return Response(generate(), status=HTTPStatus.OK, mimetype='application/json')
+
+@app.get("/api/books")
+def get_books():
+    """lists the books a page at a time, or finds books by the words of their title and author when the `q` or
+    `author` query string arguments are given. The last word of each also matches words it is the start of, so
+    it can be used while typing
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when q and author only have whitespace
+
+    Returns:
+        Response: response to client with a page of books, or up to `limit` books that match best first, in body
+        and code HTTPStatus.OK(200)
+    """
+    if "q" not in request.args and "author" not in request.args:
+        return listing_response("books", library.page_books, book_response)
+
+    query = request.args.get("q", "")
+    author = request.args.get("author", "")
+    limit = parse_limit(request.args.get("limit"), DEFAULT_SEARCH_LIMIT)
+    app.logger.info("get_books: called with q %s author %s limit %s", Payload(query), Payload(author), limit)
+
+    if not query.strip() and not author.strip():
+        e = HTTPException("q or author must have words to search books")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+
+    response = [book_response(book) for book in library.search(query, author, limit)]
+    app.logger.info("get_books: %s books", len(response))
+
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+
+def conditional_response(encoded: tuple[bytes, str]):
+    """builds the response for the json body and ETag of a book or customer, empty when the global `request`
+    object's If-None-Match already has that ETag
+
+    Returns:
+        Response: response to client with details in body and code HTTPStatus.OK(200), or no body and code
+        HTTPStatus.NOT_MODIFIED(304)
+    """
+    body, etag = encoded
+    if request.if_none_match.contains(etag):
+        app.logger.info("%s: not modified, etag %s", request.path, etag)
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+    else:
+        app.logger.info("%s: etag %s", request.path, etag)
+        response = Response(body, status=HTTPStatus.OK, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 @app.get("/api/books/<isbn>")
 def get_book(isbn: str):
     """retrieves book details with given isbn
 
+    Args:
+        isbn (str): unique isbn of book
+
+    Returns:
+        Response: response to client with details in body and code HTTPStatus.OK(200), or HTTPStatus.NOT_MODIFIED(304)
+        when If-None-Match has its current ETag
+    """
+    app.logger.info("get_book: called with isbn %s", isbn)
+    book = library.get_book(isbn)
+    # only books that exist are counted, so unknown isbns can't crowd out the top isbns
+    metrics.touch_isbn(isbn)
+    return conditional_response(encode_book(book))
+
+@app.get("/api/books/availability/stream")
+def stream_availability():
+    """streams the available copies of the books given as `isbn` arguments as Server-Sent Events, first their
+    current values and then every change, until the client disconnects
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when no isbn or too many are given
+
+    Returns:
+        Response: response to client with a text/event-stream body and code HTTPStatus.OK(200)
+    """
+    isbns = list(dict.fromkeys(request.args.getlist("isbn")))
+    app.logger.info("stream_availability: called with isbns %s", Payload(isbns))
+
+    if not isbns or len(isbns) > MAX_STREAM_ISBNS:
+        e = HTTPException(f"Between 1 and {MAX_STREAM_ISBNS} isbn arguments are needed to stream availability")
+        e.code = HTTPStatus.BAD_REQUEST
+        raise e
+
+    # subscribing before reading the current values means no change falls between them
+    subscription = availability.subscribe(isbns)
+    try:
+        current = {isbn: available_copies(library.get_book(isbn)) for isbn in isbns}
+    except HTTPException:
+        availability.unsubscribe(subscription)
+        raise
+
+    stream = AvailabilityStream(availability, subscription, current, STREAM_HEARTBEAT)
+    # passed through as it is, so the ASGI adapter can iterate it asynchronously
+    response = Response(stream, status=HTTPStatus.OK, mimetype='text/event-stream', direct_passthrough=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.get("/api/books/<isbn>/checkouts")
+def get_book_checkouts(isbn: str):
+    """retrieves the checkouts of the book with given isbn, i.e. who has its copies
+
     Args:
         isbn (str): unique isbn of book
 
     Returns:
         Response: response to client with details in body and code HTTPStatus.OK(200)
     """
-    app.logger.info(f"get_book: called with isbn {isbn}")
-    app.logger.info(f"get_book: {str(library.get_book(isbn))}")
-    return Response(str(library.get_book(isbn)), status=HTTPStatus.OK, mimetype='application/json')
+    app.logger.info("get_book_checkouts: called with isbn %s", isbn)
+    _ = library.get_book(isbn)
+
+    response = list(c.get_response() for c in checkouts.get_by_isbn(isbn))
+    app.logger.info("get_book_checkouts: %s checkouts", len(response))
+
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
 
 @app.post("/api/customers")
 def create_customer():
@@ -128,10 +691,32 @@ def create_customer():
     customer_id: str = body["customer_id"]
 
     # add customer to customers
-    customer = customers.add_customer(name, email, customer_id)
+    with locks.hold(customer_ids=[customer_id]):
+        customer = customers.add_customer(name, email, customer_id)
+        if exports.active:
+            exports.record(customer_record(customer))
+
+    body, _ = customer.encode()
+    app.logger.info("create_customer: customer created %s", Payload(body))
+    return Response(body, status=HTTPStatus.CREATED, mimetype='application/json')
+
+@app.post("/api/customers/bulk")
+def create_customers_bulk():
+    """adds many customers from an NDJSON or JSON array body, existing customer_ids get updated
+
+    Returns:
+        Response: response to client with the import summary in body and code HTTPStatus.OK(200)
+    """
+    return bulk_import_request(Customer, customers.add_customers)
 
-    app.logger.info(f"create_customer: customer created {str(customer)}")
-    return Response(str(customer), status=HTTPStatus.CREATED, mimetype='application/json')
+@app.get("/api/customers")
+def get_customers():
+    """lists the customers a page at a time, in the order they were added
+
+    Returns:
+        Response: response to client with a page of customers in body and code HTTPStatus.OK(200)
+    """
+    return listing_response("customers", customers.page_customers)
 
 @app.get("/api/customers/<customer_id>")
 def get_customer(customer_id: str):
@@ -141,11 +726,11 @@ def get_customer(customer_id: str):
         customer_id (str): unique customer_id of customer
 
     Returns:
-        Response: response to client with details in body and code HTTPStatus.OK(200)
+        Response: response to client with details in body and code HTTPStatus.OK(200), or HTTPStatus.NOT_MODIFIED(304)
+        when If-None-Match has its current ETag
     """
-    app.logger.info(f"get_customer: called with customer_id {customer_id}")
-    app.logger.info(f"get_customer: {str(customers.get_customer(customer_id))}")
-    return Response(str(customers.get_customer(customer_id)), status=HTTPStatus.OK, mimetype='application/json')
+    app.logger.info("get_customer: called with customer_id %s", customer_id)
+    return conditional_response(customers.get_customer(customer_id).encode())
 
 @app.get("/api/customers/<customer_id>/books")
 def get_customer_books(customer_id: str):
@@ -157,15 +742,13 @@ def get_customer_books(customer_id: str):
     Returns:
         Response: response to client with details in body and code HTTPStatus.OK(200)
     """
-    app.logger.info(f"get_customer_books: called with customer_id {customer_id}")
+    app.logger.info("get_customer_books: called with customer_id %s", customer_id)
     _ = customers.get_customer(customer_id)
 
-    customer_checkouts: list[Checkout] = checkouts.get_by_customer_id(customer_id)
+    body: bytes = checkouts.encode_customer_books(customer_id)
+    app.logger.info("get_customer_books: %s", Payload(body))
 
-    response = list(c.get_checkout_info() for c in customer_checkouts)
-    app.logger.info(f"get_customer_books: {json.dumps(response)}")
-
-    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+    return Response(body, status=HTTPStatus.OK, mimetype='application/json')
 
 @app.post("/api/checkouts")
 def checkout_book():
@@ -181,25 +764,223 @@ def checkout_book():
     customer_id: str = body["customer_id"]
     due_date: date = body["due_date"]
 
-    # check if checkout is allowed to happen
-    book: Book = library.get_book(isbn)
-    if book.available_copies < 1:
-        e = HTTPException(f"Not enough copies of book: {book}")
-        e.code = HTTPStatus.CONFLICT
-        raise e
+    # the locks make checking the limits and taking the copy one step for other requests
+    with locks.hold(isbns=[isbn], customer_ids=[customer_id]):
+        # check if checkout is allowed to happen, copies set aside for holds can only go to their customers
+        book: Book = library.get_book(isbn)
+        metrics.touch_isbn(isbn)
+        hold: Hold | None = holds.find(isbn, customer_id)
+        has_ready_hold = hold is not None and hold.status == READY
+        if not has_ready_hold and available_copies(book) < 1:
+            metrics.reject_checkout("no_copies")
+            e = HTTPException(f"Not enough copies of book: {book}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
 
-    customer: Customer = customers.get_customer(customer_id)
-    if customer.checkouts >= MAX_BOOKS_CHECKED_OUT:
-        e = HTTPException(f"Cannot check out more than {MAX_BOOKS_CHECKED_OUT} for customer: {customer}")
-        e.code = HTTPStatus.CONFLICT
-        raise e
+        customer: Customer = customers.get_customer(customer_id)
+        # copies set aside for the customer's other holds count towards the limit
+        other_ready = holds.ready_count(customer_id) - has_ready_hold
+        if customer.checkouts + other_ready >= MAX_BOOKS_CHECKED_OUT:
+            metrics.reject_checkout("limit")
+            e = HTTPException(f"Cannot check out more than {MAX_BOOKS_CHECKED_OUT} for customer: {customer}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        # create checkout and add
+        checkout = Checkout(book, customer, isbn, customer_id, due_date)
+        try:
+            checkouts.add_checkout(checkout)
+        except HTTPException as e:
+            # counters shared with other workers can still refuse it
+            if e.code == HTTPStatus.CONFLICT:
+                metrics.reject_checkout("conflict")
+            raise
+
+        # the hold is fulfilled, whether its copy was set aside or it was still waiting
+        if hold is not None:
+            holds.remove(hold)
+            if exports.active:
+                exports.record(hold_removed_record(hold))
+        circulation.checked_out(isbn, checkout.checkout_date, due_date)
+        publish_availability([isbn])
+        if exports.active:
+            exports.record(checkout_record(checkout))
+
+    body = str(checkout)
+    app.logger.info("checkout_book: checkout created %s", Payload(body))
+    return Response(body, status=HTTPStatus.CREATED, mimetype='application/json')
+
+@app.get("/api/checkouts")
+def get_checkouts():
+    """lists the active checkouts a page at a time, in the order they were made
+
+    Returns:
+        Response: response to client with a page of checkouts in body and code HTTPStatus.OK(200)
+    """
+    return listing_response("checkouts", checkouts.page_checkouts)
+
+@app.post("/api/checkouts/batch")
+def checkout_books_batch():
+    """checks out several books at once, either every checkout is made or none of them are
+
+    Returns:
+        Response: response to client with a result per item in body and code HTTPStatus.CREATED(201), or the
+        code of the first kind of failure when nothing was checked out
+    """
+    items, results = parse_validate_batch_request(Checkout)
+
+    valid_items = [item for item in items if item is not None]
+    with locks.hold(isbns=[item["isbn"] for item in valid_items],
+                    customer_ids=[item["customer_id"] for item in valid_items]):
+        # look up each book and customer once, counting what the batch takes from them as we go
+        books: dict[str, Book] = {}
+        batch_customers: dict[str, Customer] = {}
+        copies_taken: dict[str, int] = {}
+        books_taken: dict[str, int] = {}
+        # ready holds the batch picks up, their copies are already set aside so they don't take free copies
+        holds_used: dict[str, Hold] = {}
+        ready_used: dict[str, int] = {}
+
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+
+            isbn: str = item["isbn"]
+            customer_id: str = item["customer_id"]
+
+            try:
+                if isbn not in books:
+                    books[isbn] = library.get_book(isbn)
+                if customer_id not in batch_customers:
+                    batch_customers[customer_id] = customers.get_customer(customer_id)
+            except HTTPException as e:
+                results.fail(index, e)
+                continue
+
+            book = books[isbn]
+            hold = holds.find(isbn, customer_id)
+            uses_hold = hold is not None and hold.status == READY and hold.hold_id not in holds_used
+            if not uses_hold and available_copies(book) - copies_taken.get(isbn, 0) < 1:
+                e = HTTPException(f"Not enough copies of book: {book}")
+                e.code = HTTPStatus.CONFLICT
+                results.fail(index, e)
+                continue
+
+            customer = batch_customers[customer_id]
+            other_ready = holds.ready_count(customer_id) - ready_used.get(customer_id, 0) - uses_hold
+            if customer.checkouts + books_taken.get(customer_id, 0) + other_ready >= MAX_BOOKS_CHECKED_OUT:
+                e = HTTPException(f"Cannot check out more than {MAX_BOOKS_CHECKED_OUT} for customer: {customer}")
+                e.code = HTTPStatus.CONFLICT
+                results.fail(index, e)
+                continue
 
-    # create checkout and add
-    checkout = Checkout(book, customer, isbn, customer_id, due_date)
-    checkouts.add_checkout(checkout)
+            if uses_hold:
+                holds_used[hold.hold_id] = hold
+                ready_used[customer_id] = ready_used.get(customer_id, 0) + 1
+            else:
+                copies_taken[isbn] = copies_taken.get(isbn, 0) + 1
+            books_taken[customer_id] = books_taken.get(customer_id, 0) + 1
 
-    app.logger.info(f"checkout_book: checkout created {str(checkout)}")
-    return Response(str(checkout), status=HTTPStatus.CREATED, mimetype='application/json')
+        # only apply once every item is known to succeed
+        if not results.failed:
+            new_checkouts = [Checkout(books[item["isbn"]], batch_customers[item["customer_id"]],
+                                      item["isbn"], item["customer_id"], item["due_date"]) for item in items]
+            checkouts.add_checkouts(new_checkouts)
+            for checkout in new_checkouts:
+                circulation.checked_out(checkout.isbn, checkout.checkout_date, checkout.due_date)
+
+            for isbn, customer_id in dict.fromkeys((item["isbn"], item["customer_id"]) for item in items):
+                hold = holds.find(isbn, customer_id)
+                if hold is not None:
+                    holds.remove(hold)
+                    if exports.active:
+                        exports.record(hold_removed_record(hold))
+            publish_availability(item["isbn"] for item in items)
+            if exports.active:
+                for checkout in new_checkouts:
+                    exports.record(checkout_record(checkout))
+
+            for index, checkout in enumerate(new_checkouts):
+                results.succeed(index, HTTPStatus.CREATED, checkout.get_response())
+
+    response = results.get_response()
+    app.logger.info("checkout_books_batch: %s of %s checkouts created", response["applied"], len(items))
+    return Response(json.dumps(response), status=results.get_status(HTTPStatus.CREATED), mimetype='application/json')
+
+def parse_date_arg(name: str, default: date | None = None):
+    """parses an optional YYYY-MM-DD query string argument of the global `request` object
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when the argument isn't a date
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+
+    try:
+        return date.fromisoformat(value)
+    except ValueError as e:
+        new_e = HTTPException(f"{name} must be a YYYY-MM-DD date, not {value}")
+        new_e.code = HTTPStatus.BAD_REQUEST
+        raise new_e from e
+
+def checkouts_by_due_date_response(start: date | None, end: date | None):
+    """builds a page of checkouts due in [start, end) from the `cursor` and `limit` arguments of the global
+    `request` object
+
+    Returns:
+        Response: response to client with the checkouts and the cursor of the next page, or null on the last
+        page, in body and code HTTPStatus.OK(200)
+    """
+    limit = parse_limit(request.args.get("limit"))
+
+    after = None
+    if "cursor" in request.args:
+        due_date, checkout_id = decode_cursor(request.args["cursor"], 2)
+        try:
+            after = (date.fromisoformat(due_date), str(checkout_id))
+        except (TypeError, ValueError) as e:
+            new_e = HTTPException(f"Cursor {request.args['cursor']} is not valid!")
+            new_e.code = HTTPStatus.BAD_REQUEST
+            raise new_e from e
+
+    try:
+        page = checkouts.get_by_due_date(start, end, after, limit)
+    except ValueError as e:
+        # the checkout id in the cursor isn't one the backend hands out
+        new_e = HTTPException(f"Cursor {request.args['cursor']} is not valid!")
+        new_e.code = HTTPStatus.BAD_REQUEST
+        raise new_e from e
+
+    next_cursor = None
+    if len(page) == limit:
+        next_cursor = encode_cursor([page[-1].due_date.isoformat(), page[-1].checkout_id])
+
+    response = {
+        "checkouts": [c.get_response() for c in page],
+        "next_cursor": next_cursor
+    }
+    app.logger.info("%s: %s checkouts", request.path, len(page))
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+
+@app.get("/api/checkouts/overdue")
+def get_overdue_checkouts():
+    """retrieves checkouts that were due before `as_of`, today by default, the earliest due first
+
+    Returns:
+        Response: response to client with a page of checkouts in body and code HTTPStatus.OK(200)
+    """
+    return checkouts_by_due_date_response(None, parse_date_arg("as_of", date.today()))
+
+@app.get("/api/checkouts/due")
+def get_due_checkouts():
+    """retrieves checkouts due between `from` and `to`, both included and both optional, the earliest due first
+
+    Returns:
+        Response: response to client with a page of checkouts in body and code HTTPStatus.OK(200)
+    """
+    end = parse_date_arg("to")
+    return checkouts_by_due_date_response(parse_date_arg("from"), end + timedelta(days=1) if end else None)
 
 @app.post("/api/returns")
 def return_book():
@@ -214,16 +995,344 @@ def return_book():
     isbn: str = body["isbn"]
     customer_id: str = body["customer_id"]
 
-    # check if checkout even exists
-    if not checkouts.contains_isbn_cust_id(isbn, customer_id):
-        e = HTTPException(f"Checkout with ISBN: {isbn} and customer_id: {customer_id} doesn't exist!")
-        e.code = HTTPStatus.CONFLICT
+    with locks.hold(isbns=[isbn], customer_ids=[customer_id]):
+        # check if checkout even exists
+        if not checkouts.contains_isbn_cust_id(isbn, customer_id):
+            e = HTTPException(f"Checkout with ISBN: {isbn} and customer_id: {customer_id} doesn't exist!")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        # the history keeps when the loan started and was due, which the store forgets on return
+        loan: Checkout = checkouts.get_by_isbn_cust_id(isbn, customer_id)
+        checkout_date, due_date = loan.checkout_date, loan.due_date
+        response = checkouts.return_book(isbn, customer_id)
+        circulation.returned(isbn, checkout_date, due_date, date.today())
+        # the returned copy goes to the next hold rather than back to the shelf when there is one
+        allocate_holds(isbn)
+        publish_availability([isbn])
+        if exports.active:
+            exports.record(return_record(isbn, customer_id))
+    app.logger.info("return_book: book returned %s", Payload(response))
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+
+@app.post("/api/returns/batch")
+def return_books_batch():
+    """returns several books at once, either every book is returned or none of them are
+
+    Returns:
+        Response: response to client with a result per item in body and code HTTPStatus.OK(200), or the
+        code of the first kind of failure when nothing was returned
+    """
+    items, results = parse_validate_batch_request(Return)
+
+    valid_items = [item for item in items if item is not None]
+    with locks.hold(isbns=[item["isbn"] for item in valid_items],
+                    customer_ids=[item["customer_id"] for item in valid_items]):
+        seen: set[tuple[str, str]] = set()
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+
+            isbn: str = item["isbn"]
+            customer_id: str = item["customer_id"]
+
+            # a checkout can only be returned once, even within the same batch
+            if not checkouts.contains_isbn_cust_id(isbn, customer_id) or (isbn, customer_id) in seen:
+                e = HTTPException(f"Checkout with ISBN: {isbn} and customer_id: {customer_id} doesn't exist!")
+                e.code = HTTPStatus.CONFLICT
+                results.fail(index, e)
+                continue
+
+            seen.add((isbn, customer_id))
+
+        if not results.failed:
+            loans = [checkouts.get_by_isbn_cust_id(item["isbn"], item["customer_id"]) for item in items]
+            loan_dates = [(loan.checkout_date, loan.due_date) for loan in loans]
+            returned = checkouts.return_books([(item["isbn"], item["customer_id"]) for item in items])
+            for item, (checkout_date, due_date) in zip(items, loan_dates):
+                circulation.returned(item["isbn"], checkout_date, due_date, date.today())
+
+            for index, response in enumerate(returned):
+                results.succeed(index, HTTPStatus.OK, response)
+
+            for isbn in dict.fromkeys(item["isbn"] for item in items):
+                allocate_holds(isbn)
+            publish_availability(item["isbn"] for item in items)
+            if exports.active:
+                for item in items:
+                    exports.record(return_record(item["isbn"], item["customer_id"]))
+
+    response = results.get_response()
+    app.logger.info("return_books_batch: %s of %s books returned", response["applied"], len(items))
+    return Response(json.dumps(response), status=results.get_status(HTTPStatus.OK), mimetype='application/json')
+
+def hold_response(hold: Hold):
+    return {**hold.get_response(), "position": holds.position(hold)}
+
+@app.post("/api/holds")
+def place_hold():
+    """places a hold on a book with no free copies, a copy is set aside for the customer when one comes back
+
+    Raises:
+        e: HTTPException(HTTPStatus.CONFLICT/409) when a copy is free to check out, or the customer already has
+        the book or a hold on it
+
+    Returns:
+        Response: response to client with the hold and its place in the queue in body and code
+        HTTPStatus.CREATED(201)
+    """
+    body = parse_validate_request(Hold)
+
+    isbn: str = body["isbn"]
+    customer_id: str = body["customer_id"]
+
+    with locks.hold(isbns=[isbn], customer_ids=[customer_id]):
+        book: Book = library.get_book(isbn)
+        customer: Customer = customers.get_customer(customer_id)
+
+        if holds.find(isbn, customer_id) is not None:
+            e = HTTPException(f"Customer: {customer} already has a hold on book: {book}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        if checkouts.contains_isbn_cust_id(isbn, customer_id):
+            e = HTTPException(f"Customer: {customer} already has book: {book}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        if available_copies(book) > 0:
+            e = HTTPException(f"Copies of book: {book} are free to check out")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        hold = holds.place(isbn, customer_id, datetime.now())
+        if exports.active:
+            exports.record(hold_record(hold))
+        response = hold_response(hold)
+
+    app.logger.info("place_hold: hold placed %s", Payload(response))
+    return Response(json.dumps(response), status=HTTPStatus.CREATED, mimetype='application/json')
+
+@app.delete("/api/holds/<hold_id>")
+def cancel_hold(hold_id: str):
+    """cancels a hold, a copy set aside for it goes to the next hold
+
+    Args:
+        hold_id (str): unique hold_id of hold
+
+    Raises:
+        e: HTTPException(HTTPStatus.NOT_FOUND/404) when the hold doesn't exist
+
+    Returns:
+        Response: response to client with the cancelled hold in body and code HTTPStatus.OK(200)
+    """
+    app.logger.info("cancel_hold: called with hold_id %s", hold_id)
+    try:
+        isbn = holds.get_by_id(hold_id).isbn
+    except KeyError as e:
+        new_e = HTTPException(f"Hold with hold_id: {hold_id} doesn't exist!")
+        new_e.code = HTTPStatus.NOT_FOUND
+        raise new_e from e
+
+    with locks.hold(isbns=[isbn]):
+        # it may have been picked up, cancelled or expired while waiting for the lock
+        try:
+            hold = holds.get_by_id(hold_id)
+        except KeyError as e:
+            new_e = HTTPException(f"Hold with hold_id: {hold_id} doesn't exist!")
+            new_e.code = HTTPStatus.NOT_FOUND
+            raise new_e from e
+
+        holds.remove(hold)
+        if exports.active:
+            exports.record(hold_removed_record(hold))
+        allocate_holds(isbn)
+        publish_availability([isbn])
+
+    response = hold.get_response()
+    app.logger.info("cancel_hold: hold cancelled %s", Payload(response))
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+
+@app.get("/api/customers/<customer_id>/holds")
+def get_customer_holds(customer_id: str):
+    """retrieves the holds of the customer with given customer_id in the order they were placed
+
+    Args:
+        customer_id (str): unique customer_id of customer
+
+    Returns:
+        Response: response to client with the holds and their places in the queues in body and code
+        HTTPStatus.OK(200)
+    """
+    app.logger.info("get_customer_holds: called with customer_id %s", customer_id)
+    _ = customers.get_customer(customer_id)
+
+    response = [hold_response(hold) for hold in holds.get_by_customer_id(customer_id)]
+    app.logger.info("get_customer_holds: %s holds", len(response))
+
+    return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
+
+def analytics_window(latest: date):
+    """parses the `from` and `to` dates of the global `request` object for a report, both included, `to` is at
+    most latest and by default the window is the ANALYTICS_WINDOW_DAYS up to it
+
+    Raises:
+        e: HTTPException(HTTPStatus.BAD_REQUEST/400) when a date is invalid or the window is empty
+    """
+    end = min(parse_date_arg("to", latest), latest)
+    start = parse_date_arg("from", end - timedelta(days=ANALYTICS_WINDOW_DAYS - 1))
+    if start > end:
+        e = HTTPException(f"from must not be after {end.isoformat()}, not {start.isoformat()}")
+        e.code = HTTPStatus.BAD_REQUEST
         raise e
+    return start, end
+
+def isbn_keys(history: History):
+    """keys of the `isbn` arguments of the global `request` object, or None to report on every book"""
+    isbns = request.args.getlist("isbn")
+    return history.keys(isbns) if isbns else None
 
-    response = checkouts.return_book(isbn, customer_id)
-    app.logger.info(f"return_book: book returned {json.dumps(response)}")
+def analytics_response(start: date, end: date, report: dict):
+    response = {"from": start.isoformat(), "to": end.isoformat(), **report}
+    app.logger.info("%s: %s", request.path, Payload(response))
     return Response(json.dumps(response), status=HTTPStatus.OK, mimetype='application/json')
 
+@app.get("/api/analytics/top-titles")
+def get_top_titles():
+    """ranks the `limit` books checked out most between `from` and `to`
+
+    Returns:
+        Response: response to client with the books and their checkouts in body and code HTTPStatus.OK(200)
+    """
+    start, end = analytics_window(date.today())
+    limit = parse_limit(request.args.get("limit"), TOP_TITLES)
+    titles = [{"isbn": isbn, "title": library.get_book(isbn).title if library.contains_isbn(isbn) else None,
+               "checkouts": count} for isbn, count in top_titles(circulation.snapshot(), start, end, limit)]
+    return analytics_response(start, end, {"titles": titles})
+
+@app.get("/api/analytics/utilization")
+def get_utilization():
+    """reports the share of their copies' days books spent on loan between `from` and `to`, for the books given
+    as `isbn` arguments or else the `limit` with the most days on loan. Copies are counted as they are now
+
+    Raises:
+        e: HTTPException(HTTPStatus.NOT_FOUND/404) when an isbn given isn't a book
+
+    Returns:
+        Response: response to client with the books in body and code HTTPStatus.OK(200)
+    """
+    start, end = analytics_window(date.today())
+    days = (end - start).days + 1
+    history = circulation.snapshot()
+    days_on_loan = loan_days(history, start, end)
+
+    isbns = request.args.getlist("isbn")
+    if isbns:
+        books_days = [(isbn, history.value(days_on_loan, isbn)) for isbn in dict.fromkeys(isbns)]
+    else:
+        books_days = history.ranked(days_on_loan, parse_limit(request.args.get("limit"), TOP_TITLES))
+
+    books = []
+    for isbn, book_days in books_days:
+        book: Book = library.get_book(isbn)
+        books.append({"isbn": isbn, "title": book.title, "copies": book.copies, "days_on_loan": book_days,
+                      "utilization": book_days / (book.copies * days) if book.copies else None})
+    return analytics_response(start, end, {"days": days, "books": books})
+
+@app.get("/api/analytics/loan-durations")
+def get_loan_durations():
+    """reports how many days the loans returned between `from` and `to` lasted, for the books given as `isbn`
+    arguments or for every book
+
+    Returns:
+        Response: response to client with the mean and percentiles in body and code HTTPStatus.OK(200)
+    """
+    start, end = analytics_window(date.today())
+    history = circulation.snapshot()
+    return analytics_response(start, end, loan_durations(history, start, end, isbn_keys(history)))
+
+@app.get("/api/analytics/overdue")
+def get_overdue_rate():
+    """reports the share of the loans due between `from` and `to`, `to` at most yesterday, that came back late
+    or are still out, for the books given as `isbn` arguments or for every book
+
+    Returns:
+        Response: response to client with the counts and the rate in body and code HTTPStatus.OK(200)
+    """
+    start, end = analytics_window(date.today() - timedelta(days=1))
+    history = circulation.snapshot()
+    report = overdue_loans(history, start, end, isbn_keys(history))
+    overdue = report["returned_late"] + report["outstanding"]
+    report["overdue_rate"] = overdue / report["due"] if report["due"] else None
+    return analytics_response(start, end, report)
+
+@app.get("/api/metrics")
+def get_metrics():
+    """reports request counts, latencies and the state of the library in the Prometheus text format
+
+    Returns:
+        Response: response to client with the metrics in body and code HTTPStatus.OK(200)
+    """
+    copies, on_shelf = library.count_copies()
+    reserved = holds.count_reserved()
+    gauges = [("library_copies", "Copies of every book.", copies),
+              ("library_available_copies", "Copies free to check out, leaving out those set aside for holds.",
+               on_shelf - reserved),
+              ("library_reserved_copies", "Copies set aside for ready holds.", reserved),
+              ("library_active_checkouts", "Checkouts not returned yet.", checkouts.count_active()),
+              ("library_customers_at_limit", f"Customers with {MAX_BOOKS_CHECKED_OUT} books checked out.",
+               customers.count_at_limit(MAX_BOOKS_CHECKED_OUT)),
+              ("library_availability_streams", "Open availability streams.", availability.count()),
+              ("library_admitted_requests_in_flight", "Write requests handled on routes with a concurrency limit.",
+               admission.in_flight()),
+              ("library_idempotent_responses", "Responses kept for retries with the same Idempotency-Key.",
+               len(idempotency))]
+    return Response(metrics.render(gauges), status=HTTPStatus.OK, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def reset_library():
+    library.reset()
+    customers.reset()
+    checkouts.reset()
+    holds.reset()
+    circulation.reset()
+    # replaying a response from before the reset would report changes the reset undid
+    idempotency.reset()
+
+@app.get("/api/export")
+def export_library():
+    """streams every book, customer, active checkout and hold as NDJSON, as they were when the export finished
+
+    Returns:
+        Response: response to client with an NDJSON body that POST /api/import restores and code HTTPStatus.OK(200)
+    """
+    app.logger.info("export_library: export started")
+    # the records are read under the gate and sent after it is released, so a slow client doesn't hold off imports
+    with restore_gate.shared():
+        chunks = export_records(exports, library, customers, checkouts, holds, EXPORT_PAGE)
+
+    return Response(chunks, status=HTTPStatus.OK, mimetype='application/x-ndjson')
+
+@app.post("/api/import")
+def import_library():
+    """replaces the whole library with an NDJSON body written by GET /api/export
+
+    The circulation history isn't exported, so it is cleared too. The body is read and validated first, and every
+    lock is only held while it is applied, so a slow client doesn't hold up other requests.
+
+    Returns:
+        Response: response to client with the import summary in body and code HTTPStatus.OK(200)
+    """
+    staged = read_export(request.stream)
+    with restore_gate.exclusive(), locks.hold_all():
+        reset_library()
+        summary = staged.apply(library, customers, checkouts, holds)
+        # the export only has the loans that are out, the history starts again from them
+        circulation.load(checkouts)
+
+    app.logger.info("import_library: received %s, applied %s, failed %s", summary.received, summary.applied,
+                    summary.failed)
+    return Response(json.dumps(summary.get_response()), status=HTTPStatus.OK, mimetype='application/json')
+
 @app.post("/api/reset")
 def reset_system():
     """resets the entire system
@@ -231,10 +1340,11 @@ def reset_system():
     Returns:
         Response: response to client with details in body and code HTTPStatus.OK(200)
     """
-    library.reset()
-    customers.reset()
-    checkouts.reset()
+    with locks.hold_all():
+        reset_library()
+        if exports.active:
+            exports.record({"type": "reset"})
 
     response = {"message":"System reset successful"}
-    app.logger.info(f"reset_system: system reset")
+    app.logger.info("reset_system: system reset")
     return Response(json.dumps(response), HTTPStatus.OK, mimetype='application/json')
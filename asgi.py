@@ -0,0 +1,21 @@
+"""
+ASGI entry point for the Library Management System API.
+Serves the routes of app.py on an event loop, for example with `uvicorn asgi:app`, so thousands of open
+connections don't each need a thread. Requests run on LIBRARY_ASGI_WORKERS threads.
+"""
+
+import atexit
+import os
+
+from api import ASGIAdapter, ASGI_WORKERS, MAX_BODY_SIZE
+from app import app as flask_app
+
+WORKERS: int = int(os.environ.get("LIBRARY_ASGI_WORKERS", ASGI_WORKERS))
+MAX_BODY: int = int(os.environ.get("LIBRARY_ASGI_MAX_BODY_SIZE", MAX_BODY_SIZE))
+
+# the bulk imports and the import read their bodies a record at a time, so they can be any size
+STREAMED_PATHS = ("/api/books/bulk", "/api/customers/bulk", "/api/import")
+
+app = ASGIAdapter(flask_app, WORKERS, MAX_BODY, streamed_paths=STREAMED_PATHS)
+# servers that don't send lifespan events still get the executor's threads finished
+atexit.register(app.executor.shutdown)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the Library Management System API.
+This script runs workload mixes against the app, in process through the Flask test client or over HTTP
+against a running server, and reports throughput and p50/p95/p99 latency per endpoint. Results are written
+as JSON, and compared against a stored baseline when one is given.
+
+    python -m benchmarks.load --concurrency 8 --output results.json --baseline benchmarks/baseline.json
+    python -m benchmarks.load --url http://localhost:3000 --concurrency 64
+
+Scenarios run in order on a library that is reset first:
+    seed    adds the catalog and customers one request at a time
+    reads   availability checks, customer lookups and searches
+    churn   checkouts and returns that keep customers close to MAX_BOOKS_CHECKED_OUT
+    hot     every worker checking out and returning the same few books
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+# checked out by the app at most, mirrored here so the benchmark doesn't need to import app over HTTP
+MAX_BOOKS_CHECKED_OUT = 5
+HOT_BOOKS = 3
+HOT_COPIES = 2
+PERCENTILES = (50, 95, 99)
+# a result regresses when it is this much worse than the baseline
+TOLERANCE = 0.25
+SCENARIOS = ("seed", "reads", "churn", "hot")
+
+class Transport:
+    """sends requests to the app, one per worker thread"""
+
+    def request(self, method: str, path: str, body: dict | None = None) -> tuple[int, bytes]: ...
+
+class InProcess(Transport):
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+class HTTP(Transport):
+    """keeps one connection open, like a client with keep-alive"""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.prefix: str = parts.path.rstrip("/")
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        self.connection.request(method, self.prefix + path, body=data, headers=headers)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+class Recorder:
+    """latencies and unexpected statuses of one worker, by endpoint"""
+
+    def __init__(self, transport: Transport):
+        self.transport: Transport = transport
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def call(self, endpoint: str, method: str, path: str, body: dict | None = None, expected=(200,)):
+        """sends a request and records its latency under endpoint, a status not in expected counts as an error"""
+        start = time.perf_counter()
+        status, content = self.transport.request(method, path, body)
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        if status not in expected:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return status, content
+
+class Library:
+    """sizes of the generated library, and the keys workers pick from"""
+
+    def __init__(self, books: int, customers: int):
+        self.books: int = books
+        self.customers: int = customers
+        self.due_date: str = (date.today() + timedelta(days=14)).isoformat()
+
+    @staticmethod
+    def isbn(i: int):
+        return f"978{i:010d}"
+
+    @staticmethod
+    def customer_id(i: int):
+        return f"CUST{i:08d}"
+
+def seed(recorder: Recorder, library: Library, worker: int, workers: int, operations: int, generator: random.Random):
+    for i in range(worker, library.books, workers):
+        book_data = {"title": f"Title {i} of the library", "author": f"Author {generator.randrange(1000)}",
+                     "isbn": library.isbn(i), "copies": generator.randint(1, 5)}
+        recorder.call("POST /api/books", "POST", "/api/books", book_data, (201,))
+    for i in range(worker, library.customers, workers):
+        customer_data = {"name": f"Customer {i}", "email": f"customer{i}@example.com",
+                         "customer_id": library.customer_id(i)}
+        recorder.call("POST /api/customers", "POST", "/api/customers", customer_data, (201,))
+
+def reads(recorder: Recorder, library: Library, worker: int, workers: int, operations: int,
+          generator: random.Random):
+    for _ in range(operations):
+        pick = generator.random()
+        if pick < 0.85:
+            isbn = library.isbn(generator.randrange(library.books))
+            recorder.call("GET /api/books/<isbn>", "GET", f"/api/books/{isbn}")
+        elif pick < 0.95:
+            customer_id = library.customer_id(generator.randrange(library.customers))
+            recorder.call("GET /api/customers/<customer_id>", "GET", f"/api/customers/{customer_id}")
+        else:
+            recorder.call("GET /api/books?q=", "GET", f"/api/books?q=title+{generator.randrange(library.books)}")
+
+def churn(recorder: Recorder, library: Library, worker: int, workers: int, operations: int,
+          generator: random.Random):
+    # each worker has its own customers, so what they hold is known without asking
+    customers = list(range(worker, library.customers, workers)) or [worker % library.customers]
+    held: dict[int, list[str]] = {customer: [] for customer in customers}
+    for _ in range(operations):
+        customer = generator.choice(customers)
+        customer_id = library.customer_id(customer)
+        # checkouts are tried more often than returns, so customers sit at the limit and some get a 409
+        at_limit = len(held[customer]) >= MAX_BOOKS_CHECKED_OUT
+        if held[customer] and generator.random() < (0.5 if at_limit else 0.3):
+            isbn = held[customer].pop(0)
+            recorder.call("POST /api/returns", "POST", "/api/returns", {"isbn": isbn, "customer_id": customer_id})
+            continue
+
+        isbn = library.isbn(generator.randrange(library.books))
+        if isbn in held[customer]:
+            continue
+        checkout_data = {"isbn": isbn, "customer_id": customer_id, "due_date": library.due_date}
+        status, _ = recorder.call("POST /api/checkouts", "POST", "/api/checkouts", checkout_data, (201, 409))
+        if status == 201:
+            held[customer].append(isbn)
+
+    for customer, isbns in held.items():
+        for isbn in isbns:
+            recorder.call("POST /api/returns", "POST", "/api/returns",
+                          {"isbn": isbn, "customer_id": library.customer_id(customer)})
+
+def hot(recorder: Recorder, library: Library, worker: int, workers: int, operations: int,
+        generator: random.Random):
+    customer_id = library.customer_id(worker % library.customers)
+    for _ in range(operations):
+        isbn = f"HOT{generator.randrange(HOT_BOOKS)}"
+        recorder.call("GET /api/books/<isbn>", "GET", f"/api/books/{isbn}")
+        checkout_data = {"isbn": isbn, "customer_id": customer_id, "due_date": library.due_date}
+        status, _ = recorder.call("POST /api/checkouts", "POST", "/api/checkouts", checkout_data, (201, 409))
+        if status == 201:
+            recorder.call("POST /api/returns", "POST", "/api/returns", {"isbn": isbn, "customer_id": customer_id})
+
+def percentile(ordered: list[float], p: int):
+    """nearest rank percentile of sorted values"""
+    rank = max(0, -(-p * len(ordered) // 100) - 1)
+    return ordered[rank]
+
+def summarise(recorders: list[Recorder], duration: float):
+    """per endpoint counts, errors, throughput and latency percentiles in milliseconds"""
+    endpoints: dict[str, dict] = {}
+    for endpoint in sorted({endpoint for recorder in recorders for endpoint in recorder.latencies}):
+        latencies = sorted(latency for recorder in recorders for latency in recorder.latencies.get(endpoint, []))
+        summary = {
+            "count": len(latencies),
+            "errors": sum(recorder.errors.get(endpoint, 0) for recorder in recorders),
+            "throughput": len(latencies) / duration
+        }
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = percentile(latencies, p) * 1000
+        endpoints[endpoint] = summary
+
+    return {
+        "duration": duration,
+        "throughput": sum(summary["count"] for summary in endpoints.values()) / duration,
+        "endpoints": endpoints
+    }
+
+def run_scenario(name: str, make_transport: Callable[[], Transport], library: Library, concurrency: int,
+                 operations: int, seed_value: int):
+    """runs a scenario on concurrency workers that start together, and summarises what they recorded"""
+    workload = globals()[name]
+    recorders = [Recorder(make_transport()) for _ in range(concurrency)]
+    start_line = threading.Barrier(concurrency + 1)
+
+    def work(worker: int):
+        generator = random.Random(seed_value * 1000 + worker)
+        start_line.wait()
+        workload(recorders[worker], library, worker, concurrency, operations, generator)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(work, worker) for worker in range(concurrency)]
+        start_line.wait()
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+        duration = time.perf_counter() - start
+
+    return summarise(recorders, duration)
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE):
+    """regressions of results against baseline, as messages
+
+    Latencies regress when they are more than tolerance higher, throughput when it is more than tolerance lower.
+    Endpoints missing from either are skipped.
+    """
+    regressions = []
+    for scenario, baseline_scenario in baseline["scenarios"].items():
+        for endpoint, before in baseline_scenario["endpoints"].items():
+            after = results["scenarios"].get(scenario, {}).get("endpoints", {}).get(endpoint)
+            if after is None:
+                continue
+            for p in PERCENTILES:
+                key = f"p{p}_ms"
+                if after[key] > before[key] * (1 + tolerance):
+                    regressions.append(f"{scenario} {endpoint} {key}: {after[key]:.2f} > {before[key]:.2f}")
+            if after["throughput"] < before["throughput"] * (1 - tolerance):
+                regressions.append(f"{scenario} {endpoint} throughput: {after['throughput']:.0f} < "
+                                   f"{before['throughput']:.0f}")
+            if after["errors"] > before["errors"]:
+                regressions.append(f"{scenario} {endpoint} errors: {after['errors']} > {before['errors']}")
+    return regressions
+
+def report(results: dict):
+    print(f"{results['transport']}, {results['concurrency']} workers, {results['storage']} storage")
+    for scenario, summary in results["scenarios"].items():
+        print(f"\n{scenario}: {summary['throughput']:.0f} requests/s over {summary['duration']:.2f}s")
+        print(f"  {'endpoint':<34}{'count':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for endpoint, s in summary["endpoints"].items():
+            print(f"  {endpoint:<34}{s['count']:>8}{s['errors']:>8}{s['throughput']:>9.0f}"
+                  f"{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['p99_ms']:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", type=str, default=None, help="server to benchmark, in process when not given")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--operations", type=int, default=500, help="operations per worker in each scenario")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="file to write the results to as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="results to compare against")
+    parser.add_argument("--save-baseline", type=str, default=None, help="file to store the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}, save one with --save-baseline first (make benchmark-baseline)")
+
+    if args.url is None:
+        from app import app
+        make_transport = lambda: InProcess(app.test_client())
+        transport, storage = "in process", os.environ.get("LIBRARY_STORAGE", "memory")
+    else:
+        make_transport = lambda: HTTP(args.url)
+        transport, storage = args.url, "server"
+
+    library = Library(args.books, args.customers)
+    setup = make_transport()
+    setup.request("POST", "/api/reset")
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(sorted(unknown))}, expected {', '.join(SCENARIOS)}")
+    if "seed" not in names:
+        # the other scenarios need the catalog, it is added without being reported
+        run_scenario("seed", make_transport, library, args.concurrency, 0, args.seed)
+    for i in range(HOT_BOOKS):
+        setup.request("POST", "/api/books", {"title": f"Hot {i}", "author": "Hot", "isbn": f"HOT{i}",
+                                             "copies": HOT_COPIES})
+
+    results = {"transport": transport, "concurrency": args.concurrency, "storage": storage, "scenarios": {}}
+    for name in names:
+        results["scenarios"][name] = run_scenario(name, make_transport, library, args.concurrency,
+                                                  args.operations, args.seed)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} results regressed past the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nno regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for the in memory storage backends.
+This script fills the dict-of-objects collections and the columnar ones with the same library and prints
+how much memory each holds once filled, measured with tracemalloc. Both backends keep the same search index
+over the books, so the checkouts are also measured on their own.
+
+    python -m benchmarks.memory --books 100000 --customers 50000 --checkouts 200000
+"""
+
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import date, timedelta
+
+from models import Books, Customers, Checkouts, Checkout
+from storage import ColumnarBooks, ColumnarCustomers, ColumnarCheckouts
+
+AUTHORS = 2000
+
+def fill(library, customers, checkouts, books: int, customer_count: int, checkout_count: int, seed: int):
+    """adds the same generated library to whichever stores are given"""
+    generator = random.Random(seed)
+    for i in range(books):
+        library.add_book(f"Title {i} of the library", f"Author {generator.randrange(AUTHORS)}", f"978{i:010d}",
+                         generator.randint(1, 10))
+    for i in range(customer_count):
+        customers.add_customer(f"Customer {i}", f"customer{i}@example.com", f"CUST{i:08d}")
+
+    today = date.today()
+    added = 0
+    while added < checkout_count:
+        isbn = f"978{generator.randrange(books):010d}"
+        customer_id = f"CUST{generator.randrange(customer_count):08d}"
+        book = library.get_book(isbn)
+        if book.available_copies == 0 or checkouts.contains_isbn_cust_id(isbn, customer_id):
+            continue
+        customer = customers.get_customer(customer_id)
+        due_date = today + timedelta(days=generator.randint(1, 60))
+        checkouts.add_checkout(Checkout(book, customer, isbn, customer_id, due_date))
+        added += 1
+
+def measure(make_stores, books: int, customers: int, checkouts: int, seed: int):
+    """returns the bytes held by the stores make_stores returns once they're filled, and by their checkouts"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    library, customer_store, checkout_store = make_stores()
+    fill(library, customer_store, checkout_store, books, customers, 0, seed)
+    gc.collect()
+    without_checkouts = tracemalloc.get_traced_memory()[0]
+    # same seed, so the books and customers are added again as they are and only the checkouts are new
+    fill(library, customer_store, checkout_store, books, customers, checkouts, seed)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, after - without_checkouts
+
+def dict_of_objects():
+    return Books(), Customers(), Checkouts()
+
+def columnar():
+    library, customers = ColumnarBooks(), ColumnarCustomers()
+    return library, customers, ColumnarCheckouts(library, customers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=50000)
+    parser.add_argument("--checkouts", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {name: measure(make_stores, args.books, args.customers, args.checkouts, args.seed)
+               for name, make_stores in (("memory", dict_of_objects), ("columnar", columnar))}
+
+    print(f"{args.books} books, {args.customers} customers, {args.checkouts} checkouts")
+    for name, (held, by_checkouts) in results.items():
+        print(f"{name:>10}: {held / 2 ** 20:8.1f} MiB in total, {by_checkouts / 2 ** 20:8.1f} MiB of checkouts "
+              f"({by_checkouts / max(args.checkouts, 1):5.0f} bytes each)")
+    (memory, memory_checkouts), (compact, compact_checkouts) = results["memory"], results["columnar"]
+    print(f"{'ratio':>10}: {memory / compact:8.2f}x in total, {memory_checkouts / max(compact_checkouts, 1):8.2f}x "
+          "of checkouts")
+
+if __name__ == "__main__":
+    main()
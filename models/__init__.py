@@ -1,2 +1,3 @@
-from .collections import Books, Customers, Checkouts
-from .objects import Book, Customer, Checkout, Return
+from .collections import Books, Customers, Checkouts, Holds, BookStore, CustomerStore, CheckoutStore
+from .objects import Book, Customer, Checkout, Return, Hold
+from .objects import IdAllocator, SequentialIds, TimeOrderedIds, LeasedIds, FileCounter, WorkerLease
@@ -1,3 +1,8 @@
+from .stores import BookStore, CustomerStore, CheckoutStore, Position, start_after
+from .due_dates import DueDateIndex
 from .books import Books
 from .customers import Customers
 from .checkouts import Checkouts
+from .journal import Journal, NullJournal
+from .search import SearchIndex, DEFAULT_SEARCH_LIMIT, MAX_CANDIDATES, rank, tokenize
+from .holds import Holds, PICKUP_WINDOW
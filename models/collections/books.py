@@ -1,29 +1,44 @@
 from http import HTTPStatus
 from werkzeug.exceptions import HTTPException
 from models.objects.book import Book
+from models.collections.journal import Journal, NULL_JOURNAL
+from models.collections.search import SearchIndex
+from models.collections.stores import BookStore, Position, start_after
 
-class Books():
-    def __init__(self):
+class Books(BookStore):
+    def __init__(self, journal: Journal | None = None):
         self._books: dict[str, Book] = {}
+        # isbns in the order they were added, the index of a book in it is its position when listing
+        self._order: list[str] = []
+        self._index: SearchIndex = SearchIndex()
+        self._journal: Journal = journal or NULL_JOURNAL
 
     def reset(self):
-        self.__init__()
+        with self._journal.mutation("reset_books", {}):
+            self.__init__(self._journal)
 
     def add_book(self, title: str, author: str, isbn: str, copies: int):
         book = None
 
-        # if book exists already, add more copies
-        # would need to update if isbn mistakes are plausible
-        if isbn in self._books:
-            book = self._books[isbn]
-            book.add_more_books(copies)
-        # otherwise, just add book
-        else:
-            book = Book(title, author, isbn, copies)
-            self._books[isbn] = book
+        with self._journal.mutation("add_book", {"title": title, "author": author, "isbn": isbn, "copies": copies}):
+            # if book exists already, add more copies
+            # would need to update if isbn mistakes are plausible
+            if isbn in self._books:
+                book = self._books[isbn]
+                book.add_more_books(copies)
+            # otherwise, just add book
+            else:
+                book = Book(title, author, isbn, copies)
+                self._books[isbn] = book
+                self._order.append(isbn)
+                self._index.add(isbn, title, author)
 
         return book
 
+    def add_books(self, books: list[dict]):
+        for book in books:
+            self.add_book(book["title"], book["author"], book["isbn"], book["copies"])
+
     def get_book(self, isbn: str):
         if isbn not in self._books:
             e = HTTPException(f"ISBN: {isbn} not found in library!")
@@ -32,5 +47,21 @@ class Books():
 
         return self._books[isbn]
 
+    def get_books(self):
+        return list(self._books.values())
+
+    def page_books(self, after: Position | None, limit: int):
+        start = start_after(after)
+        # a reset replaces both, the page keeps listing the ones it started with
+        books, order = self._books, self._order
+        return ((i, books[order[i]]) for i in range(start, min(start + limit, len(order))))
+
     def contains_isbn(self, isbn: str):
         return isbn in self._books
+
+    def search(self, query: str, author: str, limit: int):
+        return [self._books[isbn] for isbn in self._index.search(query, author, limit)]
+
+    def count_copies(self):
+        books = list(self._books.values())
+        return sum(book.copies for book in books), sum(book.available_copies for book in books)
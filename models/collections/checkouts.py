@@ -1,42 +1,122 @@
+import threading
+from bisect import bisect_left
 from datetime import date
+from models.objects import encode_list
 from models.objects.checkout import Checkout
+from models.collections.due_dates import DueDateIndex
+from models.collections.journal import Journal, NULL_JOURNAL
+from models.collections.stores import CheckoutStore, Position, start_after
 
-class Checkouts:
-    def __init__(self):
+class Checkouts(CheckoutStore):
+    def __init__(self, journal: Journal | None = None):
         # in a database system these would all be different searches
         # for in memory, we'll have to make do
         self._checkouts_by_id: dict[str, Checkout] = {}
-        self._checkouts_by_cust_id: dict[str, list[Checkout]] = {}
+        # dicts keep insertion order and remove a checkout by its id in constant time
+        self._checkouts_by_cust_id: dict[str, dict[str, Checkout]] = {}
+        self._checkouts_by_isbn: dict[str, dict[str, Checkout]] = {}
         self._checkouts_by_isbn_cust_id: dict[tuple[str, str], Checkout] = {}
+        # each customer's checkouts already encoded for GET /api/customers/<customer_id>/books, kept up to date
+        # as checkouts are added and returned so reading them only joins bytes
+        self._books_by_cust_id: dict[str, dict[str, bytes]] = {}
+        # checkout ids by due date, checkouts for different books and customers are added at the same time so
+        # the sorted indexes have their own lock
+        self._checkouts_by_due_date: DueDateIndex = DueDateIndex()
+        # (sequence, checkout_id) in the order checkouts were added, the sequence is the position when listing.
+        # returned checkouts are left in place and skipped, the list is compacted once they outnumber the rest
+        self._checkouts_in_order: list[tuple[int, str]] = []
+        self._returned_in_order: int = 0
+        self._next_sequence: int = 0
+        self._sorted_lock = threading.Lock()
+        self._journal: Journal = journal or NULL_JOURNAL
 
     def reset(self):
-        self.__init__()
+        with self._journal.mutation("reset_checkouts", {}):
+            self.__init__(self._journal)
 
     def add_checkout(self, checkout: Checkout):
         isbn = checkout.isbn
         customer_id = checkout.customer_id
         checkout_id = checkout.checkout_id
 
-        checkout.book.checkout_book()
-        checkout.customer.checkout_book()
+        with self._journal.mutation("add_checkout", checkout.get_record()):
+            checkout.book.checkout_book()
+            # counters kept outside this process can refuse a checkout, so give the copy back if they do
+            try:
+                checkout.customer.checkout_book()
+            except Exception:
+                checkout.book.return_book()
+                raise
 
-        self._checkouts_by_id[checkout_id] = checkout
+            self._checkouts_by_id[checkout_id] = checkout
 
-        if customer_id not in self._checkouts_by_cust_id:
-            self._checkouts_by_cust_id[customer_id] = []
-        self._checkouts_by_cust_id[customer_id].append(checkout)
+            if customer_id not in self._checkouts_by_cust_id:
+                self._checkouts_by_cust_id[customer_id] = {}
+            self._checkouts_by_cust_id[customer_id][checkout_id] = checkout
+            self._books_by_cust_id.setdefault(customer_id, {})[checkout_id] = checkout.encode_checkout_info()
 
-        self._checkouts_by_isbn_cust_id[(isbn, customer_id)] = checkout
+            if isbn not in self._checkouts_by_isbn:
+                self._checkouts_by_isbn[isbn] = {}
+            self._checkouts_by_isbn[isbn][checkout_id] = checkout
+
+            self._checkouts_by_isbn_cust_id[(isbn, customer_id)] = checkout
+
+            with self._sorted_lock:
+                self._checkouts_by_due_date.add(checkout.due_date, checkout_id)
+                self._checkouts_in_order.append((self._next_sequence, checkout_id))
+                self._next_sequence += 1
+
+    def add_checkouts(self, checkouts: list[Checkout]):
+        added: list[Checkout] = []
+        try:
+            for checkout in checkouts:
+                self.add_checkout(checkout)
+                added.append(checkout)
+        except Exception:
+            for checkout in reversed(added):
+                self.return_book(checkout.isbn, checkout.customer_id)
+            raise
 
     def get_by_id(self, checkout_id: str):
         return self._checkouts_by_id[checkout_id]
 
+    def get_checkouts(self):
+        return list(self._checkouts_by_id.values())
+
     def get_by_customer_id(self, customer_id: str):
         if customer_id not in self._checkouts_by_cust_id: return []
-        return self._checkouts_by_cust_id[customer_id]
+        return list(self._checkouts_by_cust_id[customer_id].values())
+
+    def encode_customer_books(self, customer_id: str):
+        return encode_list(self._books_by_cust_id.get(customer_id, {}).values())
+
+    def get_by_isbn(self, isbn: str):
+        if isbn not in self._checkouts_by_isbn: return []
+        return list(self._checkouts_by_isbn[isbn].values())
 
     def get_by_isbn_cust_id(self, isbn: str, customer_id: str):
         return self._checkouts_by_isbn_cust_id[(isbn, customer_id)]
+
+    def page_checkouts(self, after: Position | None, limit: int):
+        checkouts_by_id = self._checkouts_by_id
+        page: list[tuple[int, Checkout]] = []
+        with self._sorted_lock:
+            in_order = self._checkouts_in_order
+            for index in range(bisect_left(in_order, (start_after(after),)), len(in_order)):
+                if len(page) == limit:
+                    break
+                sequence, checkout_id = in_order[index]
+                # returned checkouts are skipped
+                checkout = checkouts_by_id.get(checkout_id)
+                if checkout is not None:
+                    page.append((sequence, checkout))
+        return iter(page)
+
+    def get_by_due_date(self, start: date | None, end: date | None, after: tuple[date, str] | None, limit: int):
+        with self._sorted_lock:
+            keys = self._checkouts_by_due_date.page(start, end, after, limit)
+
+        return [self._checkouts_by_id[checkout_id] for _, checkout_id in keys]
     
     def contains_isbn_cust_id(self, isbn: str, customer_id: str):
         return (isbn, customer_id) in self._checkouts_by_isbn_cust_id
@@ -44,15 +124,31 @@ class Checkouts:
     def return_book(self, isbn: str, customer_id: str):
         checkout = self.get_by_isbn_cust_id(isbn, customer_id)
 
-        checkout.book.return_book()
-        checkout.customer.return_book()
+        with self._journal.mutation("return_book", {"isbn": isbn, "customer_id": customer_id}):
+            checkout.book.return_book()
+            checkout.customer.return_book()
+
+            # remove all checkouts
+            del self._checkouts_by_id[checkout.checkout_id]
+            del self._checkouts_by_isbn_cust_id[(isbn, customer_id)]
+            customer_checkouts = self._checkouts_by_cust_id[customer_id]
+            del customer_checkouts[checkout.checkout_id]
+            if not customer_checkouts:
+                del self._checkouts_by_cust_id[customer_id]
+            customer_books = self._books_by_cust_id[customer_id]
+            del customer_books[checkout.checkout_id]
+            if not customer_books:
+                del self._books_by_cust_id[customer_id]
+            isbn_checkouts = self._checkouts_by_isbn[isbn]
+            del isbn_checkouts[checkout.checkout_id]
+            if not isbn_checkouts:
+                del self._checkouts_by_isbn[isbn]
 
-        # remove all checkouts
-        del self._checkouts_by_id[checkout.checkout_id]
-        del self._checkouts_by_isbn_cust_id[(isbn, customer_id)]
-        checkouts = self._checkouts_by_cust_id[customer_id]
-        self._checkouts_by_cust_id[customer_id] = \
-            [c for c in checkouts if c.checkout_id != checkout.checkout_id]
+            with self._sorted_lock:
+                self._checkouts_by_due_date.remove(checkout.due_date, checkout.checkout_id)
+                self._returned_in_order += 1
+                if self._returned_in_order * 2 > len(self._checkouts_in_order):
+                    self._compact_in_order()
 
         response = {
             "message": "Book returned successfully",
@@ -61,3 +157,16 @@ class Checkouts:
             "return_date": date.today().isoformat()
         }
         return response
+
+    def _compact_in_order(self):
+        """drops returned checkouts from _checkouts_in_order, called under _sorted_lock once they are over half of
+        it so each return pays for a constant share of the copy"""
+        checkouts_by_id = self._checkouts_by_id
+        self._checkouts_in_order = [key for key in self._checkouts_in_order if key[1] in checkouts_by_id]
+        self._returned_in_order = 0
+
+    def return_books(self, returns: list[tuple[str, str]]):
+        return [self.return_book(isbn, customer_id) for isbn, customer_id in returns]
+
+    def count_active(self):
+        return len(self._checkouts_by_id)
@@ -1,28 +1,40 @@
 from http import HTTPStatus
 from werkzeug.exceptions import HTTPException
 from models.objects.customer import Customer
+from models.collections.journal import Journal, NULL_JOURNAL
+from models.collections.stores import CustomerStore, Position, start_after
 
-class Customers:
-    def __init__(self):
+class Customers(CustomerStore):
+    def __init__(self, journal: Journal | None = None):
         self._customers: dict[str, Customer] = {}
+        # customer_ids in the order they were added, the index of a customer in it is its position when listing
+        self._order: list[str] = []
+        self._journal: Journal = journal or NULL_JOURNAL
 
     def reset(self):
-        self.__init__()
+        with self._journal.mutation("reset_customers", {}):
+            self.__init__(self._journal)
 
     def add_customer(self, name: str, email: str, customer_id: str):
         customer = None
 
-        # if customer exists already, update information
-        if customer_id in self._customers:
-            customer = self._customers[customer_id]
-            customer.update_info(name, email)
-        # otherwise, create a new customer
-        else:
-            customer = Customer(name, email, customer_id)
-            self._customers[customer_id] = customer
+        with self._journal.mutation("add_customer", {"name": name, "email": email, "customer_id": customer_id}):
+            # if customer exists already, update information
+            if customer_id in self._customers:
+                customer = self._customers[customer_id]
+                customer.update_info(name, email)
+            # otherwise, create a new customer
+            else:
+                customer = Customer(name, email, customer_id)
+                self._customers[customer_id] = customer
+                self._order.append(customer_id)
 
         return customer
 
+    def add_customers(self, customers: list[dict]):
+        for customer in customers:
+            self.add_customer(customer["name"], customer["email"], customer["customer_id"])
+
     def get_customer(self, customer_id: str):
         if customer_id not in self._customers:
             e = HTTPException(f"customer_id: {customer_id} not found in customers!")
@@ -30,5 +42,17 @@ class Customers:
             raise e
         return self._customers[customer_id]
 
+    def get_customers(self):
+        return list(self._customers.values())
+
+    def page_customers(self, after: Position | None, limit: int):
+        start = start_after(after)
+        # a reset replaces both, the page keeps listing the ones it started with
+        customers, order = self._customers, self._order
+        return ((i, customers[order[i]]) for i in range(start, min(start + limit, len(order))))
+
     def contains_customer_id(self, customer_id: str):
         return customer_id in self._customers
+
+    def count_at_limit(self, limit: int):
+        return sum(1 for customer in list(self._customers.values()) if customer.checkouts >= limit)
@@ -0,0 +1,53 @@
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Callable, MutableSequence
+from itertools import islice
+from typing import Any
+
+class DueDateIndex:
+    """checkout keys grouped by due date, the keys due each day kept sorted
+
+    Adding or removing a checkout only moves the keys due the same day, and the sorted list of due dates
+    only changes when a day gets its first checkout or loses its last, so a write costs the number of
+    checkouts due that day rather than the number of active checkouts. Callers keep it under a lock.
+    """
+
+    def __init__(self, bucket: Callable[[], MutableSequence] = list):
+        """
+        Args:
+            bucket (Callable[[], MutableSequence], optional): makes the sorted sequence of a day's keys, e.g. a
+            typed array. Defaults to list.
+        """
+        self._bucket: Callable[[], MutableSequence] = bucket
+        self._keys_by_day: dict[Any, MutableSequence] = {}
+        self._days: list = []
+
+    def add(self, day, key):
+        keys = self._keys_by_day.get(day)
+        if keys is None:
+            keys = self._keys_by_day[day] = self._bucket()
+            insort(self._days, day)
+        insort(keys, key)
+
+    def remove(self, day, key):
+        keys = self._keys_by_day[day]
+        del keys[bisect_left(keys, key)]
+        if not keys:
+            del self._keys_by_day[day]
+            del self._days[bisect_left(self._days, day)]
+
+    def page(self, start, end, after: tuple | None, limit: int):
+        """up to limit (day, key) due on or after start and before end, ordered by day then key, starting after
+        the (day, key) after. start and end can be None for no bound"""
+        low = 0 if start is None else bisect_left(self._days, start)
+        if after is not None:
+            low = max(low, bisect_left(self._days, after[0]))
+        high = len(self._days) if end is None else bisect_left(self._days, end)
+
+        page: list[tuple] = []
+        for day in islice(self._days, low, high):
+            keys = self._keys_by_day[day]
+            first = bisect_right(keys, after[1]) if after is not None and day == after[0] else 0
+            page += [(day, key) for key in keys[first:first + limit - len(page)]]
+            if len(page) >= limit:
+                break
+        return page
@@ -0,0 +1,201 @@
+import heapq
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from models.collections.journal import Journal, NULL_JOURNAL
+from models.objects.hold import Hold, WAITING, READY
+
+# how long a copy set aside for a hold waits to be checked out
+PICKUP_WINDOW = timedelta(hours=72)
+HOLD_ID_PREFIX = "HLD"
+
+class Holds:
+    """holds on books, queued per isbn in the order they were placed
+
+    A copy given to a hold isn't taken from the book's counters, it is counted as reserved here instead, so
+    holds work the same whichever backend keeps the books. Callers hold the isbn's lock from api/locks.py
+    while they check reserved copies and allocate them. Every change is made inside a journaled mutation while
+    holding the lock.
+    """
+
+    def __init__(self, pickup_window: timedelta = PICKUP_WINDOW, journal: Journal | None = None):
+        self.pickup_window: timedelta = pickup_window
+        self._holds_by_id: dict[str, Hold] = {}
+        # dicts keep insertion order, so each isbn's waiting holds are a queue that can also drop any hold
+        self._waiting_by_isbn: dict[str, dict[str, Hold]] = {}
+        self._holds_by_cust_id: dict[str, dict[str, Hold]] = {}
+        self._holds_by_isbn_cust_id: dict[tuple[str, str], Hold] = {}
+        self._reserved_by_isbn: dict[str, int] = {}
+        # copies set aside across every isbn, so metrics don't iterate the dict while holds change
+        self._reserved: int = 0
+        self._ready_by_cust_id: dict[str, int] = {}
+        # (expires_at, hold_id) of ready holds, holds picked up or cancelled before they expire are skipped
+        self._expiries: list[tuple[datetime, str]] = []
+        # number of the latest hold_id handed out or restored
+        self._last_number: int = 0
+        # the indexes span isbns and customers, the lock keeps them consistent with each other
+        self._lock = threading.Lock()
+        self._journal: Journal = journal or NULL_JOURNAL
+
+    def reset(self):
+        with self._journal.mutation("reset_holds", {}):
+            self.__init__(self.pickup_window, self._journal)
+
+    def place(self, isbn: str, customer_id: str, placed_at: datetime, hold_id: str | None = None):
+        """queues a hold behind the other holds on the isbn
+
+        Args:
+            hold_id (str | None, optional): only given when restoring a hold that already existed, later holds
+            are numbered after it. Defaults to None.
+        """
+        with self._lock:
+            if hold_id is None:
+                hold_id = f"{HOLD_ID_PREFIX}{self._last_number + 1}"
+            number = hold_id.removeprefix(HOLD_ID_PREFIX)
+            if number.isdigit():
+                self._last_number = max(self._last_number, int(number))
+
+            hold = Hold(hold_id, isbn, customer_id, placed_at)
+            with self._journal.mutation("place_hold", hold.get_record()):
+                self._holds_by_id[hold.hold_id] = hold
+                self._waiting_by_isbn.setdefault(isbn, {})[hold.hold_id] = hold
+                self._holds_by_cust_id.setdefault(customer_id, {})[hold.hold_id] = hold
+                self._holds_by_isbn_cust_id[(isbn, customer_id)] = hold
+        return hold
+
+    def get_by_id(self, hold_id: str):
+        """raises KeyError when the hold_id doesn't exist"""
+        return self._holds_by_id[hold_id]
+
+    def get_by_customer_id(self, customer_id: str):
+        """holds of a customer in the order they were placed"""
+        return list(self._holds_by_cust_id.get(customer_id, {}).values())
+
+    def get_holds(self):
+        """every hold in the order they were placed, copied without the lock so a snapshot taken while
+        mutations wait on the journal can call it"""
+        return list(self._holds_by_id.values())
+
+    def find(self, isbn: str, customer_id: str):
+        return self._holds_by_isbn_cust_id.get((isbn, customer_id))
+
+    def position(self, hold: Hold):
+        """place of a waiting hold in its queue starting from 1, or 0 for ready holds"""
+        if hold.status != WAITING:
+            return 0
+        with self._lock:
+            for position, hold_id in enumerate(self._waiting_by_isbn.get(hold.isbn, {}), 1):
+                if hold_id == hold.hold_id:
+                    return position
+        return 0
+
+    def has_waiting(self, isbn: str):
+        return bool(self._waiting_by_isbn.get(isbn))
+
+    def reserved(self, isbn: str):
+        """copies of the book set aside for ready holds"""
+        return self._reserved_by_isbn.get(isbn, 0)
+
+    def count_reserved(self):
+        """copies set aside for ready holds on every book"""
+        return self._reserved
+
+    def ready_count(self, customer_id: str):
+        """copies set aside for the customer, which count towards their checkout limit"""
+        return self._ready_by_cust_id.get(customer_id, 0)
+
+    def allocate(self, isbn: str, eligible: Callable[[str], bool], now: datetime):
+        """sets a copy aside for the oldest waiting hold on the isbn whose customer is eligible
+
+        Customers that aren't eligible, e.g. because they're at their checkout limit, keep their place for the
+        next copy. Usually the oldest hold is eligible, so a copy is allocated in constant time.
+
+        Returns:
+            Hold | None: the hold now ready, or None when no waiting hold is eligible
+        """
+        with self._lock:
+            queue = self._waiting_by_isbn.get(isbn)
+            if not queue:
+                return None
+            hold = next((hold for hold in queue.values() if eligible(hold.customer_id)), None)
+            if hold is None:
+                return None
+            self._set_ready(hold, now + self.pickup_window)
+        return hold
+
+    def set_ready(self, hold_id: str, expires_at: datetime):
+        """sets a copy aside for a waiting hold like allocate does, for restoring a hold that was ready
+
+        Raises:
+            KeyError: when the hold_id doesn't exist
+            ValueError: when the hold is already ready
+        """
+        with self._lock:
+            hold = self._holds_by_id[hold_id]
+            if hold.status != WAITING:
+                raise ValueError(f"hold {hold_id} is already {hold.status}")
+            self._set_ready(hold, expires_at)
+        return hold
+
+    def _set_ready(self, hold: Hold, expires_at: datetime):
+        with self._journal.mutation("ready_hold", {"hold_id": hold.hold_id, "expires_at": expires_at.isoformat()}):
+            queue = self._waiting_by_isbn[hold.isbn]
+            del queue[hold.hold_id]
+            if not queue:
+                del self._waiting_by_isbn[hold.isbn]
+            # expires_at is set first, get_holds readers that see the status also see when it expires
+            hold.expires_at = expires_at
+            hold.status = READY
+            self._reserved_by_isbn[hold.isbn] = self._reserved_by_isbn.get(hold.isbn, 0) + 1
+            self._reserved += 1
+            self._ready_by_cust_id[hold.customer_id] = self._ready_by_cust_id.get(hold.customer_id, 0) + 1
+            heapq.heappush(self._expiries, (hold.expires_at, hold.hold_id))
+
+    def _remove(self, hold: Hold):
+        with self._journal.mutation("remove_hold", {"hold_id": hold.hold_id}):
+            self._unlink(hold)
+
+    def _unlink(self, hold: Hold):
+        del self._holds_by_id[hold.hold_id]
+        del self._holds_by_isbn_cust_id[(hold.isbn, hold.customer_id)]
+        customer_holds = self._holds_by_cust_id[hold.customer_id]
+        del customer_holds[hold.hold_id]
+        if not customer_holds:
+            del self._holds_by_cust_id[hold.customer_id]
+
+        if hold.status == WAITING:
+            queue = self._waiting_by_isbn[hold.isbn]
+            del queue[hold.hold_id]
+            if not queue:
+                del self._waiting_by_isbn[hold.isbn]
+        else:
+            # the copy goes back to the shelf, the caller allocates it again
+            self._reserved_by_isbn[hold.isbn] -= 1
+            if not self._reserved_by_isbn[hold.isbn]:
+                del self._reserved_by_isbn[hold.isbn]
+            self._reserved -= 1
+            self._ready_by_cust_id[hold.customer_id] -= 1
+            if not self._ready_by_cust_id[hold.customer_id]:
+                del self._ready_by_cust_id[hold.customer_id]
+
+    def remove(self, hold: Hold):
+        """removes a hold that was cancelled or picked up"""
+        with self._lock:
+            self._remove(hold)
+
+    def expire(self, now: datetime):
+        """removes the ready holds whose pickup window has passed and returns them"""
+        expired: list[Hold] = []
+        # checked without the lock first, as most calls find nothing to expire
+        if not self._expiries or self._expiries[0][0] > now:
+            return expired
+
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                expires_at, hold_id = heapq.heappop(self._expiries)
+                hold = self._holds_by_id.get(hold_id)
+                if hold is not None and hold.status == READY and hold.expires_at == expires_at:
+                    self._remove(hold)
+                    expired.append(hold)
+        return expired
@@ -0,0 +1,16 @@
+from contextlib import AbstractContextManager, nullcontext
+from typing import Protocol
+
+class Journal(Protocol):
+    """receives every mutation made to a collection, e.g. to log it for recovery"""
+
+    def mutation(self, op: str, fields: dict) -> AbstractContextManager:
+        """wraps a mutation, which is only journaled if the block finishes without raising"""
+
+class NullJournal:
+    """journal for collections that aren't journaled"""
+
+    def mutation(self, op: str, fields: dict):
+        return nullcontext()
+
+NULL_JOURNAL = NullJournal()
@@ -0,0 +1,154 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+from itertools import chain
+
+from models.objects.book import Book
+
+# letters and digits, the same tokens as the unicode61 tokenizer of sqlite fts5
+_TOKEN = re.compile(r"[^\W_]+")
+
+# a prefix only expands to this many tokens, so a one letter query can't turn into a catalog scan
+MAX_PREFIX_TOKENS = 64
+# results returned when the client doesn't give a limit, enough for a typeahead list
+DEFAULT_SEARCH_LIMIT = 10
+# most books matching every term that are ranked for a single query, exact matches are found before prefix matches
+MAX_CANDIDATES = 256
+
+# how much a match in each field is worth, and how much less a prefix match counts
+FIELD_WEIGHTS = {"title": 2.0, "author": 1.0}
+PREFIX_MATCH = 0.5
+
+def tokenize(text: str):
+    return _TOKEN.findall(text.lower())
+
+def parse_terms(query: str, author: str):
+    """(token, whether it matches as a prefix, fields it must be in) for every token of a search"""
+    terms = []
+    for text, fields in ((query, ("title", "author")), (author, ("author",))):
+        tokens = tokenize(text)
+        terms += [(token, i == len(tokens) - 1, fields) for i, token in enumerate(tokens)]
+    return terms
+
+def score_tokens(tokens: dict[str, set[str]], terms: list[tuple[str, bool, tuple[str, ...]]]):
+    """how well a book with the given tokens per field matches every term, 0 when one of them doesn't match"""
+    score = 0.0
+    for token, prefix, fields in terms:
+        best = 0.0
+        for field in fields:
+            if token in tokens[field]:
+                best = max(best, FIELD_WEIGHTS[field])
+            elif prefix and any(t.startswith(token) for t in tokens[field]):
+                best = max(best, FIELD_WEIGHTS[field] * PREFIX_MATCH)
+        if not best:
+            return 0.0
+        score += best
+    return score
+
+def rank(books: Iterable[Book], query: str, author: str, limit: int):
+    """the limit books that best match a search, for stores that find candidates some other way"""
+    terms = parse_terms(query, author)
+    scored = []
+    for book in books:
+        score = score_tokens({"title": set(tokenize(book.title)), "author": set(tokenize(book.author))}, terms)
+        if score:
+            scored.append((score, book.isbn, book))
+    return [book for _, _, book in heapq.nsmallest(limit, scored, key=lambda s: (-s[0], s[1]))]
+
+class _FieldIndex:
+    """inverted index of one field plus the sorted tokens of the field for prefix lookups"""
+
+    def __init__(self):
+        self.postings: dict[str, set[str]] = {}
+        self.tokens: list[str] = []
+
+    def add(self, key: str, tokens: set[str]):
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = set()
+                insort(self.tokens, token)
+            self.postings[token].add(key)
+
+    def prefixed(self, prefix: str):
+        """tokens starting with prefix, at most MAX_PREFIX_TOKENS of them"""
+        start = bisect_left(self.tokens, prefix)
+        end = min(start + MAX_PREFIX_TOKENS, len(self.tokens))
+        return [token for token in self.tokens[start:end] if token.startswith(prefix)]
+
+    def postings_of(self, token: str, prefix: bool):
+        """sets of keys whose field has the token, then when prefix is set sets of keys whose field has a
+        longer token starting with it"""
+        if not prefix:
+            return [self.postings[token]] if token in self.postings else []
+        return [self.postings[prefixed] for prefixed in self.prefixed(token) if prefixed != token]
+
+class SearchIndex:
+    """token index over the title and author of books
+
+    A query matches a book when every query token is in its title or author. The last token of a query
+    also matches tokens it is a prefix of, so results show up while a query is being typed.
+    """
+
+    def __init__(self):
+        self._fields: dict[str, _FieldIndex] = {field: _FieldIndex() for field in FIELD_WEIGHTS}
+        self._tokens: dict[str, dict[str, set[str]]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, title: str, author: str):
+        """indexes a book, books that are already indexed are left as they are"""
+        with self._lock:
+            if key in self._tokens:
+                return
+            tokens = {"title": set(tokenize(title)), "author": set(tokenize(author))}
+            self._tokens[key] = tokens
+            for field, field_tokens in tokens.items():
+                self._fields[field].add(key, field_tokens)
+
+    def _postings(self, token: str, prefix: bool, fields: tuple[str, ...]):
+        """sets of keys matching the term, exact matches first so the best candidates are seen first"""
+        postings = [keys for field in fields for keys in self._fields[field].postings_of(token, False)]
+        if prefix:
+            postings += [keys for field in fields for keys in self._fields[field].postings_of(token, True)]
+        return postings
+
+    def search(self, query: str, author: str, limit: int):
+        """keys of the best matching books, best first
+
+        Args:
+            query (str): tokens to find in the title or author
+            author (str): tokens to find in the author
+            limit (int): most keys returned
+
+        Returns:
+            list[str]: keys ranked by how many tokens matched, where and how exactly
+        """
+        terms = parse_terms(query, author)
+        if not terms:
+            return []
+
+        with self._lock:
+            # every term has to match, so the candidates are the keys in the postings of every term. They are
+            # walked from the most selective term and kept when the other terms' postings have them too
+            term_postings = sorted((self._postings(token, prefix, fields) for token, prefix, fields in terms),
+                                   key=lambda p: sum(len(keys) for keys in p))
+            postings, others = term_postings[0], term_postings[1:]
+            seen: set[str] = set()
+
+            scored = []
+            for key in chain.from_iterable(postings):
+                # a book with several tokens starting with the prefix shows up in several postings
+                if key in seen:
+                    continue
+                seen.add(key)
+                if not all(any(key in keys for keys in other) for other in others):
+                    continue
+                score = score_tokens(self._tokens[key], terms)
+                if score:
+                    scored.append((score, key))
+                    if len(scored) >= MAX_CANDIDATES:
+                        break
+
+        # best score first, equal scores in key order so results are stable
+        return [key for _, key in heapq.nsmallest(limit, scored, key=lambda s: (-s[0], s[1]))]
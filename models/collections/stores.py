@@ -0,0 +1,148 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+from datetime import date
+
+from models.objects.book import Book
+from models.objects.customer import Customer
+from models.objects.checkout import Checkout
+
+# storage backends implement these so app.py doesn't depend on where the library is kept
+
+# where an item is in a store's listing order, only meaningful to the store that gave it out
+type Position = int | str
+
+def start_after(after: Position | None):
+    """index to list from for stores whose positions are indexes into an append only list
+
+    Raises:
+        ValueError: when after isn't such an index
+    """
+    if after is None:
+        return 0
+    if type(after) is not int or after < 0:
+        raise ValueError(f"{after} is not a position")
+    return after + 1
+
+class BookStore(ABC):
+    @abstractmethod
+    def reset(self): ...
+
+    @abstractmethod
+    def add_book(self, title: str, author: str, isbn: str, copies: int) -> Book:
+        """adds a book, or more copies of it when the isbn already exists"""
+
+    @abstractmethod
+    def add_books(self, books: list[dict]): ...
+
+    @abstractmethod
+    def get_book(self, isbn: str) -> Book:
+        """raises HTTPException(HTTPStatus.NOT_FOUND/404) when the isbn doesn't exist"""
+
+    @abstractmethod
+    def get_books(self) -> Iterable[Book]: ...
+
+    @abstractmethod
+    def page_books(self, after: Position | None, limit: int) -> Iterator[tuple[Position, Book]]:
+        """yields (position, book) for up to limit books listed after the book at position after, or from the
+        first book when after is None. Adding books doesn't move the ones already listed. Raises ValueError
+        before yielding anything when after isn't a position this store gave out"""
+
+    @abstractmethod
+    def contains_isbn(self, isbn: str) -> bool: ...
+
+    @abstractmethod
+    def search(self, query: str, author: str, limit: int) -> list[Book]:
+        """up to limit books whose title or author has every token of query and whose author has every token
+        of author, best match first. The last token of each also matches tokens it is a prefix of"""
+
+    @abstractmethod
+    def count_copies(self) -> tuple[int, int]:
+        """copies and available copies of every book added together"""
+
+class CustomerStore(ABC):
+    @abstractmethod
+    def reset(self): ...
+
+    @abstractmethod
+    def add_customer(self, name: str, email: str, customer_id: str) -> Customer:
+        """adds a customer, or updates their information when the customer_id already exists"""
+
+    @abstractmethod
+    def add_customers(self, customers: list[dict]): ...
+
+    @abstractmethod
+    def get_customer(self, customer_id: str) -> Customer:
+        """raises HTTPException(HTTPStatus.NOT_FOUND/404) when the customer_id doesn't exist"""
+
+    @abstractmethod
+    def get_customers(self) -> Iterable[Customer]: ...
+
+    @abstractmethod
+    def page_customers(self, after: Position | None, limit: int) -> Iterator[tuple[Position, Customer]]:
+        """like BookStore.page_books for customers"""
+
+    @abstractmethod
+    def contains_customer_id(self, customer_id: str) -> bool: ...
+
+    @abstractmethod
+    def count_at_limit(self, limit: int) -> int:
+        """number of customers with limit or more books checked out"""
+
+class CheckoutStore(ABC):
+    @abstractmethod
+    def reset(self): ...
+
+    @abstractmethod
+    def add_checkout(self, checkout: Checkout):
+        """stores the checkout and takes a copy of its book and a slot of its customer's limit"""
+
+    @abstractmethod
+    def add_checkouts(self, checkouts: list[Checkout]):
+        """adds every checkout, or none of them if the store fails partway through"""
+
+    @abstractmethod
+    def get_by_id(self, checkout_id: str) -> Checkout:
+        """raises KeyError when the checkout_id doesn't exist"""
+
+    @abstractmethod
+    def get_checkouts(self) -> Iterable[Checkout]: ...
+
+    @abstractmethod
+    def page_checkouts(self, after: Position | None, limit: int) -> Iterator[tuple[Position, Checkout]]:
+        """like BookStore.page_books for active checkouts, in the order they were made"""
+
+    @abstractmethod
+    def get_by_customer_id(self, customer_id: str) -> list[Checkout]:
+        """checkouts of a customer in the order they were made"""
+
+    @abstractmethod
+    def encode_customer_books(self, customer_id: str) -> bytes:
+        """json list of the get_checkout_info of a customer's checkouts, in the order they were made"""
+
+    @abstractmethod
+    def get_by_isbn(self, isbn: str) -> list[Checkout]:
+        """checkouts of a book in the order they were made"""
+
+    @abstractmethod
+    def get_by_isbn_cust_id(self, isbn: str, customer_id: str) -> Checkout: ...
+
+    @abstractmethod
+    def get_by_due_date(self, start: date | None, end: date | None, after: tuple[date, str] | None,
+                        limit: int) -> list[Checkout]:
+        """up to limit checkouts due on or after start and before end, ordered by due_date then by checkout,
+        starting after the (due_date, checkout_id) of the last checkout of the previous page. Raises ValueError
+        when that checkout_id can't be one this store gave out"""
+
+    @abstractmethod
+    def contains_isbn_cust_id(self, isbn: str, customer_id: str) -> bool: ...
+
+    @abstractmethod
+    def return_book(self, isbn: str, customer_id: str) -> dict:
+        """removes the checkout, gives back its copy and slot, and returns the response for the client"""
+
+    @abstractmethod
+    def return_books(self, returns: list[tuple[str, str]]) -> list[dict]: ...
+
+    @abstractmethod
+    def count_active(self) -> int:
+        """number of checkouts that haven't been returned"""
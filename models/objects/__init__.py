@@ -1,11 +1,54 @@
+import hashlib
+from collections.abc import Hashable, Iterable
 from typing import Any, Callable
 
+from flask import json
+
 def identity(x): return x
 type AttributeValidator = Callable[[Any], bool]
 type AttributeTransform = Callable[[Any], Any]
-type AttributeList = list[tuple[Any, AttributeTransform, AttributeValidator]]
+# name, json type, transform, validator
+type AttributeList = list[tuple[str, type, AttributeTransform, AttributeValidator]]
+
+def encode_response(response: dict):
+    """returns the json body of a response and its ETag"""
+    body = json.dumps(response).encode()
+    # hashing the body keeps tags apart across resets and worker processes, which a version can't
+    return body, hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def encode_list(items: Iterable[bytes]):
+    """joins items that are already json into the json list json.dumps would have made of them"""
+    return b"[" + b", ".join(items) + b"]"
+
+class EncodedResponse:
+    """caches the json response of an object with its ETag until the object's version changes
+
+    Subclasses give their response in get_response and bump version whenever it would change.
+    """
+    version: Hashable = 0
+    _encoded: tuple[Hashable, bytes, str] | None = None
+
+    def get_response(self) -> dict: ...
+
+    def get_version(self) -> Hashable:
+        return self.version
+
+    def encode(self):
+        """returns the json response and its ETag, only serialising the response again when the version changed"""
+        # the version is read first so a change while serialising makes the next call serialise again
+        version = self.get_version()
+        encoded = self._encoded
+        if encoded is None or encoded[0] != version:
+            encoded = (version, *encode_response(self.get_response()))
+            self._encoded = encoded
+        return encoded[1], encoded[2]
+
+    def __str__(self):
+        return self.encode()[0].decode()
 
+from .ids import IdAllocator, SequentialIds, TimeOrderedIds, LeasedIds, FileCounter, WorkerLease, CHECKOUT_ID_PREFIX
 from .book import Book
 from .customer import Customer
 from .checkout import Checkout
 from.return_book import Return
+from .hold import Hold, WAITING, READY
@@ -1,12 +1,10 @@
-from flask import json
+from models.objects import AttributeList, EncodedResponse, identity
 
-from models.objects import AttributeList, identity
-
-class Book:
-    REQUIRED_ATTRIBUTES: AttributeList = [("title", identity, bool),
-                                            ("author", identity, bool),
-                                            ("isbn", identity, bool),
-                                            ("copies", int, lambda x: x >= 0)]
+class Book(EncodedResponse):
+    REQUIRED_ATTRIBUTES: AttributeList = [("title", str, identity, bool),
+                                            ("author", str, identity, bool),
+                                            ("isbn", str, identity, bool),
+                                            ("copies", int, identity, lambda x: x >= 0)]
 
     def __init__(self, title: str, author: str, isbn: str, copies: int):
         self.title: str = title
@@ -14,16 +12,20 @@ class Book:
         self.isbn: str = isbn
         self.copies: int = copies
         self.available_copies: int = copies
+        self.version: int = 0
 
     def checkout_book(self):
         self.available_copies -= 1
+        self.version += 1
 
     def return_book(self):
         self.available_copies += 1
+        self.version += 1
 
     def add_more_books(self, copies):
         self.copies += copies
         self.available_copies += copies
+        self.version += 1
 
     def get_response(self):
         return {
@@ -33,6 +35,3 @@ class Book:
             "copies": self.copies,
             "available_copies": self.available_copies
         }
-
-    def __str__(self):
-        return json.dumps(self.get_response())
@@ -5,14 +5,17 @@ from flask import json
 from models.objects.book import Book
 from models.objects.customer import Customer
 from models.objects import AttributeList, identity
+from models.objects.ids import IdAllocator, SequentialIds
 
 class Checkout:
-    REQUIRED_ATTRIBUTES: AttributeList = [("isbn", identity, bool), 
-                                            ("customer_id", identity, bool),
-                                            ("due_date", date.fromisoformat, lambda x: x >= date.today())]
-    checkout_id = 1
+    REQUIRED_ATTRIBUTES: AttributeList = [("isbn", str, identity, bool), 
+                                            ("customer_id", str, identity, bool),
+                                            ("due_date", str, date.fromisoformat, lambda x: x >= date.today())]
+    # hands out the ids of new checkouts, app.py picks one that suits how many processes make checkouts
+    ids: IdAllocator = SequentialIds()
 
-    def __init__(self, book: Book, customer: Customer, isbn: str, customer_id: str, due_date: date):
+    def __init__(self, book: Book, customer: Customer, isbn: str, customer_id: str, due_date: date,
+                 checkout_id: str | None = None, checkout_date: date | None = None):
         # we would be able to get these with sql join, with
         # in memory we'll settle to make our lives easier
         self.book: Book = book
@@ -20,10 +23,12 @@ class Checkout:
 
         self.isbn: str = isbn
         self.customer_id: str = customer_id
-        self.checkout_id: str = f"CKO{Checkout.checkout_id}"
-        Checkout.checkout_id += 1
+        # checkout_id and checkout_date are only given when restoring a checkout that already existed
+        if checkout_id is None:
+            checkout_id = Checkout.ids.next_id()
+        self.checkout_id: str = checkout_id
 
-        self.checkout_date: date = date.today()
+        self.checkout_date: date = checkout_date or date.today()
         self.due_date: date = due_date
 
     def get_response(self):
@@ -45,5 +50,18 @@ class Checkout:
             "due_date": date.isoformat(self.due_date)
         }
 
+    def encode_checkout_info(self):
+        # stores can encode checkouts while recovering, outside of an app and its sorted keys
+        return json.dumps(self.get_checkout_info(), sort_keys=True).encode()
+
+    def get_record(self):
+        return {
+            "checkout_id": self.checkout_id,
+            "isbn": self.isbn,
+            "customer_id": self.customer_id,
+            "checkout_date": date.isoformat(self.checkout_date),
+            "due_date": date.isoformat(self.due_date)
+        }
+
     def __str__(self):
         return json.dumps(self.get_response())
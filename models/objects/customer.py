@@ -1,21 +1,21 @@
-from flask import json
+from models.objects import AttributeList, EncodedResponse, identity
 
-from models.objects import AttributeList, identity
-
-class Customer:
-    REQUIRED_ATTRIBUTES: AttributeList = [("name", identity, bool),
-                                            ("email", identity, bool),
-                                            ("customer_id", identity, bool)]
+class Customer(EncodedResponse):
+    REQUIRED_ATTRIBUTES: AttributeList = [("name", str, identity, bool),
+                                            ("email", str, identity, bool),
+                                            ("customer_id", str, identity, bool)]
 
     def __init__(self, name: str, email: str, customer_id: str):
         self.name: str = name
         self.email: str = email
         self.customer_id: str = customer_id
         self.checkouts: int = 0
+        self.version: int = 0
 
     def update_info(self, name: str, email: str):
         self.name = name
         self.email = email
+        self.version += 1
 
     def checkout_book(self):
         self.checkouts += 1
@@ -29,6 +29,3 @@ class Customer:
             "email": self.email,
             "customer_id": self.customer_id
         }
-
-    def __str__(self):
-        return json.dumps(self.get_response())
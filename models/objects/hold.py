@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from models.objects import AttributeList, identity
+
+# a waiting hold is queued for a copy, a ready hold has a copy set aside until it expires
+WAITING = "waiting"
+READY = "ready"
+
+class Hold:
+    REQUIRED_ATTRIBUTES: AttributeList = [("isbn", str, identity, bool),
+                                            ("customer_id", str, identity, bool)]
+
+    def __init__(self, hold_id: str, isbn: str, customer_id: str, placed_at: datetime):
+        self.hold_id: str = hold_id
+        self.isbn: str = isbn
+        self.customer_id: str = customer_id
+        self.placed_at: datetime = placed_at
+        self.status: str = WAITING
+        self.expires_at: datetime | None = None
+
+    def get_response(self):
+        return {
+            "hold_id": self.hold_id,
+            "isbn": self.isbn,
+            "customer_id": self.customer_id,
+            "status": self.status,
+            "placed_at": self.placed_at.isoformat(timespec="seconds"),
+            "expires_at": self.expires_at.isoformat(timespec="seconds") if self.expires_at else None
+        }
+
+    def get_record(self):
+        return {
+            "hold_id": self.hold_id,
+            "isbn": self.isbn,
+            "customer_id": self.customer_id,
+            "placed_at": self.placed_at.isoformat()
+        }
@@ -0,0 +1,187 @@
+import fcntl
+import itertools
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+CHECKOUT_ID_PREFIX = "CKO"
+
+# time based ids count milliseconds from here, 41 bits of them last until 2093
+EPOCH_MS = 1704067200000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+# ids leased from a persistent counter at a time
+ID_BLOCK_SIZE = 1000
+
+def id_number(checkout_id: str):
+    """the number of a CKO<number> id, or None for ids that aren't"""
+    number = checkout_id.removeprefix(CHECKOUT_ID_PREFIX)
+    return int(number) if number != checkout_id and number.isdigit() else None
+
+class IdAllocator(ABC):
+    """hands out checkout ids, on any number of threads at once
+
+    Allocators are called for every checkout, so they never wait on a lock or another process per id.
+    """
+
+    @abstractmethod
+    def next_id(self) -> str: ...
+
+    def observe(self, checkout_id: str):
+        """called with the ids of restored checkouts, before any new ones are handed out"""
+
+class SequentialIds(IdAllocator):
+    """CKO1, CKO2, ... numbered per process, so only unique when a single process makes checkouts"""
+
+    def __init__(self, start: int = 1):
+        # next() on a count is a single step under the GIL, so threads never see the same number
+        self._numbers = itertools.count(start)
+        self._start: int = start
+
+    def next_id(self):
+        return f"{CHECKOUT_ID_PREFIX}{next(self._numbers)}"
+
+    def observe(self, checkout_id: str):
+        number = id_number(checkout_id)
+        if number is not None and number >= self._start:
+            self._start = number + 1
+            self._numbers = itertools.count(self._start)
+
+class TimeOrderedIds(IdAllocator):
+    """CKO<number> ids unique across processes without coordinating, in roughly the order they were made
+
+    The number is the milliseconds since EPOCH_MS, then the worker id in WORKER_BITS, then a sequence in
+    SEQUENCE_BITS, like snowflake ids. Each process needs its own worker id. The clock is read once at startup
+    and advanced with the monotonic clock, so ids keep increasing if the wall clock is set back while running.
+    The sequence wraps every 4096 ids, so a worker would have to make 4096 checkouts within one millisecond
+    for two of them to collide.
+    """
+
+    def __init__(self, worker_id: int):
+        """
+        Raises:
+            ValueError: when worker_id doesn't fit in WORKER_BITS
+        """
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker id {worker_id} must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id: int = worker_id
+        self._sequence = itertools.count()
+        self._started_ms: int = time.time_ns() // 1_000_000 - EPOCH_MS
+        self._started_monotonic: int = time.monotonic_ns()
+
+    def _now_ms(self):
+        return self._started_ms + (time.monotonic_ns() - self._started_monotonic) // 1_000_000
+
+    def next_id(self):
+        # the clock is read before the sequence, so a thread held up in between takes a later sequence
+        now = self._now_ms()
+        sequence = next(self._sequence) & ((1 << SEQUENCE_BITS) - 1)
+        number = (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | sequence
+        return f"{CHECKOUT_ID_PREFIX}{number}"
+
+class FileCounter:
+    """counter kept in a file, leased from under an fcntl lock so processes sharing the file never overlap"""
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def lease(self, size: int):
+        """returns the first of size numbers no other lease has had or will get"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            text = os.pread(fd, 32, 0).strip()
+            start = int(text) if text else 1
+            data = f"{start + size:<20}\n".encode()
+            os.pwrite(fd, data, 0)
+            os.fsync(fd)
+            return start
+        finally:
+            os.close(fd)
+
+    def advance(self, number: int):
+        """makes sure later leases start after number"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            text = os.pread(fd, 32, 0).strip()
+            if not text or int(text) <= number:
+                os.pwrite(fd, f"{number + 1:<20}\n".encode(), 0)
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class WorkerLease:
+    """a worker id for TimeOrderedIds that no other live process sharing the file holds
+
+    Each worker id is a byte of the file, leased by locking it with fcntl.lockf. The kernel releases the locks of
+    a process when it exits, so the ids of stopped workers are leased again, and a forked child holds none of its
+    parent's locks so it leases an id of its own. The file stays open while the process runs, closing it would
+    release the lock.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.worker_id: int | None = None
+        self._fd: int | None = None
+        self._pid: int | None = None
+
+    def acquire(self):
+        """leases the lowest free worker id, or returns the one this process already holds
+
+        Raises:
+            RuntimeError: when every worker id is held by another process
+
+        Returns:
+            int: the worker id, held until the process exits
+        """
+        if self._pid == os.getpid():
+            return self.worker_id
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        for worker_id in range(MAX_WORKER_ID + 1):
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, worker_id)
+            except OSError:
+                continue
+            self.worker_id, self._pid = worker_id, os.getpid()
+            return worker_id
+        raise RuntimeError(f"all {MAX_WORKER_ID + 1} worker ids in {self.path} are held by other processes")
+
+class LeasedIds(IdAllocator):
+    """dense CKO<number> ids from blocks leased from a FileCounter shared by every process
+
+    Threads take an index from a count and find its number in the block it falls in, only the first thread
+    to reach a block leases it. Ids are unique and survive restarts, a process that stops leaves the rest of
+    its block unused.
+    """
+
+    def __init__(self, counter: FileCounter, block_size: int = ID_BLOCK_SIZE):
+        self.counter: FileCounter = counter
+        self.block_size: int = block_size
+        self._indexes = itertools.count()
+        # first number of each block by its index, a thread can still be using an old block so none are dropped
+        self._blocks: dict[int, int] = {}
+        # only taken once per block
+        self._lease_lock = threading.Lock()
+
+    def _block(self, block: int):
+        start = self._blocks.get(block)
+        if start is None:
+            with self._lease_lock:
+                start = self._blocks.get(block)
+                if start is None:
+                    start = self.counter.lease(self.block_size)
+                    self._blocks[block] = start
+        return start
+
+    def next_id(self):
+        block, offset = divmod(next(self._indexes), self.block_size)
+        return f"{CHECKOUT_ID_PREFIX}{self._block(block) + offset}"
+
+    def observe(self, checkout_id: str):
+        number = id_number(checkout_id)
+        if number is not None:
+            self.counter.advance(number)
@@ -2,5 +2,5 @@ from models.objects import AttributeList, identity
 
 
 class Return():
-    REQUIRED_ATTRIBUTES: AttributeList = [("isbn", identity, bool),
-                                            ("customer_id", identity, bool)]
+    REQUIRED_ATTRIBUTES: AttributeList = [("isbn", str, identity, bool),
+                                            ("customer_id", str, identity, bool)]
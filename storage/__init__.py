@@ -0,0 +1,5 @@
+from .wal import WriteAheadLog
+from .persistence import Persistence, SNAPSHOT_INTERVAL
+from .sqlite import SQLiteEngine, SQLiteBooks, SQLiteCustomers, SQLiteCheckouts
+from .shared import SharedRegion, SharedBooks, SharedCustomers, SharedCheckouts
+from .columnar import ColumnarBooks, ColumnarCustomers, ColumnarCheckouts
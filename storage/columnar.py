@@ -0,0 +1,555 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import date
+from http import HTTPStatus
+
+from werkzeug.exceptions import HTTPException
+
+from models import Checkout, BookStore, CustomerStore, CheckoutStore
+from models.collections import DueDateIndex, Position, SearchIndex, start_after
+from models.objects import encode_list, encode_response
+from models.objects.ids import CHECKOUT_ID_PREFIX, id_number
+
+# rows and ids are int32, counters int64, dates are stored as date.toordinal() days
+ROW = "i"
+COUNTER = "q"
+NO_ROW = -1
+
+class KeyTable:
+    """interns string keys as consecutive integer ids, the ids index the columns of a store"""
+
+    __slots__ = ("ids", "keys")
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.keys: list[str] = []
+
+    def add(self, key: str):
+        key_id = len(self.keys)
+        self.keys.append(key)
+        self.ids[key] = key_id
+        return key_id
+
+    def __len__(self):
+        return len(self.keys)
+
+class _View:
+    """stands in for a Book, Customer or Checkout by pointing at its row, made on demand and never stored"""
+
+    __slots__ = ("_store", "_id")
+
+    def __init__(self, store, row_id: int):
+        self._store = store
+        self._id: int = row_id
+
+    def get_response(self) -> dict: ...
+
+    def encode(self):
+        return encode_response(self.get_response())
+
+    def __str__(self):
+        return self.encode()[0].decode()
+
+class BookView(_View):
+    __slots__ = ()
+
+    @property
+    def title(self):
+        return self._store._titles[self._id]
+
+    @property
+    def author(self):
+        return self._store._authors[self._id]
+
+    @property
+    def isbn(self):
+        return self._store._isbns.keys[self._id]
+
+    @property
+    def copies(self):
+        return self._store._copies[self._id]
+
+    @property
+    def available_copies(self):
+        return self._store._available_copies[self._id]
+
+    def checkout_book(self):
+        self._store._available_copies[self._id] -= 1
+
+    def return_book(self):
+        self._store._available_copies[self._id] += 1
+
+    def add_more_books(self, copies: int):
+        self._store._copies[self._id] += copies
+        self._store._available_copies[self._id] += copies
+
+    def get_response(self):
+        return {
+            "title": self.title,
+            "author": self.author,
+            "isbn": self.isbn,
+            "copies": self.copies,
+            "available_copies": self.available_copies
+        }
+
+class CustomerView(_View):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self._store._names[self._id]
+
+    @property
+    def email(self):
+        return self._store._emails[self._id]
+
+    @property
+    def customer_id(self):
+        return self._store._customer_ids.keys[self._id]
+
+    @property
+    def checkouts(self):
+        return self._store._checkouts[self._id]
+
+    def update_info(self, name: str, email: str):
+        self._store._names[self._id] = name
+        self._store._emails[self._id] = email
+
+    def checkout_book(self):
+        self._store._checkouts[self._id] += 1
+
+    def return_book(self):
+        self._store._checkouts[self._id] -= 1
+
+    def get_response(self):
+        return {
+            "name": self.name,
+            "email": self.email,
+            "customer_id": self.customer_id
+        }
+
+class CheckoutView(_View):
+    __slots__ = ()
+
+    @property
+    def checkout_id(self):
+        return f"{CHECKOUT_ID_PREFIX}{self._store._numbers[self._id]}"
+
+    @property
+    def book(self):
+        return BookView(self._store._books, self._store._book_ids[self._id])
+
+    @property
+    def customer(self):
+        return CustomerView(self._store._customers, self._store._customer_ids[self._id])
+
+    @property
+    def isbn(self):
+        return self._store._books._isbns.keys[self._store._book_ids[self._id]]
+
+    @property
+    def customer_id(self):
+        return self._store._customers._customer_ids.keys[self._store._customer_ids[self._id]]
+
+    @property
+    def checkout_date(self):
+        return date.fromordinal(self._store._checkout_days[self._id])
+
+    @property
+    def due_date(self):
+        return date.fromordinal(self._store._due_days[self._id])
+
+    get_response = Checkout.get_response
+    get_checkout_info = Checkout.get_checkout_info
+    encode_checkout_info = Checkout.encode_checkout_info
+    get_record = Checkout.get_record
+
+class ColumnarBooks(BookStore):
+    def __init__(self):
+        self._isbns: KeyTable = KeyTable()
+        self._titles: list[str] = []
+        # authors repeat across books, interning keeps one copy of each
+        self._authors: list[str] = []
+        self._copies: array = array(COUNTER)
+        self._available_copies: array = array(COUNTER)
+        self._index: SearchIndex = SearchIndex()
+        # new books append to every column, which has to happen as one step
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.__init__()
+
+    def id_of(self, isbn: str):
+        return self._isbns.ids.get(isbn)
+
+    def add_book(self, title: str, author: str, isbn: str, copies: int):
+        book_id = self._isbns.ids.get(isbn)
+        # if book exists already, add more copies
+        if book_id is not None:
+            book = BookView(self, book_id)
+            book.add_more_books(copies)
+            return book
+
+        with self._lock:
+            self._titles.append(title)
+            self._authors.append(sys.intern(author))
+            self._copies.append(copies)
+            self._available_copies.append(copies)
+            book_id = self._isbns.add(isbn)
+        self._index.add(isbn, title, author)
+        return BookView(self, book_id)
+
+    def add_books(self, books: list[dict]):
+        for book in books:
+            self.add_book(book["title"], book["author"], book["isbn"], book["copies"])
+
+    def get_book(self, isbn: str):
+        book_id = self._isbns.ids.get(isbn)
+        if book_id is None:
+            e = HTTPException(f"ISBN: {isbn} not found in library!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+
+        return BookView(self, book_id)
+
+    def get_books(self):
+        return [BookView(self, book_id) for book_id in range(len(self._isbns))]
+
+    def page_books(self, after: Position | None, limit: int):
+        # ids are handed out in the order books are added, so they are the positions
+        start = start_after(after)
+        return ((book_id, BookView(self, book_id)) for book_id in range(start, min(start + limit, len(self._isbns))))
+
+    def contains_isbn(self, isbn: str):
+        return isbn in self._isbns.ids
+
+    def search(self, query: str, author: str, limit: int):
+        return [self.get_book(isbn) for isbn in self._index.search(query, author, limit)]
+
+    def count_copies(self):
+        return sum(self._copies), sum(self._available_copies)
+
+class ColumnarCustomers(CustomerStore):
+    def __init__(self):
+        self._customer_ids: KeyTable = KeyTable()
+        self._names: list[str] = []
+        self._emails: list[str] = []
+        self._checkouts: array = array(COUNTER)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.__init__()
+
+    def id_of(self, customer_id: str):
+        return self._customer_ids.ids.get(customer_id)
+
+    def add_customer(self, name: str, email: str, customer_id: str):
+        row_id = self._customer_ids.ids.get(customer_id)
+        # if customer exists already, update information
+        if row_id is not None:
+            customer = CustomerView(self, row_id)
+            customer.update_info(name, email)
+            return customer
+
+        with self._lock:
+            self._names.append(name)
+            self._emails.append(email)
+            self._checkouts.append(0)
+            row_id = self._customer_ids.add(customer_id)
+        return CustomerView(self, row_id)
+
+    def add_customers(self, customers: list[dict]):
+        for customer in customers:
+            self.add_customer(customer["name"], customer["email"], customer["customer_id"])
+
+    def get_customer(self, customer_id: str):
+        row_id = self._customer_ids.ids.get(customer_id)
+        if row_id is None:
+            e = HTTPException(f"customer_id: {customer_id} not found in customers!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+        return CustomerView(self, row_id)
+
+    def get_customers(self):
+        return [CustomerView(self, row_id) for row_id in range(len(self._customer_ids))]
+
+    def page_customers(self, after: Position | None, limit: int):
+        start = start_after(after)
+        return ((row_id, CustomerView(self, row_id))
+                for row_id in range(start, min(start + limit, len(self._customer_ids))))
+
+    def contains_customer_id(self, customer_id: str):
+        return customer_id in self._customer_ids.ids
+
+    def count_at_limit(self, limit: int):
+        return sum(1 for checkouts in self._checkouts if checkouts >= limit)
+
+class _RowList:
+    """doubly linked lists of checkout rows, one per book or customer id, kept in arrays
+
+    Appending and unlinking are constant time and a book or customer without checkouts costs two ints.
+    """
+
+    __slots__ = ("head", "tail", "prev", "next")
+
+    def __init__(self):
+        self.head: array = array(ROW)
+        self.tail: array = array(ROW)
+        self.prev: array = array(ROW)
+        self.next: array = array(ROW)
+
+    def append(self, owner: int, row: int):
+        """links row after the owner's last row, row is either new or one that was unlinked"""
+        if owner >= len(self.head):
+            grow = owner + 1 - len(self.head)
+            self.head.extend([NO_ROW] * grow)
+            self.tail.extend([NO_ROW] * grow)
+
+        last = self.tail[owner]
+        if row < len(self.prev):
+            self.prev[row], self.next[row] = last, NO_ROW
+        else:
+            self.prev.append(last)
+            self.next.append(NO_ROW)
+        if last == NO_ROW:
+            self.head[owner] = row
+        else:
+            self.next[last] = row
+        self.tail[owner] = row
+
+    def unlink(self, owner: int, row: int):
+        previous, following = self.prev[row], self.next[row]
+        if previous == NO_ROW:
+            self.head[owner] = following
+        else:
+            self.next[previous] = following
+        if following == NO_ROW:
+            self.tail[owner] = previous
+        else:
+            self.prev[following] = previous
+
+    def rows(self, owner: int):
+        """rows of the owner in the order they were appended"""
+        row = self.head[owner] if owner < len(self.head) else NO_ROW
+        while row != NO_ROW:
+            yield row
+            row = self.next[row]
+
+    def rows_reversed(self, owner: int):
+        row = self.tail[owner] if owner < len(self.tail) else NO_ROW
+        while row != NO_ROW:
+            yield row
+            row = self.prev[row]
+
+class ColumnarCheckouts(CheckoutStore):
+    """active checkouts as rows of int columns
+
+    A returned checkout's row goes on a free list and the next checkout reuses it, so the columns only grow with
+    the most checkouts active at once. Each row costs a few dozen bytes however many checkouts there are. Ids come
+    from Checkout.ids like the in memory store, and are kept as the number of their CKO<number>.
+    """
+
+    def __init__(self, books: ColumnarBooks, customers: ColumnarCustomers):
+        self._books: ColumnarBooks = books
+        self._customers: ColumnarCustomers = customers
+
+        self._book_ids: array = array(ROW)
+        self._customer_ids: array = array(ROW)
+        self._checkout_days: array = array(ROW)
+        self._due_days: array = array(ROW)
+        self._numbers: array = array(COUNTER)
+        # order the checkout in the row was made in, NO_ROW for free rows
+        self._sequences: array = array(COUNTER)
+        self._rows_by_number: dict[int, int] = {}
+        self._free_rows: array = array(ROW)
+        self._by_book: _RowList = _RowList()
+        self._by_customer: _RowList = _RowList()
+        # id numbers by due day, so checkouts are ordered by due date then by id
+        self._by_due_date: DueDateIndex = DueDateIndex(lambda: array(COUNTER))
+        # (sequence, row) of active checkouts in the order they were made, the sequence is the position when
+        # listing. returned checkouts are left in place and skipped, and dropped once they outnumber the rest
+        self._order_sequences: array = array(COUNTER)
+        self._order_rows: array = array(ROW)
+        self._returned_in_order: int = 0
+        self._next_sequence: int = 0
+        self._active: int = 0
+        # rows and the indexes that span books and customers change together
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.__init__(self._books, self._customers)
+
+    def _columns(self):
+        return (self._book_ids, self._customer_ids, self._checkout_days, self._due_days, self._numbers,
+                self._sequences)
+
+    def add_checkout(self, checkout: Checkout):
+        book_id = self._books.id_of(checkout.isbn)
+        customer_id = self._customers.id_of(checkout.customer_id)
+        if book_id is None or customer_id is None:
+            raise KeyError((checkout.isbn, checkout.customer_id))
+        number = id_number(checkout.checkout_id)
+        if number is None:
+            e = HTTPException(f"checkout_id: {checkout.checkout_id} is not {CHECKOUT_ID_PREFIX} followed by a number!")
+            e.code = HTTPStatus.BAD_REQUEST
+            raise e
+        due_day = checkout.due_date.toordinal()
+
+        with self._lock:
+            if number in self._rows_by_number:
+                e = HTTPException(f"checkout_id: {checkout.checkout_id} already exists!")
+                e.code = HTTPStatus.CONFLICT
+                raise e
+
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            values = (book_id, customer_id, checkout.checkout_date.toordinal(), due_day, number, sequence)
+            if self._free_rows:
+                row = self._free_rows.pop()
+                for column, value in zip(self._columns(), values):
+                    column[row] = value
+            else:
+                row = len(self._numbers)
+                for column, value in zip(self._columns(), values):
+                    column.append(value)
+
+            self._rows_by_number[number] = row
+            self._by_book.append(book_id, row)
+            self._by_customer.append(customer_id, row)
+            self._by_due_date.add(due_day, number)
+            self._order_sequences.append(sequence)
+            self._order_rows.append(row)
+            self._books._available_copies[book_id] -= 1
+            self._customers._checkouts[customer_id] += 1
+            self._active += 1
+
+    def add_checkouts(self, checkouts: list[Checkout]):
+        added: list[Checkout] = []
+        try:
+            for checkout in checkouts:
+                self.add_checkout(checkout)
+                added.append(checkout)
+        except Exception:
+            for checkout in reversed(added):
+                self.return_book(checkout.isbn, checkout.customer_id)
+            raise
+
+    def get_by_id(self, checkout_id: str):
+        number = id_number(checkout_id)
+        row = None if number is None else self._rows_by_number.get(number)
+        if row is None:
+            raise KeyError(checkout_id)
+        return CheckoutView(self, row)
+
+    def get_checkouts(self):
+        return [checkout for _, checkout in self.page_checkouts(None, self._next_sequence)]
+
+    def page_checkouts(self, after: Position | None, limit: int):
+        page: list[tuple[int, CheckoutView]] = []
+        with self._lock:
+            sequences, rows = self._order_sequences, self._order_rows
+            for index in range(bisect_left(sequences, start_after(after)), len(sequences)):
+                if len(page) == limit:
+                    break
+                # returned checkouts are skipped, their row is free or holds a later checkout
+                sequence, row = sequences[index], rows[index]
+                if self._sequences[row] == sequence:
+                    page.append((sequence, CheckoutView(self, row)))
+        return iter(page)
+
+    def get_by_customer_id(self, customer_id: str):
+        owner = self._customers.id_of(customer_id)
+        if owner is None: return []
+        return [CheckoutView(self, row) for row in self._by_customer.rows(owner)]
+
+    def encode_customer_books(self, customer_id: str):
+        return encode_list(checkout.encode_checkout_info() for checkout in self.get_by_customer_id(customer_id))
+
+    def get_by_isbn(self, isbn: str):
+        owner = self._books.id_of(isbn)
+        if owner is None: return []
+        return [CheckoutView(self, row) for row in self._by_book.rows(owner)]
+
+    def _find(self, isbn: str, customer_id: str):
+        """row of the latest checkout of the book by the customer, like the in memory index, or NO_ROW"""
+        book_id = self._books.id_of(isbn)
+        owner = self._customers.id_of(customer_id)
+        if book_id is None or owner is None:
+            return NO_ROW
+        # a customer only has a handful of checkouts at a time
+        for row in self._by_customer.rows_reversed(owner):
+            if self._book_ids[row] == book_id:
+                return row
+        return NO_ROW
+
+    def get_by_isbn_cust_id(self, isbn: str, customer_id: str):
+        row = self._find(isbn, customer_id)
+        if row == NO_ROW:
+            raise KeyError((isbn, customer_id))
+        return CheckoutView(self, row)
+
+    def get_by_due_date(self, start: date | None, end: date | None, after: tuple[date, str] | None, limit: int):
+        after_key = None
+        if after is not None:
+            number = id_number(after[1])
+            if number is None:
+                raise ValueError(f"checkout_id: {after[1]} is not {CHECKOUT_ID_PREFIX} followed by a number")
+            after_key = (after[0].toordinal(), number)
+        with self._lock:
+            keys = self._by_due_date.page(None if start is None else start.toordinal(),
+                                          None if end is None else end.toordinal(), after_key, limit)
+            rows = [self._rows_by_number[number] for _, number in keys]
+
+        return [CheckoutView(self, row) for row in rows]
+
+    def contains_isbn_cust_id(self, isbn: str, customer_id: str):
+        return self._find(isbn, customer_id) != NO_ROW
+
+    def return_book(self, isbn: str, customer_id: str):
+        with self._lock:
+            row = self._find(isbn, customer_id)
+            if row == NO_ROW:
+                raise KeyError((isbn, customer_id))
+
+            book_id, owner, number = self._book_ids[row], self._customer_ids[row], self._numbers[row]
+            self._by_book.unlink(book_id, row)
+            self._by_customer.unlink(owner, row)
+            self._by_due_date.remove(self._due_days[row], number)
+            del self._rows_by_number[number]
+            # the other columns keep their values until the row is reused, so views made before still read them
+            self._sequences[row] = NO_ROW
+            self._free_rows.append(row)
+            self._books._available_copies[book_id] += 1
+            self._customers._checkouts[owner] -= 1
+            self._active -= 1
+
+            self._returned_in_order += 1
+            if self._returned_in_order * 2 > len(self._order_sequences):
+                self._compact_order()
+
+        response = {
+            "message": "Book returned successfully",
+            "isbn": isbn,
+            "customer_id": customer_id,
+            "return_date": date.today().isoformat()
+        }
+        return response
+
+    def _compact_order(self):
+        """drops returned checkouts from the order they were made in, called under the lock once they are over
+        half of it so each return pays for a constant share of the copy"""
+        sequences, rows = array(COUNTER), array(ROW)
+        for sequence, row in zip(self._order_sequences, self._order_rows):
+            if self._sequences[row] == sequence:
+                sequences.append(sequence)
+                rows.append(row)
+        self._order_sequences, self._order_rows = sequences, rows
+        self._returned_in_order = 0
+
+    def return_books(self, returns: list[tuple[str, str]]):
+        return [self.return_book(isbn, customer_id) for isbn, customer_id in returns]
+
+    def count_active(self):
+        return self._active
@@ -0,0 +1,186 @@
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import TYPE_CHECKING
+
+from api.locks import ReadWriteLock
+from models import Books, Customers, Checkouts, Checkout, Holds
+from storage.wal import WriteAheadLog
+
+if TYPE_CHECKING:
+    # api.analytics imports the storage package, it can't be imported while this module loads
+    from api.analytics import CirculationLog, History
+
+# number of logged mutations between snapshots, bounds how much log is replayed on startup
+SNAPSHOT_INTERVAL = 10000
+
+def _snapshot_records(books: list[tuple[str, str, str, int]], customers: list[tuple[str, str, str]],
+                      checkouts: Iterable[Checkout], holds: list[tuple[dict, datetime | None]],
+                      history: "History | None") -> Iterator[dict]:
+    # books are added with all of their copies, replaying the checkouts takes the copies back out
+    for title, author, isbn, copies in books:
+        yield {"op": "add_book", "title": title, "author": author, "isbn": isbn, "copies": copies}
+    for name, email, customer_id in customers:
+        yield {"op": "add_customer", "name": name, "email": email, "customer_id": customer_id}
+    for checkout in checkouts:
+        yield {"op": "add_checkout", **checkout.get_record()}
+    # holds are placed again in the order they were placed, which is the order of their queues
+    for record, expires_at in holds:
+        yield {"op": "place_hold", **record}
+        if expires_at is not None:
+            yield {"op": "ready_hold", "hold_id": record["hold_id"], "expires_at": expires_at.isoformat()}
+    if history is None:
+        return
+    # the circulation history keeps the returned loans the stores have forgotten, so every event is written
+    for isbn, day, due in zip(history.checkout_isbn.tolist(), history.checkout_day.tolist(),
+                              history.checkout_due.tolist()):
+        yield {"op": "log_checkout", "isbn": history.isbn(isbn), "checkout_date": date.fromordinal(day).isoformat(),
+               "due_date": date.fromordinal(due).isoformat()}
+    for isbn, day, start, due in zip(history.return_isbn.tolist(), history.return_day.tolist(),
+                                     history.return_start.tolist(), history.return_due.tolist()):
+        yield {"op": "log_return", "isbn": history.isbn(isbn), "checkout_date": date.fromordinal(start).isoformat(),
+               "due_date": date.fromordinal(due).isoformat(), "return_date": date.fromordinal(day).isoformat()}
+
+class Persistence:
+    """journal for the collections that logs their mutations and rebuilds them on startup"""
+
+    def __init__(self, wal: WriteAheadLog, snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.wal: WriteAheadLog = wal
+        self.snapshot_interval: int = snapshot_interval
+
+        self._books: Books | None = None
+        self._customers: Customers | None = None
+        self._checkouts: Checkouts | None = None
+        self._holds: Holds | None = None
+        self._circulation: "CirculationLog | None" = None
+        self._since_snapshot: int = 0
+        self._since_snapshot_lock = threading.Lock()
+        self._replaying: bool = False
+
+        # mutations share the gate, a snapshot holds it alone so it sees every logged mutation and no others
+        self._gate = ReadWriteLock()
+
+    @contextmanager
+    def mutation(self, op: str, fields: dict) -> Iterator[None]:
+        """logs a mutation made by a collection in the block, taking a snapshot every snapshot_interval mutations
+
+        Args:
+            op (str): name of the mutation, one of the keys of _apply's dispatch
+            fields (dict): json serializable arguments needed to make the mutation again
+        """
+        if self._replaying:
+            yield
+            return
+
+        with self._gate.shared():
+            yield
+            self.wal.append({"op": op, **fields})
+
+            with self._since_snapshot_lock:
+                self._since_snapshot += 1
+                snapshot_due = self._since_snapshot >= self.snapshot_interval
+
+        # taken once the gate is released so the snapshot can wait for the other mutations to finish
+        if snapshot_due:
+            self.snapshot(only_if_due=True)
+
+    def snapshot(self, only_if_due: bool = False):
+        """queues a snapshot of the collections as they are right now
+
+        Args:
+            only_if_due (bool, optional): skip the snapshot when another thread already took the one that was
+            due. Defaults to False.
+        """
+        with self._gate.exclusive():
+            if only_if_due and self._since_snapshot < self.snapshot_interval:
+                return
+            self._snapshot()
+
+    def _snapshot(self):
+        self._since_snapshot = 0
+
+        # only the fields that can change are copied while mutations wait, checkouts never change once made.
+        # The records are made and written one at a time by the log's writer thread after the gate is released
+        books = [(b.title, b.author, b.isbn, b.copies) for b in self._books.get_books()]
+        customers = [(c.name, c.email, c.customer_id) for c in self._customers.get_customers()]
+        holds = [(h.get_record(), h.expires_at) for h in self._holds.get_holds()] if self._holds is not None else []
+        # the history's columns are only ever appended to, so the slices taken now stay as they are
+        history = self._circulation.snapshot() if self._circulation is not None else None
+        self.wal.snapshot(_snapshot_records(books, customers, self._checkouts.get_checkouts(), holds, history))
+
+    def recover(self, books: Books, customers: Customers, checkouts: Checkouts, holds: Holds | None = None,
+                circulation: "CirculationLog | None" = None):
+        """replays the latest snapshot and the log after it into empty collections, then starts logging
+
+        Args:
+            books (Books): collection journaled by this persistence
+            customers (Customers): collection journaled by this persistence
+            checkouts (Checkouts): collection journaled by this persistence
+            holds (Holds | None, optional): holds journaled by this persistence. Defaults to None.
+            circulation (CirculationLog | None, optional): circulation history journaled by this persistence.
+            Defaults to None.
+        """
+        self._books = books
+        self._customers = customers
+        self._checkouts = checkouts
+        self._holds = holds
+        self._circulation = circulation
+
+        self._replaying = True
+        try:
+            for record in self.wal.recover():
+                self._apply(record)
+        finally:
+            self._replaying = False
+        # the snapshot itself doesn't count towards the next one, only the log replayed after it
+        self._since_snapshot = self.wal.replayed
+
+        self.wal.start()
+
+    def close(self):
+        self.wal.close()
+
+    def _apply(self, record: dict):
+        match record["op"]:
+            case "add_book":
+                self._books.add_book(record["title"], record["author"], record["isbn"], record["copies"])
+            case "add_customer":
+                self._customers.add_customer(record["name"], record["email"], record["customer_id"])
+            case "add_checkout":
+                isbn = record["isbn"]
+                customer_id = record["customer_id"]
+                checkout = Checkout(self._books.get_book(isbn), self._customers.get_customer(customer_id),
+                                    isbn, customer_id, date.fromisoformat(record["due_date"]),
+                                    checkout_id=record["checkout_id"],
+                                    checkout_date=date.fromisoformat(record["checkout_date"]))
+                self._checkouts.add_checkout(checkout)
+
+                # new checkouts must not reuse the ids of restored ones
+                Checkout.ids.observe(checkout.checkout_id)
+            case "return_book":
+                self._checkouts.return_book(record["isbn"], record["customer_id"])
+            case "reset_books":
+                self._books.reset()
+            case "reset_customers":
+                self._customers.reset()
+            case "reset_checkouts":
+                self._checkouts.reset()
+            case "place_hold":
+                self._holds.place(record["isbn"], record["customer_id"], datetime.fromisoformat(record["placed_at"]),
+                                  record["hold_id"])
+            case "ready_hold":
+                self._holds.set_ready(record["hold_id"], datetime.fromisoformat(record["expires_at"]))
+            case "remove_hold":
+                self._holds.remove(self._holds.get_by_id(record["hold_id"]))
+            case "reset_holds":
+                self._holds.reset()
+            case "log_checkout":
+                self._circulation.checked_out(record["isbn"], date.fromisoformat(record["checkout_date"]),
+                                              date.fromisoformat(record["due_date"]))
+            case "log_return":
+                self._circulation.returned(record["isbn"], date.fromisoformat(record["checkout_date"]),
+                                           date.fromisoformat(record["due_date"]),
+                                           date.fromisoformat(record["return_date"]))
+            case "reset_circulation":
+                self._circulation.reset()
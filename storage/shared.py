@@ -0,0 +1,748 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date
+from http import HTTPStatus
+
+import numpy as np
+from werkzeug.exceptions import HTTPException
+
+from models import Book, Customer, Checkout, BookStore, CustomerStore, CheckoutStore
+from models.collections import Position, SearchIndex, start_after
+from models.objects import encode_list
+
+MAGIC = b"LIBSHM03"
+# magic, book capacity, customer capacity, checkout rows per customer, book table generation,
+# customer table generation, number of book slots claimed, number of customer slots claimed, checkouts made
+HEADER = struct.Struct("<8sqqqqqqqq")
+HEADER_SIZE = 128
+GENERATION_OFFSET = 32
+CLAIMED_OFFSET = 48
+SEQUENCE_OFFSET = 64
+
+# slot state, key length, data length, key, data
+SLOT = struct.Struct("<BBH60s448s")
+SLOT_EMPTY = 0
+SLOT_USED = 1
+MAX_KEY_SIZE = 60
+MAX_DATA_SIZE = 448
+
+# state, checkout day, due day, sequence, isbn, checkout_id, days are date.toordinal(). The sequence orders
+# checkouts by when they were made across workers
+CHECKOUT_ROW = struct.Struct("<B3xii4xq60s32s4x")
+CHECKOUT_ROW_DTYPE = np.dtype({"names": ["state", "checkout_day", "due_day", "sequence", "isbn", "checkout_id"],
+                               "formats": ["u1", "<i4", "<i4", "<i8", "S60", "S32"],
+                               "offsets": [0, 4, 8, 16, 24, 84], "itemsize": CHECKOUT_ROW.size})
+MAX_CHECKOUT_ID_SIZE = 32
+
+# advisory lock offsets, they don't need to be inside the file
+INIT_LOCK = 0
+TABLE_LOCKS = (1, 2)
+CHECKOUTS_LOCK = 3
+SLOT_LOCK_BASE = 1024
+
+THREAD_LOCK_STRIPES = 256
+
+class SharedRegion:
+    """memory-mapped file shared by every worker process on the host
+
+    fcntl record locks keep other processes out, they don't keep out other threads of the same process
+    so each lock offset also has a striped thread lock.
+    """
+
+    def __init__(self, path: str, book_capacity: int, customer_capacity: int, checkouts_per_customer: int):
+        self.path: str = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = [threading.RLock() for _ in range(THREAD_LOCK_STRIPES)]
+
+        # the first worker to start lays the region out, the others use its capacities
+        with self.locked(INIT_LOCK):
+            if os.fstat(self._fd).st_size == 0:
+                size = HEADER_SIZE + (book_capacity * 3 + customer_capacity * 2) * 8 \
+                    + (book_capacity + customer_capacity) * SLOT.size \
+                    + customer_capacity * checkouts_per_customer * CHECKOUT_ROW.size
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, book_capacity, customer_capacity, checkouts_per_customer,
+                                                0, 0, 0, 0, 0), 0)
+
+            self._mmap = mmap.mmap(self._fd, 0)
+            magic, book_capacity, customer_capacity, checkouts_per_customer, *_ = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a shared library region")
+
+        # counters of each book and customer, then the slots of each table in the order they were claimed
+        counters_end = HEADER_SIZE + (book_capacity * 3 + customer_capacity * 2) * 8
+        self._counters = memoryview(self._mmap)[HEADER_SIZE:counters_end].cast("q")
+        book_counters = self._counters[:book_capacity * 2]
+        customer_counters = self._counters[book_capacity * 2:book_capacity * 2 + customer_capacity]
+        book_order = self._counters[book_capacity * 2 + customer_capacity:book_capacity * 3 + customer_capacity]
+        customer_order = self._counters[book_capacity * 3 + customer_capacity:]
+        self.books = SlotTable(self, 0, book_capacity, 2, book_counters, book_order, counters_end, SLOT_LOCK_BASE)
+        self.customers = SlotTable(self, 1, customer_capacity, 1, customer_counters, customer_order,
+                                   counters_end + book_capacity * SLOT.size, SLOT_LOCK_BASE + book_capacity)
+
+        # each customer's checkouts are in the checkouts_per_customer rows after slot * checkouts_per_customer
+        self.checkouts_per_customer: int = checkouts_per_customer
+        self._rows_offset: int = counters_end + (book_capacity + customer_capacity) * SLOT.size
+        self.checkout_rows: np.ndarray | None = np.frombuffer(
+            self._mmap, CHECKOUT_ROW_DTYPE, customer_capacity * checkouts_per_customer, self._rows_offset)
+
+    @property
+    def mmap(self):
+        return self._mmap
+
+    @contextmanager
+    def locked(self, offset: int) -> Iterator[None]:
+        """holds the lock at offset, which must not be taken again inside the block: the thread lock would let
+        it in, but fcntl locks aren't counted and the inner unlock would let other workers in"""
+        with self._thread_locks[offset % THREAD_LOCK_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def generation(self, table: int):
+        return struct.unpack_from("<q", self._mmap, GENERATION_OFFSET + table * 8)[0]
+
+    def bump_generation(self, table: int):
+        struct.pack_into("<q", self._mmap, GENERATION_OFFSET + table * 8, self.generation(table) + 1)
+
+    def claimed(self, table: int):
+        return struct.unpack_from("<q", self._mmap, CLAIMED_OFFSET + table * 8)[0]
+
+    def set_claimed(self, table: int, claimed: int):
+        struct.pack_into("<q", self._mmap, CLAIMED_OFFSET + table * 8, claimed)
+
+    def next_sequence(self):
+        """the sequence of a new checkout, later than those of every checkout made so far by any worker"""
+        with self.locked(CHECKOUTS_LOCK):
+            sequence = struct.unpack_from("<q", self._mmap, SEQUENCE_OFFSET)[0]
+            struct.pack_into("<q", self._mmap, SEQUENCE_OFFSET, sequence + 1)
+        return sequence
+
+    def checkout_row_offset(self, row: int):
+        return self._rows_offset + row * CHECKOUT_ROW.size
+
+    def reset_checkouts(self):
+        """empties every checkout row for every worker"""
+        with self.locked(CHECKOUTS_LOCK):
+            end = self.checkout_row_offset(len(self.checkout_rows))
+            chunk = CHECKOUT_ROW.size * 8192
+            for offset in range(self._rows_offset, end, chunk):
+                size = min(chunk, end - offset)
+                self._mmap[offset:offset + size] = bytes(size)
+
+    def close(self):
+        self.books.close()
+        self.customers.close()
+        # the array holds an export of the map, which can't be closed while it lives
+        self.checkout_rows = None
+        self._counters.release()
+        self._mmap.close()
+        os.close(self._fd)
+
+class SlotTable:
+    """open addressing hash table from keys to slots, each slot has a few int64 counters and some json data"""
+
+    def __init__(self, region: SharedRegion, table: int, capacity: int, counters_per_slot: int,
+                 counters: memoryview, order: memoryview, slots_offset: int, lock_base: int):
+        self.region: SharedRegion = region
+        self.table: int = table
+        self.capacity: int = capacity
+        self.counters_per_slot: int = counters_per_slot
+        self._counters: memoryview = counters
+        self._order: memoryview = order
+        self._slots_offset: int = slots_offset
+        self._lock_base: int = lock_base
+
+    def _slot_offset(self, slot: int):
+        return self._slots_offset + slot * SLOT.size
+
+    def _probe(self, key: bytes) -> Iterator[tuple[int, int, bytes]]:
+        """yields (slot, state, key) from the key's home slot onwards"""
+        mm = self.region.mmap
+        start = zlib.crc32(key) % self.capacity
+        for i in range(self.capacity):
+            slot = (start + i) % self.capacity
+            offset = self._slot_offset(slot)
+            state, key_len = mm[offset], mm[offset + 1]
+            yield slot, state, mm[offset + 4:offset + 4 + key_len]
+
+    @staticmethod
+    def _encode_key(key: str):
+        encoded = key.encode()
+        if len(encoded) > MAX_KEY_SIZE:
+            e = HTTPException(f"{key} is longer than {MAX_KEY_SIZE} bytes and can't be kept in shared memory")
+            e.code = HTTPStatus.BAD_REQUEST
+            raise e
+        return encoded
+
+    @staticmethod
+    def _encode_data(data: list):
+        encoded = json.dumps(data).encode()
+        if len(encoded) > MAX_DATA_SIZE:
+            e = HTTPException(f"{data} is longer than {MAX_DATA_SIZE} bytes and can't be kept in shared memory")
+            e.code = HTTPStatus.BAD_REQUEST
+            raise e
+        return encoded
+
+    def find(self, key: str):
+        """returns the slot of the key, or None when it isn't in the table"""
+        encoded = self._encode_key(key)
+        for slot, state, slot_key in self._probe(encoded):
+            if state == SLOT_EMPTY:
+                return None
+            if slot_key == encoded:
+                return slot
+        return None
+
+    def claim(self, key: str, data: list):
+        """returns the slot of the key, adding it with data and zeroed counters when it isn't in the table
+
+        Raises:
+            e: HTTPException(HTTPStatus.INSUFFICIENT_STORAGE/507) when the table is full
+        """
+        slot = self.find(key)
+        if slot is not None:
+            return slot
+
+        encoded_key = self._encode_key(key)
+        encoded_data = self._encode_data(data)
+        with self.region.locked(TABLE_LOCKS[self.table]):
+            # another worker may have added it since
+            for slot, state, slot_key in self._probe(encoded_key):
+                if state == SLOT_USED and slot_key == encoded_key:
+                    return slot
+                if state == SLOT_EMPTY:
+                    break
+            else:
+                e = HTTPException(f"Shared memory is full, cannot add {key}")
+                e.code = HTTPStatus.INSUFFICIENT_STORAGE
+                raise e
+
+            for i in range(self.counters_per_slot):
+                self._counters[slot * self.counters_per_slot + i] = 0
+            # the state is written last so lookups never see a half written slot
+            SLOT.pack_into(self.region.mmap, self._slot_offset(slot), SLOT_EMPTY, len(encoded_key),
+                           len(encoded_data), encoded_key, encoded_data)
+            self.region.mmap[self._slot_offset(slot)] = SLOT_USED
+            # the count is written after the slot so claimed_since never hands out a slot that isn't used yet
+            claimed = self.region.claimed(self.table)
+            self._order[claimed] = slot
+            self.region.set_claimed(self.table, claimed + 1)
+            return slot
+
+    def slots(self) -> Iterator[tuple[int, str]]:
+        """yields (slot, key) for every key in the table"""
+        mm = self.region.mmap
+        for slot in range(self.capacity):
+            offset = self._slot_offset(slot)
+            if mm[offset] == SLOT_USED:
+                yield slot, bytes(mm[offset + 4:offset + 4 + mm[offset + 1]]).decode()
+
+    def claimed_since(self, start: int, limit: int | None = None) -> tuple[list[tuple[int, str]], int]:
+        """(slot, key) of the slots claimed after the first start claims, at most limit of them, and the number
+        of claims so far"""
+        mm = self.region.mmap
+        claimed = self.region.claimed(self.table)
+        stop = claimed if limit is None else min(claimed, start + limit)
+        slots = []
+        for slot in self._order[start:stop]:
+            offset = self._slot_offset(slot)
+            slots.append((slot, bytes(mm[offset + 4:offset + 4 + mm[offset + 1]]).decode()))
+        return slots, claimed
+
+    def counters(self, index: int) -> Iterator[int]:
+        """yields one counter of every claimed slot, each read on its own without a lock"""
+        for slot in self._order[:self.region.claimed(self.table)]:
+            yield self._counters[slot * self.counters_per_slot + index]
+
+    def key(self, slot: int):
+        offset = self._slot_offset(slot)
+        mm = self.region.mmap
+        return bytes(mm[offset + 4:offset + 4 + mm[offset + 1]]).decode()
+
+    def locked(self, slot: int):
+        """lock of the slot, held while its counters or data change"""
+        return self.region.locked(self._lock_base + slot)
+
+    def data(self, slot: int) -> list:
+        with self.region.locked(self._lock_base + slot):
+            _, _, data_len, _, data = SLOT.unpack_from(self.region.mmap, self._slot_offset(slot))
+        return json.loads(data[:data_len])
+
+    def set_data(self, slot: int, data: list):
+        encoded = self._encode_data(data)
+        offset = self._slot_offset(slot)
+        with self.region.locked(self._lock_base + slot):
+            struct.pack_into("<H", self.region.mmap, offset + 2, len(encoded))
+            self.region.mmap[offset + 4 + MAX_KEY_SIZE:offset + 4 + MAX_KEY_SIZE + len(encoded)] = encoded
+
+    def counter(self, slot: int, index: int):
+        return self._counters[slot * self.counters_per_slot + index]
+
+    def add(self, slot: int, deltas: tuple[int, ...]):
+        """adds each delta to the slot's counter at the same index, as one step for other workers"""
+        with self.region.locked(self._lock_base + slot):
+            self._add(slot, deltas)
+
+    def _add(self, slot: int, deltas: tuple[int, ...]):
+        """add() for callers that already hold the slot's lock. Taking it again would release the record lock
+        when the inner block ends, as fcntl locks aren't counted, letting other workers in before the outer
+        block is done"""
+        base = slot * self.counters_per_slot
+        for i, delta in enumerate(deltas):
+            self._counters[base + i] += delta
+
+    def try_add(self, slot: int, index: int, delta: int, low: int, high: int):
+        """adds delta to one counter only if the result stays within [low, high], returns whether it did"""
+        position = slot * self.counters_per_slot + index
+        with self.region.locked(self._lock_base + slot):
+            value = self._counters[position] + delta
+            if value < low or value > high:
+                return False
+            self._counters[position] = value
+            return True
+
+    def reset(self):
+        """empties the table for every worker"""
+        with self.region.locked(TABLE_LOCKS[self.table]):
+            for i in range(len(self._counters)):
+                self._counters[i] = 0
+            end = self._slot_offset(self.capacity)
+            chunk = SLOT.size * 1024
+            for offset in range(self._slots_offset, end, chunk):
+                size = min(chunk, end - offset)
+                self.region.mmap[offset:offset + size] = bytes(size)
+            self.region.set_claimed(self.table, 0)
+            self.region.bump_generation(self.table)
+
+    def generation(self):
+        return self.region.generation(self.table)
+
+    def close(self):
+        self._counters.release()
+        self._order.release()
+
+class SharedBook(Book):
+    """book whose copy counters live in shared memory, copies and available_copies are counters 0 and 1"""
+
+    def __init__(self, table: SlotTable, slot: int, title: str, author: str, isbn: str):
+        self.title: str = title
+        self.author: str = author
+        self.isbn: str = isbn
+        self._table: SlotTable = table
+        self._slot: int = slot
+
+    @property
+    def copies(self):
+        return self._table.counter(self._slot, 0)
+
+    @property
+    def available_copies(self):
+        return self._table.counter(self._slot, 1)
+
+    def get_version(self):
+        # other workers change the counters without telling this one
+        return self.copies, self.available_copies
+
+    def checkout_book(self):
+        # another worker may have taken the last copy since app.py checked it
+        if not self._table.try_add(self._slot, 1, -1, 0, self.copies):
+            e = HTTPException(f"Not enough copies of book: {self}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+    def return_book(self):
+        self._table.add(self._slot, (0, 1))
+
+    def add_more_books(self, copies):
+        self._table.add(self._slot, (copies, copies))
+
+class SharedCustomer(Customer):
+    """customer whose information and checkout counter live in shared memory"""
+
+    def __init__(self, table: SlotTable, slot: int, customer_id: str, checkout_limit: int):
+        self.customer_id: str = customer_id
+        self._table: SlotTable = table
+        self._slot: int = slot
+        self._checkout_limit: int = checkout_limit
+
+    @property
+    def name(self):
+        return self._table.data(self._slot)[0]
+
+    @property
+    def email(self):
+        return self._table.data(self._slot)[1]
+
+    @property
+    def checkouts(self):
+        return self._table.counter(self._slot, 0)
+
+    def update_info(self, name: str, email: str):
+        self._table.set_data(self._slot, [name, email])
+
+    def get_version(self):
+        return tuple(self._table.data(self._slot))
+
+    def get_response(self):
+        name, email = self._table.data(self._slot)
+        return {
+            "name": name,
+            "email": email,
+            "customer_id": self.customer_id
+        }
+
+    def checkout_book(self):
+        # another worker may have checked out a book for this customer since app.py checked the limit
+        if not self._table.try_add(self._slot, 0, 1, 0, self._checkout_limit):
+            e = HTTPException(f"Cannot check out more than {self._checkout_limit} for customer: {self}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+    def return_book(self):
+        self._table.add(self._slot, (-1,))
+
+class SharedBooks(BookStore):
+    def __init__(self, region: SharedRegion):
+        self._table: SlotTable = region.books
+        # objects are cached per worker, the generation tells us when another worker reset the table
+        self._books: dict[str, SharedBook] = {}
+        # every worker indexes the books it finds in the claim order, however they were added
+        self._index: SearchIndex = SearchIndex()
+        self._indexed: int = 0
+        self._generation: int = self._table.generation()
+
+    def _cache(self):
+        generation = self._table.generation()
+        if generation != self._generation:
+            self._books = {}
+            self._index = SearchIndex()
+            self._indexed = 0
+            self._generation = generation
+        return self._books
+
+    def _load(self, isbn: str, slot: int):
+        books = self._cache()
+        if isbn not in books:
+            title, author = self._table.data(slot)
+            books[isbn] = SharedBook(self._table, slot, title, author, isbn)
+        return books[isbn]
+
+    def reset(self):
+        self._table.reset()
+
+    def add_book(self, title: str, author: str, isbn: str, copies: int):
+        # if book exists already, add more copies
+        slot = self._table.claim(isbn, [title, author])
+        self._table.add(slot, (copies, copies))
+        return self._load(isbn, slot)
+
+    def add_books(self, books: list[dict]):
+        for book in books:
+            self.add_book(book["title"], book["author"], book["isbn"], book["copies"])
+
+    def get_book(self, isbn: str):
+        book = self._cache().get(isbn)
+        if book is not None:
+            return book
+
+        slot = self._table.find(isbn)
+        if slot is None:
+            e = HTTPException(f"ISBN: {isbn} not found in library!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+
+        return self._load(isbn, slot)
+
+    def get_books(self):
+        for slot, isbn in self._table.slots():
+            yield self._load(isbn, slot)
+
+    def page_books(self, after: Position | None, limit: int):
+        # books are listed in the order they were first added by any worker
+        start = start_after(after)
+        claimed, _ = self._table.claimed_since(start, limit)
+        return ((start + i, self._load(isbn, slot)) for i, (slot, isbn) in enumerate(claimed))
+
+    def contains_isbn(self, isbn: str):
+        return isbn in self._cache() or self._table.find(isbn) is not None
+
+    def search(self, query: str, author: str, limit: int):
+        self._cache()
+        index = self._index
+        claimed, self._indexed = self._table.claimed_since(self._indexed)
+        for slot, isbn in claimed:
+            index.add(isbn, *self._table.data(slot))
+
+        books = []
+        for isbn in index.search(query, author, limit):
+            # the book is gone when another worker reset the table since
+            slot = self._table.find(isbn)
+            if slot is not None:
+                books.append(self._load(isbn, slot))
+        return books
+
+    def count_copies(self):
+        return sum(self._table.counters(0)), sum(self._table.counters(1))
+
+class SharedCustomers(CustomerStore):
+    def __init__(self, region: SharedRegion, checkout_limit: int):
+        self._table: SlotTable = region.customers
+        self._checkout_limit: int = checkout_limit
+        self._customers: dict[str, SharedCustomer] = {}
+        self._generation: int = self._table.generation()
+
+    def _cache(self):
+        generation = self._table.generation()
+        if generation != self._generation:
+            self._customers = {}
+            self._generation = generation
+        return self._customers
+
+    def _load(self, customer_id: str, slot: int):
+        customers = self._cache()
+        if customer_id not in customers:
+            customers[customer_id] = SharedCustomer(self._table, slot, customer_id, self._checkout_limit)
+        return customers[customer_id]
+
+    def reset(self):
+        self._table.reset()
+
+    def add_customer(self, name: str, email: str, customer_id: str):
+        # if customer exists already, update information
+        slot = self._table.claim(customer_id, [name, email])
+        self._table.set_data(slot, [name, email])
+        return self._load(customer_id, slot)
+
+    def add_customers(self, customers: list[dict]):
+        for customer in customers:
+            self.add_customer(customer["name"], customer["email"], customer["customer_id"])
+
+    def get_customer(self, customer_id: str):
+        customer = self._cache().get(customer_id)
+        if customer is not None:
+            return customer
+
+        slot = self._table.find(customer_id)
+        if slot is None:
+            e = HTTPException(f"customer_id: {customer_id} not found in customers!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+
+        return self._load(customer_id, slot)
+
+    def get_customers(self):
+        for slot, customer_id in self._table.slots():
+            yield self._load(customer_id, slot)
+
+    def page_customers(self, after: Position | None, limit: int):
+        start = start_after(after)
+        claimed, _ = self._table.claimed_since(start, limit)
+        return ((start + i, self._load(customer_id, slot)) for i, (slot, customer_id) in enumerate(claimed))
+
+    def contains_customer_id(self, customer_id: str):
+        return customer_id in self._cache() or self._table.find(customer_id) is not None
+
+    def count_at_limit(self, limit: int):
+        return sum(1 for checkouts in self._table.counters(0) if checkouts >= limit)
+
+class SharedCheckouts(CheckoutStore):
+    """checkouts kept in the rows of their customer's slot, each customer has a row for every checkout the
+    limit allows
+
+    A customer's rows are read and changed under the lock of their slot together with their checkout count, so
+    every worker sees the same checkouts and a checkout made by one worker can be returned by any other.
+    Listings across customers scan every row with numpy and don't take locks.
+    """
+
+    def __init__(self, region: SharedRegion, books: SharedBooks, customers: SharedCustomers):
+        self._region: SharedRegion = region
+        self._books: SharedBooks = books
+        self._customers: SharedCustomers = customers
+        self._table: SlotTable = region.customers
+        self._per_customer: int = region.checkouts_per_customer
+
+    def reset(self):
+        self._region.reset_checkouts()
+
+    def _read_row(self, row: int):
+        """(sequence, row, checkout_day, due_day, isbn, checkout_id) of a row, or None when it is free"""
+        state, checkout_day, due_day, sequence, isbn, checkout_id = \
+            CHECKOUT_ROW.unpack_from(self._region.mmap, self._region.checkout_row_offset(row))
+        if state != SLOT_USED:
+            return None
+        return sequence, row, checkout_day, due_day, isbn.rstrip(b"\0").decode(), checkout_id.rstrip(b"\0").decode()
+
+    def _customer_rows(self, slot: int):
+        """the customer's rows that hold a checkout, oldest first"""
+        first = slot * self._per_customer
+        rows = [self._read_row(row) for row in range(first, first + self._per_customer)]
+        return sorted(row for row in rows if row is not None)
+
+    def _checkout(self, customer_id: str, row: tuple):
+        _, _, checkout_day, due_day, isbn, checkout_id = row
+        return Checkout(self._books.get_book(isbn), self._customers.get_customer(customer_id), isbn, customer_id,
+                        date.fromordinal(due_day), checkout_id=checkout_id, checkout_date=date.fromordinal(checkout_day))
+
+    def _checkouts(self, rows: np.ndarray):
+        """checkouts of rows found by a scan, rows freed since the scan are left out"""
+        checkouts = []
+        for row in rows:
+            record = self._read_row(int(row))
+            if record is not None:
+                checkouts.append((record[0], self._checkout(self._table.key(int(row) // self._per_customer), record)))
+        return checkouts
+
+    def _used(self):
+        return self._region.checkout_rows["state"] == SLOT_USED
+
+    def add_checkout(self, checkout: Checkout):
+        customer = self._customers.get_customer(checkout.customer_id)
+        isbn = SlotTable._encode_key(checkout.isbn)
+        checkout_id = checkout.checkout_id.encode()
+        if len(checkout_id) > MAX_CHECKOUT_ID_SIZE:
+            raise ValueError(f"{checkout.checkout_id} is longer than {MAX_CHECKOUT_ID_SIZE} bytes")
+
+        # the copy is taken first, so the slot's lock is never held while waiting for another one
+        checkout.book.checkout_book()
+        slot = customer._slot
+        try:
+            with self._table.locked(slot):
+                rows = self._customer_rows(slot)
+                # another worker may have checked out a book for this customer since app.py checked the limit
+                if len(rows) >= self._per_customer:
+                    e = HTTPException(f"Cannot check out more than {self._per_customer} for customer: {customer}")
+                    e.code = HTTPStatus.CONFLICT
+                    raise e
+
+                used = {record[1] for record in rows}
+                row = next(row for row in range(slot * self._per_customer, (slot + 1) * self._per_customer)
+                           if row not in used)
+                offset = self._region.checkout_row_offset(row)
+                CHECKOUT_ROW.pack_into(self._region.mmap, offset, SLOT_EMPTY, checkout.checkout_date.toordinal(),
+                                       checkout.due_date.toordinal(), self._region.next_sequence(), isbn,
+                                       checkout_id)
+                # the state is written last so scans never see a half written row
+                self._region.mmap[offset] = SLOT_USED
+                self._table._add(slot, (1,))
+        except Exception:
+            checkout.book.return_book()
+            raise
+
+    def add_checkouts(self, checkouts: list[Checkout]):
+        added: list[Checkout] = []
+        try:
+            for checkout in checkouts:
+                self.add_checkout(checkout)
+                added.append(checkout)
+        except Exception:
+            for checkout in reversed(added):
+                self.return_book(checkout.isbn, checkout.customer_id)
+            raise
+
+    def get_by_id(self, checkout_id: str):
+        rows = np.flatnonzero(self._used() & (self._region.checkout_rows["checkout_id"] == checkout_id.encode()))
+        checkouts = self._checkouts(rows)
+        if not checkouts:
+            raise KeyError(checkout_id)
+        return checkouts[0][1]
+
+    def get_checkouts(self):
+        rows = np.flatnonzero(self._used())
+        return [checkout for _, checkout in sorted(self._checkouts(rows), key=lambda item: item[0])]
+
+    def page_checkouts(self, after: Position | None, limit: int):
+        # checkouts are listed by their sequence, so they are the positions
+        start = start_after(after)
+        sequences = self._region.checkout_rows["sequence"]
+        rows = np.flatnonzero(self._used() & (sequences >= start))
+        rows = rows[np.argsort(sequences[rows], kind="stable")[:limit]]
+        return iter(self._checkouts(rows))
+
+    def get_by_customer_id(self, customer_id: str):
+        slot = self._table.find(customer_id)
+        if slot is None: return []
+        with self._table.locked(slot):
+            rows = self._customer_rows(slot)
+        return [self._checkout(customer_id, row) for row in rows]
+
+    def encode_customer_books(self, customer_id: str):
+        return encode_list(checkout.encode_checkout_info() for checkout in self.get_by_customer_id(customer_id))
+
+    def get_by_isbn(self, isbn: str):
+        checkout_rows = self._region.checkout_rows
+        rows = np.flatnonzero(self._used() & (checkout_rows["isbn"] == isbn.encode()))
+        rows = rows[np.argsort(checkout_rows["sequence"][rows], kind="stable")]
+        return [checkout for _, checkout in self._checkouts(rows)]
+
+    def _find(self, isbn: str, customer_id: str):
+        """(slot, latest row of the customer's checkouts of the book), like the in memory index, or None"""
+        slot = self._table.find(customer_id)
+        if slot is None:
+            return None
+        with self._table.locked(slot):
+            rows = [row for row in self._customer_rows(slot) if row[4] == isbn]
+        return (slot, rows[-1]) if rows else None
+
+    def get_by_isbn_cust_id(self, isbn: str, customer_id: str):
+        found = self._find(isbn, customer_id)
+        if found is None:
+            raise KeyError((isbn, customer_id))
+        return self._checkout(customer_id, found[1])
+
+    def get_by_due_date(self, start: date | None, end: date | None, after: tuple[date, str] | None, limit: int):
+        checkout_rows = self._region.checkout_rows
+        due_days, checkout_ids = checkout_rows["due_day"], checkout_rows["checkout_id"]
+        used = self._used()
+        if start is not None:
+            used &= due_days >= start.toordinal()
+        if end is not None:
+            used &= due_days < end.toordinal()
+        if after is not None:
+            after_day, after_id = after[0].toordinal(), after[1].encode()
+            used &= (due_days > after_day) | ((due_days == after_day) & (checkout_ids > after_id))
+        rows = np.flatnonzero(used)
+        rows = rows[np.lexsort((checkout_ids[rows], due_days[rows]))[:limit]]
+        return [checkout for _, checkout in self._checkouts(rows)]
+
+    def contains_isbn_cust_id(self, isbn: str, customer_id: str):
+        return self._find(isbn, customer_id) is not None
+
+    def return_book(self, isbn: str, customer_id: str):
+        slot = self._table.find(customer_id)
+        rows = []
+        if slot is not None:
+            with self._table.locked(slot):
+                rows = [row for row in self._customer_rows(slot) if row[4] == isbn]
+                if rows:
+                    self._region.mmap[self._region.checkout_row_offset(rows[-1][1])] = SLOT_EMPTY
+                    self._table._add(slot, (-1,))
+        # another worker may have returned it since app.py checked
+        if not rows:
+            e = HTTPException(f"Checkout with ISBN: {isbn} and customer_id: {customer_id} doesn't exist!")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+        self._books.get_book(isbn).return_book()
+
+        response = {
+            "message": "Book returned successfully",
+            "isbn": isbn,
+            "customer_id": customer_id,
+            "return_date": date.today().isoformat()
+        }
+        return response
+
+    def return_books(self, returns: list[tuple[str, str]]):
+        return [self.return_book(isbn, customer_id) for isbn, customer_id in returns]
+
+    def count_active(self):
+        return int(np.count_nonzero(self._used()))
@@ -0,0 +1,414 @@
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date
+from http import HTTPStatus
+
+from werkzeug.exceptions import HTTPException
+
+from models import Book, Customer, Checkout, BookStore, CustomerStore, CheckoutStore
+from models.objects import encode_list
+from models.objects.ids import CHECKOUT_ID_PREFIX
+from models.collections import MAX_CANDIDATES, Position, rank, tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    isbn TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    copies INTEGER NOT NULL,
+    available_copies INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    checkouts INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS checkouts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    isbn TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    checkout_date TEXT NOT NULL,
+    due_date TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS checkouts_customer_id ON checkouts (customer_id, id);
+CREATE INDEX IF NOT EXISTS checkouts_isbn_customer_id ON checkouts (isbn, customer_id, id);
+CREATE INDEX IF NOT EXISTS checkouts_due_date ON checkouts (due_date, id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_search USING fts5 (isbn UNINDEXED, title, author, prefix = '1 2 3');
+
+-- books are only ever deleted all at once by a reset, which empties books_search too
+CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_search (isbn, title, author) VALUES (new.isbn, new.title, new.author);
+END;
+"""
+
+# fills the search index of a database made before it existed
+INDEX_BOOKS = "INSERT INTO books_search (isbn, title, author) SELECT isbn, title, author FROM books"
+
+# statements are kept as constants so sqlite3's per connection statement cache reuses them
+INSERT_BOOK = """
+INSERT INTO books (isbn, title, author, copies, available_copies) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (isbn) DO UPDATE SET copies = copies + excluded.copies,
+                                 available_copies = available_copies + excluded.copies
+RETURNING title, author, isbn, copies, available_copies
+"""
+SELECT_BOOK = "SELECT title, author, isbn, copies, available_copies FROM books WHERE isbn = ?"
+SELECT_BOOKS = "SELECT title, author, isbn, copies, available_copies FROM books ORDER BY isbn"
+SELECT_BOOKS_PAGE = "SELECT title, author, isbn, copies, available_copies FROM books WHERE isbn > ? ORDER BY isbn LIMIT ?"
+# candidates for a search, they are ranked the same way as the in memory index afterwards
+SEARCH_BOOKS = """
+SELECT b.title, b.author, b.isbn, b.copies, b.available_copies
+FROM books_search s JOIN books b ON b.isbn = s.isbn
+WHERE books_search MATCH ? ORDER BY bm25(books_search, 0.0, 2.0, 1.0), b.isbn LIMIT ?
+"""
+COUNT_COPIES = "SELECT COALESCE(SUM(copies), 0), COALESCE(SUM(available_copies), 0) FROM books"
+TAKE_COPY = "UPDATE books SET available_copies = available_copies - 1 WHERE isbn = ? AND available_copies > 0"
+GIVE_BACK_COPY = "UPDATE books SET available_copies = available_copies + 1 WHERE isbn = ?"
+
+INSERT_CUSTOMER = """
+INSERT INTO customers (customer_id, name, email) VALUES (?, ?, ?)
+ON CONFLICT (customer_id) DO UPDATE SET name = excluded.name, email = excluded.email
+RETURNING name, email, customer_id, checkouts
+"""
+SELECT_CUSTOMER = "SELECT name, email, customer_id, checkouts FROM customers WHERE customer_id = ?"
+SELECT_CUSTOMERS = "SELECT name, email, customer_id, checkouts FROM customers ORDER BY customer_id"
+SELECT_CUSTOMERS_PAGE = """
+SELECT name, email, customer_id, checkouts FROM customers WHERE customer_id > ? ORDER BY customer_id LIMIT ?
+"""
+COUNT_CUSTOMERS_AT_LIMIT = "SELECT COUNT(*) FROM customers WHERE checkouts >= ?"
+ADD_CUSTOMER_CHECKOUT = "UPDATE customers SET checkouts = checkouts + 1 WHERE customer_id = ? AND checkouts < ?"
+REMOVE_CUSTOMER_CHECKOUT = "UPDATE customers SET checkouts = checkouts - 1 WHERE customer_id = ?"
+
+INSERT_CHECKOUT = "INSERT INTO checkouts (isbn, customer_id, checkout_date, due_date) VALUES (?, ?, ?, ?)"
+COUNT_CHECKOUTS = "SELECT COUNT(*) FROM checkouts"
+DELETE_CHECKOUT = "DELETE FROM checkouts WHERE id = ?"
+SELECT_CHECKOUTS = """
+SELECT c.id, c.isbn, c.customer_id, c.checkout_date, c.due_date,
+       b.title, b.author, b.copies, b.available_copies, u.name, u.email, u.checkouts
+FROM checkouts c JOIN books b ON b.isbn = c.isbn JOIN customers u ON u.customer_id = c.customer_id
+"""
+SELECT_CHECKOUT_BY_ID = SELECT_CHECKOUTS + "WHERE c.id = ?"
+SELECT_CHECKOUTS_BY_CUSTOMER_ID = SELECT_CHECKOUTS + "WHERE c.customer_id = ? ORDER BY c.id"
+SELECT_CHECKOUTS_BY_ISBN = SELECT_CHECKOUTS + "WHERE c.isbn = ? ORDER BY c.id"
+# the latest checkout wins when a customer has several copies of the same book, like the in memory index
+SELECT_CHECKOUT_BY_ISBN_CUST_ID = SELECT_CHECKOUTS + "WHERE c.isbn = ? AND c.customer_id = ? ORDER BY c.id DESC LIMIT 1"
+SELECT_ALL_CHECKOUTS = SELECT_CHECKOUTS + "ORDER BY c.id"
+SELECT_CHECKOUTS_PAGE = SELECT_CHECKOUTS + "WHERE c.id > ? ORDER BY c.id LIMIT ?"
+SELECT_CHECKOUTS_BY_DUE_DATE = SELECT_CHECKOUTS + """WHERE c.due_date >= ? AND c.due_date < ? AND (c.due_date, c.id) > (?, ?)
+ORDER BY c.due_date, c.id LIMIT ?"""
+
+def _book(row: tuple):
+    book = Book(row[0], row[1], row[2], row[3])
+    book.available_copies = row[4]
+    return book
+
+def _customer(row: tuple):
+    customer = Customer(row[0], row[1], row[2])
+    customer.checkouts = row[3]
+    return customer
+
+def _checkout(row: tuple):
+    book = Book(row[5], row[6], row[1], row[7])
+    book.available_copies = row[8]
+    customer = Customer(row[9], row[10], row[2])
+    customer.checkouts = row[11]
+    return Checkout(book, customer, row[1], row[2], date.fromisoformat(row[4]),
+                    checkout_id=f"{CHECKOUT_ID_PREFIX}{row[0]}", checkout_date=date.fromisoformat(row[3]))
+
+def _match_expression(query: str, author: str):
+    """fts5 query for the tokens of query in the title or author and of author in the author, the last token
+    of each matching as a prefix"""
+    terms = []
+    for text, columns in ((query, "{title author}"), (author, "author")):
+        tokens = tokenize(text)
+        terms += [f'{columns} : "{token}"' + ("*" if i == len(tokens) - 1 else "") for i, token in enumerate(tokens)]
+    return " AND ".join(terms)
+
+def _key_after(after: Position | None):
+    """books and customers are listed by key, so their position is their key"""
+    if after is None:
+        return ""
+    if not isinstance(after, str):
+        raise ValueError(f"{after} is not a position")
+    return after
+
+def _row_id(checkout_id: str):
+    """
+    Raises:
+        ValueError: when checkout_id isn't CKO followed by a row id, so can't be one this store handed out
+    """
+    if not checkout_id.startswith(CHECKOUT_ID_PREFIX) or not checkout_id[len(CHECKOUT_ID_PREFIX):].isdigit():
+        raise ValueError(f"{checkout_id} is not a checkout id")
+    return int(checkout_id[len(CHECKOUT_ID_PREFIX):])
+
+class SQLiteEngine:
+    """hands out one connection per thread to a SQLite database in WAL mode"""
+
+    def __init__(self, path: str, statement_cache_size: int = 128):
+        self.path: str = path
+        self.statement_cache_size: int = statement_cache_size
+
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        connection = self.connection()
+        indexed = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_search'").fetchone()
+        # executescript manages its own transaction
+        connection.executescript(SCHEMA)
+        if indexed is None:
+            with self.transaction() as connection:
+                connection.execute(INDEX_BOOKS)
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # autocommit, transactions are started explicitly in transaction(). Connections are only used by
+            # the thread that opened them but close() may run on another
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                         cached_statements=self.statement_cache_size)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA busy_timeout = 5000")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """runs the block in a write transaction on this thread's connection, rolling back on errors"""
+        connection = self.connection()
+        # take the write lock up front so the reads in the block can't go stale
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+class SQLiteBooks(BookStore):
+    def __init__(self, engine: SQLiteEngine):
+        self._engine: SQLiteEngine = engine
+
+    def reset(self):
+        with self._engine.transaction() as connection:
+            connection.execute("DELETE FROM books")
+            connection.execute("DELETE FROM books_search")
+
+    def add_book(self, title: str, author: str, isbn: str, copies: int):
+        with self._engine.transaction() as connection:
+            return _book(connection.execute(INSERT_BOOK, (isbn, title, author, copies, copies)).fetchone())
+
+    def add_books(self, books: list[dict]):
+        with self._engine.transaction() as connection:
+            for book in books:
+                connection.execute(INSERT_BOOK, (book["isbn"], book["title"], book["author"],
+                                                 book["copies"], book["copies"])).fetchone()
+
+    def get_book(self, isbn: str):
+        row = self._engine.connection().execute(SELECT_BOOK, (isbn,)).fetchone()
+        if row is None:
+            e = HTTPException(f"ISBN: {isbn} not found in library!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+
+        return _book(row)
+
+    def get_books(self):
+        for row in self._engine.connection().execute(SELECT_BOOKS):
+            yield _book(row)
+
+    def page_books(self, after: Position | None, limit: int):
+        rows = self._engine.connection().execute(SELECT_BOOKS_PAGE, (_key_after(after), limit))
+        return ((row[2], _book(row)) for row in rows)
+
+    def contains_isbn(self, isbn: str):
+        return self._engine.connection().execute(SELECT_BOOK, (isbn,)).fetchone() is not None
+
+    def search(self, query: str, author: str, limit: int):
+        expression = _match_expression(query, author)
+        if not expression:
+            return []
+        rows = self._engine.connection().execute(SEARCH_BOOKS, (expression, MAX_CANDIDATES))
+        return rank((_book(row) for row in rows), query, author, limit)
+
+    def count_copies(self):
+        return tuple(self._engine.connection().execute(COUNT_COPIES).fetchone())
+
+class SQLiteCustomers(CustomerStore):
+    def __init__(self, engine: SQLiteEngine):
+        self._engine: SQLiteEngine = engine
+
+    def reset(self):
+        with self._engine.transaction() as connection:
+            connection.execute("DELETE FROM customers")
+
+    def add_customer(self, name: str, email: str, customer_id: str):
+        with self._engine.transaction() as connection:
+            return _customer(connection.execute(INSERT_CUSTOMER, (customer_id, name, email)).fetchone())
+
+    def add_customers(self, customers: list[dict]):
+        with self._engine.transaction() as connection:
+            for customer in customers:
+                connection.execute(INSERT_CUSTOMER, (customer["customer_id"], customer["name"],
+                                                     customer["email"])).fetchone()
+
+    def get_customer(self, customer_id: str):
+        row = self._engine.connection().execute(SELECT_CUSTOMER, (customer_id,)).fetchone()
+        if row is None:
+            e = HTTPException(f"customer_id: {customer_id} not found in customers!")
+            e.code = HTTPStatus.NOT_FOUND
+            raise e
+        return _customer(row)
+
+    def get_customers(self):
+        for row in self._engine.connection().execute(SELECT_CUSTOMERS):
+            yield _customer(row)
+
+    def page_customers(self, after: Position | None, limit: int):
+        rows = self._engine.connection().execute(SELECT_CUSTOMERS_PAGE, (_key_after(after), limit))
+        return ((row[2], _customer(row)) for row in rows)
+
+    def contains_customer_id(self, customer_id: str):
+        return self._engine.connection().execute(SELECT_CUSTOMER, (customer_id,)).fetchone() is not None
+
+    def count_at_limit(self, limit: int):
+        return self._engine.connection().execute(COUNT_CUSTOMERS_AT_LIMIT, (limit,)).fetchone()[0]
+
+class SQLiteCheckouts(CheckoutStore):
+    def __init__(self, engine: SQLiteEngine, checkout_limit: int):
+        self._engine: SQLiteEngine = engine
+        self._checkout_limit: int = checkout_limit
+
+    def reset(self):
+        with self._engine.transaction() as connection:
+            connection.execute("DELETE FROM checkouts")
+
+    def _add_checkout(self, connection: sqlite3.Connection, checkout: Checkout):
+        # another process may have taken the last copy since app.py checked it
+        if connection.execute(TAKE_COPY, (checkout.isbn,)).rowcount == 0:
+            e = HTTPException(f"Not enough copies of book: {checkout.book}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+        # and another process may have checked out a book for the customer
+        if connection.execute(ADD_CUSTOMER_CHECKOUT, (checkout.customer_id, self._checkout_limit)).rowcount == 0:
+            e = HTTPException(f"Cannot check out more than {self._checkout_limit} for customer: {checkout.customer}")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        cursor = connection.execute(INSERT_CHECKOUT, (checkout.isbn, checkout.customer_id,
+                                                      checkout.checkout_date.isoformat(),
+                                                      checkout.due_date.isoformat()))
+        # ids come from the database so every process sharing it hands out unique ones
+        checkout.checkout_id = f"{CHECKOUT_ID_PREFIX}{cursor.lastrowid}"
+
+    def add_checkout(self, checkout: Checkout):
+        with self._engine.transaction() as connection:
+            self._add_checkout(connection, checkout)
+
+        checkout.book.checkout_book()
+        checkout.customer.checkout_book()
+
+    def add_checkouts(self, checkouts: list[Checkout]):
+        with self._engine.transaction() as connection:
+            for checkout in checkouts:
+                self._add_checkout(connection, checkout)
+
+        for checkout in checkouts:
+            checkout.book.checkout_book()
+            checkout.customer.checkout_book()
+
+    def get_by_id(self, checkout_id: str):
+        try:
+            row_id = _row_id(checkout_id)
+        except ValueError as e:
+            raise KeyError(checkout_id) from e
+        row = self._engine.connection().execute(SELECT_CHECKOUT_BY_ID, (row_id,)).fetchone()
+        if row is None:
+            raise KeyError(checkout_id)
+        return _checkout(row)
+
+    def get_checkouts(self):
+        for row in self._engine.connection().execute(SELECT_ALL_CHECKOUTS):
+            yield _checkout(row)
+
+    def page_checkouts(self, after: Position | None, limit: int):
+        # checkouts are listed by row id
+        if after is not None and (type(after) is not int or after < 0):
+            raise ValueError(f"{after} is not a position")
+        rows = self._engine.connection().execute(SELECT_CHECKOUTS_PAGE, (after or 0, limit))
+        return ((row[0], _checkout(row)) for row in rows)
+
+    def get_by_customer_id(self, customer_id: str):
+        rows = self._engine.connection().execute(SELECT_CHECKOUTS_BY_CUSTOMER_ID, (customer_id,)).fetchall()
+        return [_checkout(row) for row in rows]
+
+    def encode_customer_books(self, customer_id: str):
+        return encode_list(checkout.encode_checkout_info() for checkout in self.get_by_customer_id(customer_id))
+
+    def get_by_isbn(self, isbn: str):
+        rows = self._engine.connection().execute(SELECT_CHECKOUTS_BY_ISBN, (isbn,)).fetchall()
+        return [_checkout(row) for row in rows]
+
+    def get_by_isbn_cust_id(self, isbn: str, customer_id: str):
+        row = self._engine.connection().execute(SELECT_CHECKOUT_BY_ISBN_CUST_ID, (isbn, customer_id)).fetchone()
+        if row is None:
+            raise KeyError((isbn, customer_id))
+        return _checkout(row)
+
+    def get_by_due_date(self, start: date | None, end: date | None, after: tuple[date, str] | None, limit: int):
+        # iso dates sort as strings, "" is before every date and "9" after
+        after_due_date, after_id = ("", 0) if after is None else (after[0].isoformat(), _row_id(after[1]))
+        rows = self._engine.connection().execute(SELECT_CHECKOUTS_BY_DUE_DATE, (
+            "" if start is None else start.isoformat(), "9" if end is None else end.isoformat(),
+            after_due_date, after_id, limit)).fetchall()
+        return [_checkout(row) for row in rows]
+
+    def contains_isbn_cust_id(self, isbn: str, customer_id: str):
+        row = self._engine.connection().execute(SELECT_CHECKOUT_BY_ISBN_CUST_ID, (isbn, customer_id)).fetchone()
+        return row is not None
+
+    def _return_book(self, connection: sqlite3.Connection, isbn: str, customer_id: str):
+        row = connection.execute(SELECT_CHECKOUT_BY_ISBN_CUST_ID, (isbn, customer_id)).fetchone()
+        if row is None:
+            e = HTTPException(f"Checkout with ISBN: {isbn} and customer_id: {customer_id} doesn't exist!")
+            e.code = HTTPStatus.CONFLICT
+            raise e
+
+        connection.execute(DELETE_CHECKOUT, (row[0],))
+        connection.execute(GIVE_BACK_COPY, (isbn,))
+        connection.execute(REMOVE_CUSTOMER_CHECKOUT, (customer_id,))
+
+        response = {
+            "message": "Book returned successfully",
+            "isbn": isbn,
+            "customer_id": customer_id,
+            "return_date": date.today().isoformat()
+        }
+        return response
+
+    def return_book(self, isbn: str, customer_id: str):
+        with self._engine.transaction() as connection:
+            return self._return_book(connection, isbn, customer_id)
+
+    def return_books(self, returns: list[tuple[str, str]]):
+        with self._engine.transaction() as connection:
+            return [self._return_book(connection, isbn, customer_id) for isbn, customer_id in returns]
+
+    def count_active(self):
+        return self._engine.connection().execute(COUNT_CHECKOUTS).fetchone()[0]
@@ -0,0 +1,212 @@
+import json
+import os
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+SNAPSHOT_PREFIX = "snapshot-"
+SNAPSHOT_SUFFIX = ".jsonl"
+
+# sentinel put on the queue to stop the writer thread
+_STOP = object()
+
+def _file_lsn(name: str, prefix: str, suffix: str):
+    """parses the lsn out of a segment or snapshot file name, None when the name doesn't match"""
+    if not name.startswith(prefix) or not name.endswith(suffix):
+        return None
+    try:
+        return int(name[len(prefix):-len(suffix)])
+    except ValueError:
+        return None
+
+class WriteAheadLog:
+    """append-only log of records with group commit, compacted by snapshots
+
+    Records are handed to a single writer thread that writes everything queued since its last
+    write and then fsyncs once, so concurrent writers share an fsync. Each record gets a log
+    sequence number (lsn). A snapshot holds the records needed to rebuild the state as of an lsn,
+    once it is on disk the log segments before it are deleted.
+    """
+
+    def __init__(self, directory: str, durable: bool = False):
+        """
+        Args:
+            directory (str): directory holding the log segments and snapshots, created when missing
+            durable (bool, optional): wait for the fsync on every append instead of returning as soon
+            as the record is queued. Defaults to False.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory: str = directory
+        self.durable: bool = durable
+
+        self._lock = threading.Lock()
+        self._committed = threading.Condition()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lsn: int = 0
+        self._committed_lsn: int = 0
+        # log records recover() yielded after the snapshot
+        self.replayed: int = 0
+        self._segment = None
+        self._thread: threading.Thread | None = None
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, name)
+
+    def _files(self, prefix: str, suffix: str):
+        """lists (lsn, name) of the segments or snapshots in the directory, oldest first"""
+        files = [(_file_lsn(name, prefix, suffix), name) for name in os.listdir(self.directory)]
+        return sorted(f for f in files if f[0] is not None)
+
+    @staticmethod
+    def _read_lines(path: str) -> Iterator[dict]:
+        """yields records from a file, stopping at a torn or corrupt line left by a crash"""
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+    def recover(self) -> Iterator[dict]:
+        """yields the records of the latest snapshot followed by the log records written after it
+
+        Yields:
+            dict: records in the order they were appended
+        """
+        snapshots = self._files(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)
+        if snapshots:
+            self._lsn, name = snapshots[-1]
+            yield from self._read_lines(self._path(name))
+
+        for _, name in self._files(SEGMENT_PREFIX, SEGMENT_SUFFIX):
+            for record in self._read_lines(self._path(name)):
+                lsn = record.pop("lsn", None)
+                if lsn is None or lsn <= self._lsn:
+                    continue
+                self._lsn = lsn
+                self.replayed += 1
+                yield record
+
+        self._committed_lsn = self._lsn
+
+    def start(self):
+        """opens a new log segment after the recovered records and starts the writer thread"""
+        # anything in a segment with this name was past the last readable record, so it is dropped
+        self._segment = open(self._path(f"{SEGMENT_PREFIX}{self._lsn + 1:020d}{SEGMENT_SUFFIX}"), "wb")
+        self._thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, record: dict):
+        """queues a record to be written, waiting for it to be on disk when the log is durable
+
+        Args:
+            record (dict): json serializable record
+
+        Returns:
+            int: lsn of the record
+        """
+        with self._lock:
+            self._lsn += 1
+            lsn = self._lsn
+            self._queue.put((lsn, record))
+
+        if self.durable:
+            self.wait(lsn)
+        return lsn
+
+    def snapshot(self, records: Iterable[dict]):
+        """queues a snapshot of the state as of the last appended record
+
+        Args:
+            records (Iterable[dict]): records that rebuild the state when replayed in order, only iterated by
+            the writer thread so they can be made as they are written
+        """
+        with self._lock:
+            self._queue.put((self._lsn, records))
+
+    def wait(self, lsn: int):
+        """blocks until every record up to lsn has been fsynced"""
+        with self._committed:
+            self._committed.wait_for(lambda: self._committed_lsn >= lsn)
+
+    def close(self):
+        """writes anything still queued and stops the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._segment.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            # everything queued while the last fsync ran is committed together
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines: list[bytes] = []
+            lsn = self._committed_lsn
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                    continue
+
+                item_lsn, payload = item
+                if not isinstance(payload, dict):
+                    self._commit(lines, lsn)
+                    lines = []
+                    self._write_snapshot(item_lsn, payload)
+                    continue
+
+                lsn = item_lsn
+                lines.append(json.dumps({"lsn": lsn, **payload}, separators=(",", ":")).encode() + b"\n")
+
+            self._commit(lines, lsn)
+
+    def _commit(self, lines: list[bytes], lsn: int):
+        if lines:
+            self._segment.write(b"".join(lines))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+
+        with self._committed:
+            self._committed_lsn = max(self._committed_lsn, lsn)
+            self._committed.notify_all()
+
+    def _write_snapshot(self, lsn: int, records: Iterable[dict]):
+        name = f"{SNAPSHOT_PREFIX}{lsn:020d}{SNAPSHOT_SUFFIX}"
+        tmp_path = self._path(name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # the rename makes the snapshot visible to recovery only once it is complete
+        os.replace(tmp_path, self._path(name))
+        self._fsync_directory()
+
+        # later records go to a new segment so every older file can be dropped
+        self._segment.close()
+        self._segment = open(self._path(f"{SEGMENT_PREFIX}{lsn + 1:020d}{SEGMENT_SUFFIX}"), "wb")
+        for segment_lsn, segment in self._files(SEGMENT_PREFIX, SEGMENT_SUFFIX):
+            if segment_lsn <= lsn:
+                os.remove(self._path(segment))
+        for snapshot_lsn, snapshot in self._files(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX):
+            if snapshot_lsn < lsn:
+                os.remove(self._path(snapshot))
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+Stress test for the Library Management System API.
+This script runs many threads against the app through the Flask test client and checks that
+checkouts and returns never break the business rules.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import app as library_app
+from api import Admission, ASGIAdapter, IdempotencyCache
+from api.logs import BoundedQueueHandler, Payload, StructuredFormatter
+from app import app, MAX_BOOKS_CHECKED_OUT
+from models import Checkout, FileCounter, LeasedIds, TimeOrderedIds, WorkerLease
+
+THREADS = 32
+
+class SlowCheckout(Checkout):
+    """checkout that takes a moment to create, widening the gap between checking the limits and applying them"""
+
+    def __init__(self, *args, **kwargs):
+        time.sleep(0.001)
+        super().__init__(*args, **kwargs)
+
+class CountedPayload(Payload):
+    """payload that counts how often it is rendered"""
+
+    __slots__ = ("renders",)
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.renders = 0
+
+    def render(self, max_size):
+        self.renders += 1
+        return super().render(max_size)
+
+class LibraryConcurrencyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # switch threads far more often than usual so races show up
+        cls.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        cls.slow_checkout = mock.patch.object(library_app, "Checkout", SlowCheckout)
+        cls.slow_checkout.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.slow_checkout.stop()
+        sys.setswitchinterval(cls.switch_interval)
+
+    def setUp(self):
+        """Clear any existing data before each test"""
+        self.client = app.test_client()
+        self.client.post("/api/reset")
+        self.due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+
+    def add_book(self, isbn, copies):
+        book_data = {"title": f"Book {isbn}", "author": "Author", "isbn": isbn, "copies": copies}
+        self.assertEqual(self.client.post("/api/books", json=book_data).status_code, 201)
+
+    def add_customer(self, customer_id):
+        customer_data = {"name": customer_id, "email": f"{customer_id}@example.com", "customer_id": customer_id}
+        self.assertEqual(self.client.post("/api/customers", json=customer_data).status_code, 201)
+
+    def run_threads(self, task, args):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            return list(executor.map(task, args))
+
+    def checkout(self, isbn, customer_id):
+        checkout_data = {"isbn": isbn, "customer_id": customer_id, "due_date": self.due_date}
+        return app.test_client().post("/api/checkouts", json=checkout_data)
+
+    def test_copies_are_not_oversold(self):
+        """Test that concurrent checkouts of a hot book never take more copies than exist"""
+        self.add_book("HOT", 20)
+        customer_ids = [f"CUST{i}" for i in range(200)]
+        for customer_id in customer_ids:
+            self.add_customer(customer_id)
+
+        responses = self.run_threads(lambda customer_id: self.checkout("HOT", customer_id), customer_ids)
+
+        statuses = [response.status_code for response in responses]
+        self.assertEqual(statuses.count(201), 20)
+        self.assertEqual(statuses.count(409), 180)
+        book = self.client.get("/api/books/HOT").get_json()
+        self.assertEqual(book["available_copies"], 0)
+
+        # every checkout got its own id
+        checkout_ids = [response.get_json()["checkout_id"] for response in responses if response.status_code == 201]
+        self.assertEqual(len(set(checkout_ids)), 20)
+
+    def test_customer_limit_holds(self):
+        """Test that concurrent checkouts for one customer never go past the limit"""
+        isbns = [f"ISBN{i}" for i in range(50)]
+        for isbn in isbns:
+            self.add_book(isbn, 5)
+        self.add_customer("CUST0")
+
+        responses = self.run_threads(lambda isbn: self.checkout(isbn, "CUST0"), isbns)
+
+        statuses = [response.status_code for response in responses]
+        self.assertEqual(statuses.count(201), MAX_BOOKS_CHECKED_OUT)
+        books = self.client.get("/api/customers/CUST0/books").get_json()
+        self.assertEqual(len(books), MAX_BOOKS_CHECKED_OUT)
+
+    def test_checkout_return_churn(self):
+        """Test that copies all come back after concurrent checkouts and returns"""
+        self.add_book("HOT", 3)
+        customer_ids = [f"CUST{i}" for i in range(THREADS)]
+        for customer_id in customer_ids:
+            self.add_customer(customer_id)
+
+        def churn(customer_id):
+            client = app.test_client()
+            for _ in range(20):
+                if self.checkout("HOT", customer_id).status_code == 201:
+                    return_data = {"isbn": "HOT", "customer_id": customer_id}
+                    self.assertEqual(client.post("/api/returns", json=return_data).status_code, 200)
+
+        self.run_threads(churn, customer_ids)
+
+        book = self.client.get("/api/books/HOT").get_json()
+        self.assertEqual(book["available_copies"], 3)
+        for customer_id in customer_ids:
+            self.assertEqual(self.client.get(f"/api/customers/{customer_id}/books").get_json(), [])
+
+    def test_checkout_ids_are_unique(self):
+        """Test that id allocators shared by many threads, and by workers, never hand out the same id"""
+        def numbers(allocators):
+            ids = self.run_threads(lambda i: [allocators[i % 2].next_id() for _ in range(100)], range(THREADS))
+            return [[int(checkout_id.removeprefix("CKO")) for checkout_id in thread_ids] for thread_ids in ids]
+
+        # two allocators stand in for two worker processes
+        time_ordered = numbers([TimeOrderedIds(1), TimeOrderedIds(2)])
+        self.assertEqual(len({number for thread_numbers in time_ordered for number in thread_numbers}), THREADS * 100)
+        # each thread sees its ids increase
+        for thread_numbers in time_ordered:
+            self.assertEqual(thread_numbers, sorted(thread_numbers))
+
+        with tempfile.TemporaryDirectory() as directory:
+            counter = FileCounter(os.path.join(directory, "checkout_ids"))
+            leased = numbers([LeasedIds(counter, 10), LeasedIds(counter, 10)])
+        self.assertEqual({number for thread_numbers in leased for number in thread_numbers},
+                         set(range(1, THREADS * 100 + 1)))
+
+    def test_workers_lease_their_own_ids(self):
+        """Test that processes sharing a lease file hold different worker ids, and ids of stopped ones are reused"""
+        context = multiprocessing.get_context("fork")
+        with tempfile.TemporaryDirectory() as directory:
+            lease = WorkerLease(os.path.join(directory, "worker_ids"))
+            self.assertEqual(lease.acquire(), 0)
+            self.assertEqual(lease.acquire(), 0)
+
+            leased, stop = context.Queue(), context.Event()
+
+            def worker():
+                # a forked worker holds none of its parent's locks
+                leased.put(lease.acquire())
+                stop.wait()
+
+            workers = [context.Process(target=worker) for _ in range(4)]
+            for process in workers:
+                process.start()
+            worker_ids = sorted(leased.get(timeout=10) for _ in workers)
+            stop.set()
+            for process in workers:
+                process.join()
+            self.assertEqual(worker_ids, [1, 2, 3, 4])
+
+            stop.clear()
+            process = context.Process(target=worker)
+            process.start()
+            self.assertEqual(leased.get(timeout=10), 1)
+            stop.set()
+            process.join()
+
+    def test_asgi_serves_many_connections(self):
+        """Test that the ASGI adapter answers many open connections at once from a few threads"""
+        self.add_book("HOT", 1)
+        adapter = ASGIAdapter(app, workers=4)
+
+        async def call(method, path, body=b"", headers=()):
+            messages = [{"type": "http.request", "body": body, "more_body": False}]
+            # the client stays connected until it has its response
+            connected = asyncio.Event()
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await connected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers)}
+            await adapter(scope, receive, send)
+            connected.set()
+            return sent[0]["status"], json.loads(sent[1]["body"])
+
+        async def clients():
+            reads = [call("GET", "/api/books/HOT") for _ in range(1000)]
+            checkout_data = json.dumps({"isbn": "HOT", "customer_id": "NOBODY"}).encode()
+            invalid = call("POST", "/api/checkouts", checkout_data, [(b"content-type", b"application/json")])
+            return await asyncio.gather(*reads, invalid)
+
+        try:
+            responses = asyncio.run(clients())
+        finally:
+            adapter.executor.shutdown()
+
+        self.assertEqual({status for status, _ in responses[:-1]}, {200})
+        self.assertEqual(responses[0][1]["available_copies"], 1)
+        status, body = responses[-1]
+        self.assertEqual(status, 400)
+        self.assertEqual([error["field"] for error in body["errors"]], ["due_date"])
+
+    def test_asgi_streams_bodies(self):
+        """Test that the ASGI adapter sends iterable bodies a chunk at a time and streams request bodies to the app"""
+        for number in range(5):
+            self.add_book(f"STR{number}", 2)
+        adapter = ASGIAdapter(app, workers=2, max_body_size=64, buffer_size=16, streamed_paths=["/api/import"])
+
+        async def call(method, path, chunks, headers=()):
+            messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+            messages.append({"type": "http.request", "body": b"", "more_body": False})
+            received = []
+            sent = []
+
+            async def receive():
+                if messages:
+                    received.append(messages[0]["body"])
+                    return messages.pop(0)
+                # the client stays connected until it has its response
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers)}
+            await adapter(scope, receive, send)
+            return sent, received
+
+        try:
+            sent, _ = asyncio.run(call("GET", "/api/export", []))
+            bodies = [message for message in sent if message["type"] == "http.response.body"]
+            self.assertGreater(len(bodies), 2)
+            self.assertEqual([message.get("more_body", False) for message in bodies],
+                             [True] * (len(bodies) - 1) + [False])
+            exported = b"".join(message["body"] for message in bodies)
+            self.assertEqual(len(exported.splitlines()), 7)
+
+            # without a Content-Length the body is streamed to the app until the client ends it, and streamed
+            # paths take bodies over max_body_size
+            chunks = [exported[i:i + 10] for i in range(0, len(exported), 10)]
+            sent, received = asyncio.run(call("POST", "/api/import", chunks))
+            self.assertEqual(sent[0]["status"], 200)
+            self.assertEqual(b"".join(received), exported)
+            self.assertEqual(self.client.get("/api/books/STR4").get_json()["copies"], 2)
+            length = [(b"content-length", str(len(exported)).encode())]
+            sent, _ = asyncio.run(call("POST", "/api/import", chunks, length))
+            self.assertEqual(sent[0]["status"], 200)
+
+            # other bodies over max_body_size are refused by their Content-Length, or once the app reads past it
+            too_long = [b"x" * 20] * 5
+            sent, received = asyncio.run(call("POST", "/api/books", too_long, [(b"content-length", b"100")]))
+            self.assertEqual((sent[0]["status"], received), (413, []))
+            sent, _ = asyncio.run(call("POST", "/api/books", too_long, [(b"content-type", b"application/json")]))
+            self.assertEqual(sent[0]["status"], 413)
+        finally:
+            adapter.executor.shutdown()
+
+    def test_export_while_changing(self):
+        """Test that an export taken while requests change the library restores the library as it ended"""
+        for number in range(20):
+            self.add_book(f"EXP{number}", 2)
+        for number in range(THREADS):
+            self.add_customer(f"CUST{number}")
+            self.assertEqual(self.checkout(f"EXP{number % 20}", f"CUST{number}").status_code, 201)
+
+        def state():
+            client = app.test_client()
+            books = [client.get(f"/api/books/EXP{number}").json for number in range(25)]
+            customers = [client.get(f"/api/customers/CUST{number}").json for number in range(THREADS)]
+            books_out = [sorted(checkout["isbn"] for checkout in client.get(f"/api/customers/CUST{number}/books").json)
+                         for number in range(THREADS)]
+            return books, customers, books_out
+
+        def change(number):
+            # changes books, customers and checkouts the export has already read
+            client = app.test_client()
+            customer_id = f"CUST{number}"
+            client.post("/api/returns", json={"isbn": f"EXP{number % 20}", "customer_id": customer_id})
+            self.checkout(f"EXP{(number + 1) % 20}", customer_id)
+            client.post("/api/customers", json={"name": f"Renamed {number}", "email": f"{number}@example.com",
+                                                "customer_id": customer_id})
+            client.post("/api/books", json={"title": f"Book EXP{number % 20}", "author": "Author",
+                                            "isbn": f"EXP{number % 20}", "copies": 1})
+            client.post("/api/books", json={"title": "New", "author": "Author", "isbn": f"EXP{20 + number % 5}",
+                                            "copies": 1})
+            self.checkout(f"EXP{20 + number % 5}", customer_id)
+
+        # the export reads a page of checkouts, the library changes, then it reads the rest
+        page_checkouts = library_app.checkouts.page_checkouts
+
+        def page_then_change(after, limit):
+            page = list(page_checkouts(after, limit))
+            if after is None:
+                self.run_threads(change, range(THREADS))
+            return iter(page)
+
+        with mock.patch.object(library_app, "EXPORT_PAGE", 5), \
+                mock.patch.object(library_app.checkouts, "page_checkouts", page_then_change):
+            response = self.client.get("/api/export", buffered=False)
+        exported = list(response.response)
+        response.close()
+        expected = state()
+
+        response = self.client.post("/api/import", data=b"".join(exported))
+        self.assertEqual(response.json["failed"], 0)
+        self.assertEqual(state(), expected)
+
+    def test_import_reads_body_before_locking(self):
+        """Test that requests and exports carry on while an import's body is still arriving"""
+        self.add_book("OLD", 1)
+        arrived = threading.Event()
+        records = [{"type": "export", "version": 2},
+                   {"type": "book", "title": "Slow", "author": "Author", "isbn": "SLOW", "copies": 1},
+                   {"type": "end"}]
+        lines = [json.dumps(record).encode() + b"\n" for record in records]
+
+        class SlowBody(io.RawIOBase):
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                if not lines:
+                    return 0
+                if len(lines) == 1:
+                    # the client stalls before the end of its upload
+                    arrived.wait(5)
+                line = lines.pop(0)
+                buffer[:len(line)] = line
+                return len(line)
+
+        environ = EnvironBuilder(path="/api/import", method="POST", content_type="application/x-ndjson").get_environ()
+        environ.update({"wsgi.input": io.BufferedReader(SlowBody()), "wsgi.input_terminated": True})
+        environ.pop("CONTENT_LENGTH", None)
+        with ThreadPoolExecutor(1) as executor:
+            response = executor.submit(run_wsgi_app, app, environ, buffered=True)
+            time.sleep(0.05)
+            self.add_book("NEW", 1)
+            self.assertEqual(len(self.client.get("/api/export").data.splitlines()), 4)
+            arrived.set()
+            body, status, _ = response.result(timeout=5)
+            self.assertEqual((status, json.loads(b"".join(body))["failed"]), ("200 OK", 0))
+        self.assertEqual(self.client.get("/api/books/SLOW").status_code, 200)
+        self.assertEqual(self.client.get("/api/books/NEW").status_code, 404)
+
+    def test_availability_stream(self):
+        """Test that availability streams get every book's latest value, and don't hold an ASGI worker"""
+        self.add_book("LIVE", 2)
+        for customer_id in ("CUST1", "CUST2"):
+            self.add_customer(customer_id)
+
+        def events(chunk):
+            return [json.loads(line[len(b"data: "):]) for line in chunk.splitlines() if line.startswith(b"data: ")]
+
+        # a slow consumer only gets the latest of the changes it missed
+        response = self.client.get("/api/books/availability/stream?isbn=LIVE", buffered=False)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        chunks = iter(response.response)
+        self.assertEqual(events(next(chunks)), [{"isbn": "LIVE", "available_copies": 2}])
+        self.assertEqual(self.checkout("LIVE", "CUST1").status_code, 201)
+        self.assertEqual(self.checkout("LIVE", "CUST2").status_code, 201)
+        self.assertEqual(events(next(chunks)), [{"isbn": "LIVE", "available_copies": 0}])
+        response.close()
+        self.assertEqual(library_app.availability.count(), 0)
+
+        # over ASGI an open stream waits on the loop, leaving the only worker free for other requests
+        adapter = ASGIAdapter(app, workers=1)
+
+        async def stream():
+            loop = asyncio.get_running_loop()
+            disconnect = asyncio.Event()
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+            bodies = asyncio.Queue()
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.body":
+                    await bodies.put(message["body"])
+
+            scope = {"type": "http", "method": "GET", "path": "/api/books/availability/stream",
+                     "query_string": b"isbn=LIVE", "headers": []}
+            served = asyncio.ensure_future(adapter(scope, receive, send))
+            first = await bodies.get()
+            returned = await loop.run_in_executor(adapter.executor, lambda: app.test_client().post(
+                "/api/returns", json={"isbn": "LIVE", "customer_id": "CUST1"}).status_code)
+            second = await bodies.get()
+            disconnect.set()
+            await served
+            return first, returned, second
+
+        try:
+            first, returned, second = asyncio.run(stream())
+        finally:
+            adapter.executor.shutdown()
+
+        self.assertEqual(events(first), [{"isbn": "LIVE", "available_copies": 0}])
+        self.assertEqual(returned, 200)
+        self.assertEqual(events(second), [{"isbn": "LIVE", "available_copies": 1}])
+        self.assertEqual(library_app.availability.count(), 0)
+
+    def test_admission_sheds_load(self):
+        """Test that writes over a client's or customer's rate, or a route's limit, are refused up front"""
+        self.add_book("HOT", 10)
+        for customer_id in ("CUST1", "CUST2", "CUST3"):
+            self.add_customer(customer_id)
+
+        def add_book(client):
+            book_data = {"title": "Book", "author": "Author", "isbn": "HOT", "copies": 1}
+            return app.test_client().post("/api/books", json=book_data, headers={"X-Client-Id": client})
+
+        with mock.patch.object(library_app, "admission", Admission(client_rate=0.001, client_burst=3)):
+            statuses = [add_book("desk").status_code for _ in range(4)]
+            self.assertEqual(statuses, [201, 201, 201, 429])
+            response = add_book("desk")
+            self.assertEqual(int(response.headers["Retry-After"]), 1000)
+            # other clients and reads are not limited
+            self.assertEqual(add_book("kiosk").status_code, 201)
+            self.assertEqual(self.client.get("/api/books/HOT").status_code, 200)
+
+        with mock.patch.object(library_app, "admission", Admission(customer_rate=0.001, customer_burst=2)):
+            statuses = [self.checkout("HOT", "CUST1").status_code for _ in range(3)]
+            self.assertEqual(statuses, [201, 201, 429])
+            self.assertEqual(self.checkout("HOT", "CUST2").status_code, 201)
+
+        # checkouts past the limit are refused while the first ones are still being handled
+        release = threading.Event()
+
+        class BlockedCheckout(Checkout):
+            def __init__(self, *args, **kwargs):
+                release.wait()
+                super().__init__(*args, **kwargs)
+
+        with mock.patch.object(library_app, "admission", Admission(route_concurrency=2)), \
+                mock.patch.object(library_app, "Checkout", BlockedCheckout):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                blocked = [executor.submit(self.checkout, "HOT", customer_id) for customer_id in ("CUST1", "CUST3")]
+                while library_app.admission.in_flight() < 2:
+                    time.sleep(0.001)
+                response = self.checkout("HOT", "CUST2")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers["Retry-After"], "1")
+                release.set()
+                self.assertEqual([future.result().status_code for future in blocked], [201, 201])
+            self.assertEqual(library_app.admission.in_flight(), 0)
+            self.assertEqual(self.checkout("HOT", "CUST2").status_code, 201)
+
+        metrics = self.client.get("/api/metrics").get_data(as_text=True)
+        for reason in ("client_rate", "customer_rate", "concurrency"):
+            self.assertIn(f'reason="{reason}"', metrics)
+
+    def test_idempotent_retries_run_once(self):
+        """Test that concurrent retries of a checkout with the same Idempotency-Key wait for one checkout"""
+        self.add_book("HOT", 10)
+        self.add_customer("CUST1")
+
+        def checkout():
+            checkout_data = {"isbn": "HOT", "customer_id": "CUST1", "due_date": self.due_date}
+            return app.test_client().post("/api/checkouts", json=checkout_data, headers={"Idempotency-Key": "retry"})
+
+        with mock.patch.object(library_app, "idempotency", IdempotencyCache(max_entries=2)), \
+                mock.patch.object(library_app, "Checkout", SlowCheckout):
+            responses = self.run_threads(lambda _: checkout(), range(THREADS))
+            self.assertEqual({response.status_code for response in responses}, {201})
+            self.assertEqual(len({response.get_json()["checkout_id"] for response in responses}), 1)
+            replayed = [response for response in responses if "Idempotent-Replayed" in response.headers]
+            self.assertEqual(len(replayed), THREADS - 1)
+            self.assertEqual(self.client.get("/api/books/HOT").get_json()["available_copies"], 9)
+
+            # the least recently used responses are dropped, and the request is made again
+            for key in ("other", "another"):
+                self.client.post("/api/returns", json={"isbn": "HOT", "customer_id": "CUST1"},
+                                 headers={"Idempotency-Key": key})
+            self.assertEqual(len(library_app.idempotency), 2)
+            self.assertNotIn("Idempotent-Replayed", checkout().headers)
+            self.assertEqual(self.client.get("/api/books/HOT").get_json()["available_copies"], 9)
+
+    def test_full_idempotency_cache_keeps_running_requests(self):
+        """Test that a full cache drops the least recently used response but never a request still being handled"""
+        cache = IdempotencyCache(max_entries=1, wait=0.0)
+        self.assertIsNone(cache.begin("running"))
+        self.assertIsNone(cache.begin("other"))
+        cache.finish("other", 201, [], b"{}")
+        self.assertIsNone(cache.begin("newer"))
+        self.assertEqual(len(cache), 2)
+
+        # the running request is still claimed, and its retries get its response once it is done
+        with self.assertRaises(HTTPException) as raised:
+            cache.begin("running")
+        self.assertEqual(raised.exception.code, 409)
+        cache.finish("running", 201, [], b"{}")
+        self.assertEqual(cache.begin("running").status, 201)
+        # the finished response was dropped instead
+        self.assertIsNone(cache.begin("other"))
+
+    def test_reset_forgets_idempotency_keys(self):
+        """Test that a reset forgets the responses it undid and frees the keys of requests still being handled"""
+        self.add_book("HOT", 1)
+        self.add_customer("CUST1")
+
+        def checkout():
+            checkout_data = {"isbn": "HOT", "customer_id": "CUST1", "due_date": self.due_date}
+            return self.client.post("/api/checkouts", json=checkout_data, headers={"Idempotency-Key": "before"})
+
+        with mock.patch.object(library_app, "idempotency", IdempotencyCache()):
+            self.assertEqual(checkout().status_code, 201)
+            self.client.post("/api/reset")
+            self.assertEqual(len(library_app.idempotency), 0)
+
+            # the same key checks out the restocked book rather than replaying the checkout the reset undid
+            self.add_book("HOT", 1)
+            self.add_customer("CUST1")
+            response = checkout()
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn("Idempotent-Replayed", response.headers)
+            self.assertEqual(self.client.get("/api/books/HOT").get_json()["available_copies"], 0)
+
+        # a retry waiting on a request the reset interrupted claims the key instead of waiting it out
+        cache = IdempotencyCache(wait=5.0)
+        self.assertIsNone(cache.begin("slow"))
+        with ThreadPoolExecutor(1) as executor:
+            retry = executor.submit(cache.begin, "slow")
+            time.sleep(0.05)
+            cache.reset()
+            self.assertIsNone(retry.result(timeout=1))
+
+    def test_full_log_queue_drops_records(self):
+        """Test that logging never waits on a full queue and every record is either queued or counted as dropped"""
+        records = queue.Queue(10)
+        handler = BoundedQueueHandler(records)
+        logger = logging.Logger("test_full_log_queue_drops_records")
+        logger.addHandler(handler)
+
+        started = time.monotonic()
+        self.run_threads(lambda i: [logger.warning("record %s", i) for _ in range(100)], range(THREADS))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(records.qsize(), 10)
+        self.assertEqual(handler.dropped, THREADS * 100 - 10)
+
+        # the next record that fits reports how many were dropped before it
+        while not records.empty():
+            records.get_nowait()
+        logger.warning("after")
+        report, after = records.get_nowait(), records.get_nowait()
+        self.assertEqual(report.getMessage(), f"dropped {THREADS * 100 - 10} log records, the log queue was full")
+        self.assertEqual(after.getMessage(), "after")
+
+    def test_log_payloads_render_when_written(self):
+        """Test that a Payload is only rendered by the writer's formatter, and not for records that are left out"""
+        records = queue.Queue()
+        logger = logging.Logger("test_log_payloads_render_when_written", logging.INFO)
+        logger.addHandler(BoundedQueueHandler(records))
+
+        skipped = CountedPayload({"isbn": "HOT"})
+        logger.debug("request %s", skipped)
+        self.assertTrue(records.empty())
+
+        written = CountedPayload({"isbn": "HOT"})
+        logger.info("request %s", written)
+        record = records.get_nowait()
+        self.assertEqual(written.renders, 0)
+
+        stream = io.StringIO()
+        writer = logging.StreamHandler(stream)
+        writer.setFormatter(StructuredFormatter(max_payload_size=8))
+        writer.handle(record)
+        self.assertEqual(json.loads(stream.getvalue())["message"], 'request {"isbn":... (15 characters)')
+        self.assertEqual((skipped.renders, written.renders), (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
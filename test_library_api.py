@@ -5,8 +5,10 @@ This script tests all the required functionality of the API.
 """
 
 import argparse
+import json
 import requests
 import unittest
+import uuid
 from datetime import datetime, timedelta
 
 # Change this to the base URL of the API
@@ -176,7 +178,521 @@ class LibraryAPITest(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         checkouts = response.json()
         self.assertEqual(len(checkouts), 0)
-    
+
+    def test_bulk_add_books(self):
+        """Test importing books in bulk from NDJSON"""
+        lines = [
+            '{"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "copies": 2}',
+            '{"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "copies": 1}',
+            '{"title": "Emma", "author": "Jane Austen", "isbn": "9780141439587"}',
+            'not json',
+        ]
+        response = requests.post(f"{BASE_URL}/books/bulk", data="\n".join(lines),
+                                 headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual(summary["received"], 4)
+        self.assertEqual(summary["applied"], 2)
+        self.assertEqual([error["line"] for error in summary["errors"]], [3, 4])
+
+        # Verify copies were added up
+        response = requests.get(f"{BASE_URL}/books/9780441172719")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["copies"], 3)
+
+    def test_batch_checkout_and_return(self):
+        """Test that batch checkouts are all or nothing and batch returns undo them"""
+        book_data = {
+            "title": "Beloved",
+            "author": "Toni Morrison",
+            "isbn": "9781400033416",
+            "copies": 1
+        }
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        book_data = {
+            "title": "Ulysses",
+            "author": "James Joyce",
+            "isbn": "9780679722762",
+            "copies": 2
+        }
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        customer_data = {
+            "name": "Alice Brown",
+            "email": "alice.brown@example.com",
+            "customer_id": "CUST004"
+        }
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+
+        # Asking for two copies of a single copy book fails the whole batch
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        checkout_data = [
+            {"isbn": "9780679722762", "customer_id": "CUST004", "due_date": due_date},
+            {"isbn": "9781400033416", "customer_id": "CUST004", "due_date": due_date},
+            {"isbn": "9781400033416", "customer_id": "CUST004", "due_date": due_date},
+        ]
+        response = requests.post(f"{BASE_URL}/checkouts/batch", json=checkout_data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([result["status"] for result in response.json()["results"]], [424, 424, 409])
+        response = requests.get(f"{BASE_URL}/books/9780679722762")
+        self.assertEqual(response.json()["available_copies"], 2)
+
+        # Without the extra copy every checkout is made
+        response = requests.post(f"{BASE_URL}/checkouts/batch", json=checkout_data[:2])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["applied"], 2)
+        response = requests.get(f"{BASE_URL}/customers/CUST004/books")
+        self.assertEqual(len(response.json()), 2)
+
+        # Return both books at once
+        return_data = [
+            {"isbn": "9780679722762", "customer_id": "CUST004"},
+            {"isbn": "9781400033416", "customer_id": "CUST004"},
+        ]
+        response = requests.post(f"{BASE_URL}/returns/batch", json=return_data)
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(f"{BASE_URL}/books/9781400033416")
+        self.assertEqual(response.json()["available_copies"], 1)
+        response = requests.get(f"{BASE_URL}/customers/CUST004/books")
+        self.assertEqual(len(response.json()), 0)
+
+    def test_due_and_overdue_checkouts(self):
+        """Test querying checkouts by due date a page at a time"""
+        customer_data = {
+            "name": "Carol White",
+            "email": "carol.white@example.com",
+            "customer_id": "CUST005"
+        }
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+
+        # Check out three books due in 3, 5 and 10 days
+        for isbn, days in [("9780140449136", 10), ("9780140447934", 3), ("9780140442106", 5)]:
+            book_data = {"title": isbn, "author": "Homer", "isbn": isbn, "copies": 1}
+            requests.post(f"{BASE_URL}/books", json=book_data)
+            checkout_data = {
+                "isbn": isbn,
+                "customer_id": "CUST005",
+                "due_date": (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+            }
+            response = requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+            self.assertEqual(response.status_code, 201)
+
+        # As of 6 days from now two books are overdue, earliest due first
+        as_of = (datetime.now() + timedelta(days=6)).strftime("%Y-%m-%d")
+        response = requests.get(f"{BASE_URL}/checkouts/overdue", params={"as_of": as_of})
+        self.assertEqual(response.status_code, 200)
+        overdue = response.json()
+        self.assertEqual([c["isbn"] for c in overdue["checkouts"]], ["9780140447934", "9780140442106"])
+        self.assertIsNone(overdue["next_cursor"])
+
+        # Page through the books due from 4 to 10 days from now one at a time
+        params = {
+            "from": (datetime.now() + timedelta(days=4)).strftime("%Y-%m-%d"),
+            "to": (datetime.now() + timedelta(days=10)).strftime("%Y-%m-%d"),
+            "limit": 1
+        }
+        isbns = []
+        while True:
+            response = requests.get(f"{BASE_URL}/checkouts/due", params=params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            isbns += [c["isbn"] for c in page["checkouts"]]
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+        self.assertEqual(isbns, ["9780140442106", "9780140449136"])
+
+    def test_book_checkouts(self):
+        """Test listing who has the copies of a book"""
+        book_data = {
+            "title": "Middlemarch",
+            "author": "George Eliot",
+            "isbn": "9780141439549",
+            "copies": 3
+        }
+        requests.post(f"{BASE_URL}/books", json=book_data)
+
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        for customer_id in ["CUST006", "CUST007"]:
+            customer_data = {"name": customer_id, "email": f"{customer_id}@example.com", "customer_id": customer_id}
+            requests.post(f"{BASE_URL}/customers", json=customer_data)
+            checkout_data = {"isbn": "9780141439549", "customer_id": customer_id, "due_date": due_date}
+            requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+
+        response = requests.get(f"{BASE_URL}/books/9780141439549/checkouts")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["customer_id"] for c in response.json()], ["CUST006", "CUST007"])
+
+        # Returned copies are no longer listed
+        requests.post(f"{BASE_URL}/returns", json={"isbn": "9780141439549", "customer_id": "CUST006"})
+        response = requests.get(f"{BASE_URL}/books/9780141439549/checkouts")
+        self.assertEqual([c["customer_id"] for c in response.json()], ["CUST007"])
+
+        response = requests.get(f"{BASE_URL}/books/0000000000000/checkouts")
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_books(self):
+        """Test finding books by title and author words"""
+        books = [
+            {"title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "isbn": "9780743273565", "copies": 1},
+            {"title": "Great Expectations", "author": "Charles Dickens", "isbn": "9780141439563", "copies": 1},
+            {"title": "Bleak House", "author": "Charles Dickens", "isbn": "9780141439723", "copies": 1},
+            {"title": "Greatness", "author": "Jane Great", "isbn": "9780000000001", "copies": 1}
+        ]
+        for book_data in books:
+            requests.post(f"{BASE_URL}/books", json=book_data)
+
+        # Title matches rank above author matches
+        response = requests.get(f"{BASE_URL}/books", params={"q": "great"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b["isbn"] for b in response.json()], ["9780141439563", "9780743273565", "9780000000001"])
+
+        # The last word matches as a prefix while typing
+        response = requests.get(f"{BASE_URL}/books", params={"q": "great exp"})
+        self.assertEqual([b["title"] for b in response.json()], ["Great Expectations"])
+
+        response = requests.get(f"{BASE_URL}/books", params={"author": "dick", "limit": 1})
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(response.json()[0]["author"], "Charles Dickens")
+
+        response = requests.get(f"{BASE_URL}/books", params={"q": "house", "author": "fitzgerald"})
+        self.assertEqual(response.json(), [])
+
+        response = requests.get(f"{BASE_URL}/books", params={"q": " "})
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_collections(self):
+        """Test paging through books, customers and checkouts"""
+        for i in range(5):
+            book_data = {"title": f"Volume {i}", "author": "Anonymous", "isbn": f"97800000001{i}", "copies": 1}
+            requests.post(f"{BASE_URL}/books", json=book_data)
+
+        # Books added while paging don't shift the pages
+        isbns = []
+        params = {"limit": 2}
+        while True:
+            response = requests.get(f"{BASE_URL}/books", params=params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["books"]), 2)
+            isbns += [b["isbn"] for b in page["books"]]
+            if len(isbns) == 2:
+                book_data = {"title": "Volume 9", "author": "Anonymous", "isbn": "979000000019", "copies": 1}
+                requests.post(f"{BASE_URL}/books", json=book_data)
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+        self.assertEqual(len(isbns), 6)
+        self.assertEqual(len(set(isbns)), 6)
+
+        for customer_id in ["CUST008", "CUST009"]:
+            customer_data = {"name": customer_id, "email": f"{customer_id}@example.com", "customer_id": customer_id}
+            requests.post(f"{BASE_URL}/customers", json=customer_data)
+        response = requests.get(f"{BASE_URL}/customers")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["customer_id"] for c in response.json()["customers"]], ["CUST008", "CUST009"])
+        self.assertIsNone(response.json()["next_cursor"])
+
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        for isbn in ["978000000010", "978000000011"]:
+            checkout_data = {"isbn": isbn, "customer_id": "CUST008", "due_date": due_date}
+            requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+        requests.post(f"{BASE_URL}/returns", json={"isbn": "978000000010", "customer_id": "CUST008"})
+
+        response = requests.get(f"{BASE_URL}/checkouts", params={"limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["isbn"] for c in response.json()["checkouts"]], ["978000000011"])
+
+        response = requests.get(f"{BASE_URL}/checkouts", params={"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_reads(self):
+        """Test that unchanged books and customers are answered with 304 Not Modified"""
+        book_data = {"title": "Persuasion", "author": "Jane Austen", "isbn": "9780141439686", "copies": 2}
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        customer_data = {"name": "Anne Elliot", "email": "anne@example.com", "customer_id": "CUST010"}
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+
+        response = requests.get(f"{BASE_URL}/books/9780141439686")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        response = requests.get(f"{BASE_URL}/books/9780141439686", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+        # A checkout changes the availability and so the ETag
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        checkout_data = {"isbn": "9780141439686", "customer_id": "CUST010", "due_date": due_date}
+        requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+        response = requests.get(f"{BASE_URL}/books/9780141439686", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["available_copies"], 1)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        response = requests.get(f"{BASE_URL}/customers/CUST010")
+        etag = response.headers["ETag"]
+        customer_data["email"] = "anne.wentworth@example.com"
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+        response = requests.get(f"{BASE_URL}/customers/CUST010", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], "anne.wentworth@example.com")
+
+    def test_invalid_book_lists_every_error(self):
+        """Test that a bad request body is answered with all of its errors at once"""
+        book_data = {"author": "Jane Austen", "isbn": 9780141439518, "copies": "3", "edition": 2}
+        response = requests.post(f"{BASE_URL}/books", json=book_data)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertEqual([error["field"] for error in errors], ["title", "isbn", "copies", "edition"])
+
+        response = requests.get(f"{BASE_URL}/books/9780141439518")
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics(self):
+        """Test that the metrics endpoint reports requests, rejections and the state of the library"""
+        book_data = {"title": "Catch-22", "author": "Joseph Heller", "isbn": "9780099518471", "copies": 1}
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        for customer_id in ("CUST020", "CUST021"):
+            customer_data = {"name": customer_id, "email": f"{customer_id}@example.com", "customer_id": customer_id}
+            requests.post(f"{BASE_URL}/customers", json=customer_data)
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        for customer_id in ("CUST020", "CUST021"):
+            checkout_data = {"isbn": "9780099518471", "customer_id": customer_id, "due_date": due_date}
+            requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+        # isbns that aren't in the library aren't counted
+        requests.get(f"{BASE_URL}/books/9780000000000")
+        requests.post(f"{BASE_URL}/checkouts", json={"isbn": "9780000000001", "customer_id": "CUST020", "due_date": due_date})
+
+        response = requests.get(f"{BASE_URL}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        lines = response.text.splitlines()
+        self.assertIn("library_copies 1", lines)
+        self.assertIn("library_available_copies 0", lines)
+        self.assertIn("library_active_checkouts 1", lines)
+        self.assertIn('library_hot_isbn_requests{isbn="9780099518471"} 2', lines)
+        self.assertFalse(any(line.startswith('library_hot_isbn_requests{isbn="978000000000') for line in lines))
+        self.assertTrue(any(line.startswith('library_checkout_rejections_total{reason="no_copies"}') for line in lines))
+        self.assertTrue(any(line.startswith('library_http_requests_total{route="/api/checkouts",method="POST",'
+                                            'status="409"}') for line in lines))
+        self.assertTrue(any(line.startswith('library_http_request_duration_seconds_count{route="/api/books"}')
+                            for line in lines))
+
+    def test_holds(self):
+        """Test that a returned copy goes to the oldest hold and only its customer can check it out"""
+        book_data = {"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "copies": 1}
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        for customer_id in ("CUST030", "CUST031", "CUST032"):
+            customer_data = {"name": customer_id, "email": f"{customer_id}@example.com", "customer_id": customer_id}
+            requests.post(f"{BASE_URL}/customers", json=customer_data)
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        checkout_data = {"isbn": "9780441172719", "customer_id": "CUST030", "due_date": due_date}
+        requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+
+        # Holds queue up behind each other
+        response = requests.post(f"{BASE_URL}/holds", json={"isbn": "9780441172719", "customer_id": "CUST031"})
+        self.assertEqual(response.status_code, 201)
+        first_hold = response.json()
+        self.assertEqual(first_hold["status"], "waiting")
+        self.assertEqual(first_hold["position"], 1)
+        response = requests.post(f"{BASE_URL}/holds", json={"isbn": "9780441172719", "customer_id": "CUST032"})
+        second_hold = response.json()
+        self.assertEqual(second_hold["position"], 2)
+        response = requests.post(f"{BASE_URL}/holds", json={"isbn": "9780441172719", "customer_id": "CUST032"})
+        self.assertEqual(response.status_code, 409)
+
+        # The returned copy is set aside for the first hold
+        requests.post(f"{BASE_URL}/returns", json={"isbn": "9780441172719", "customer_id": "CUST030"})
+        response = requests.get(f"{BASE_URL}/customers/CUST031/holds")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["status"], "ready")
+        self.assertIsNotNone(response.json()[0]["expires_at"])
+        response = requests.get(f"{BASE_URL}/customers/CUST032/holds")
+        self.assertEqual(response.json()[0]["position"], 1)
+        # The copy set aside isn't available to anyone else
+        response = requests.get(f"{BASE_URL}/books/9780441172719")
+        self.assertEqual(response.json()["available_copies"], 0)
+        lines = requests.get(f"{BASE_URL}/metrics").text.splitlines()
+        self.assertIn("library_available_copies 0", lines)
+        self.assertIn("library_reserved_copies 1", lines)
+
+        # Holds are exported and come back from an import with their queue and the copy set aside
+        export = requests.get(f"{BASE_URL}/export").content
+        response = requests.post(f"{BASE_URL}/import", data=export)
+        self.assertEqual(response.json()["failed"], 0)
+        response = requests.get(f"{BASE_URL}/customers/CUST031/holds")
+        self.assertEqual([(hold["hold_id"], hold["status"]) for hold in response.json()],
+                         [(first_hold["hold_id"], "ready")])
+        response = requests.get(f"{BASE_URL}/customers/CUST032/holds")
+        self.assertEqual([(hold["hold_id"], hold["position"]) for hold in response.json()],
+                         [(second_hold["hold_id"], 1)])
+        response = requests.get(f"{BASE_URL}/books/9780441172719")
+        self.assertEqual(response.json()["available_copies"], 0)
+
+        # Only the customer it is set aside for can check it out
+        checkout_data = {"isbn": "9780441172719", "customer_id": "CUST032", "due_date": due_date}
+        response = requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+        self.assertEqual(response.status_code, 409)
+        checkout_data = {"isbn": "9780441172719", "customer_id": "CUST031", "due_date": due_date}
+        response = requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+        self.assertEqual(response.status_code, 201)
+        response = requests.get(f"{BASE_URL}/customers/CUST031/holds")
+        self.assertEqual(response.json(), [])
+
+        # Cancelling removes the hold
+        response = requests.delete(f"{BASE_URL}/holds/{second_hold['hold_id']}")
+        self.assertEqual(response.status_code, 200)
+        response = requests.delete(f"{BASE_URL}/holds/{second_hold['hold_id']}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_and_import(self):
+        """Test that an export restores the books, customers and checkouts it was taken from"""
+        book_data = {"title": "Beloved", "author": "Toni Morrison", "isbn": "9781400033416", "copies": 2}
+        requests.post(f"{BASE_URL}/books", json=book_data)
+        customer_data = {"name": "Ada", "email": "ada@example.com", "customer_id": "CUST040"}
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        checkout_data = {"isbn": "9781400033416", "customer_id": "CUST040", "due_date": due_date}
+        requests.post(f"{BASE_URL}/checkouts", json=checkout_data)
+
+        response = requests.get(f"{BASE_URL}/export")
+        self.assertEqual(response.status_code, 200)
+        export = response.content
+        records = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([record["type"] for record in records], ["export", "book", "customer", "checkout", "end"])
+
+        requests.post(f"{BASE_URL}/reset")
+        response = requests.post(f"{BASE_URL}/import", data=export)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["applied"], 3)
+        self.assertEqual(response.json()["failed"], 0)
+
+        response = requests.get(f"{BASE_URL}/books/9781400033416")
+        self.assertEqual(response.json()["copies"], 2)
+        self.assertEqual(response.json()["available_copies"], 1)
+        response = requests.get(f"{BASE_URL}/customers/CUST040/books")
+        self.assertEqual([book["due_date"] for book in response.json()], [due_date])
+
+        # an export cut short is reported
+        response = requests.post(f"{BASE_URL}/import", data=b"\n".join(export.splitlines()[:2]))
+        self.assertEqual(response.json()["failed"], 1)
+
+    def test_analytics(self):
+        """Test that the analytics report on returned loans as well as the ones still out"""
+        def day(offset):
+            return (datetime.now() + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+        # loans that started in the past can only be restored from an export
+        records = [{"type": "export", "version": 1},
+                   {"type": "book", "title": "The Hobbit", "author": "J.R.R. Tolkien", "isbn": "9780547928227",
+                    "copies": 2},
+                   {"type": "book", "title": "Brave New World", "author": "Aldous Huxley", "isbn": "9780060850524",
+                    "copies": 2}]
+        records += [{"type": "customer", "name": customer_id, "email": f"{customer_id}@example.com",
+                     "customer_id": customer_id} for customer_id in ("CUST050", "CUST051", "CUST052")]
+        records += [{"type": "checkout", "checkout_id": "CKO900", "isbn": "9780547928227", "customer_id": "CUST050",
+                     "checkout_date": day(-20), "due_date": day(-6)},
+                    {"type": "checkout", "checkout_id": "CKO901", "isbn": "9780547928227", "customer_id": "CUST051",
+                     "checkout_date": day(-10), "due_date": day(-3)},
+                    {"type": "checkout", "checkout_id": "CKO902", "isbn": "9780060850524", "customer_id": "CUST052",
+                     "checkout_date": day(-4), "due_date": day(10)},
+                    {"type": "end"}]
+        response = requests.post(f"{BASE_URL}/import", data="\n".join(json.dumps(record) for record in records))
+        self.assertEqual(response.json()["failed"], 0)
+
+        for customer_id in ("CUST051", "CUST052"):
+            isbn = "9780547928227" if customer_id == "CUST051" else "9780060850524"
+            requests.post(f"{BASE_URL}/returns", json={"isbn": isbn, "customer_id": customer_id})
+        for customer_id in ("CUST050", "CUST051"):
+            checkout_data = {"isbn": "9780060850524", "customer_id": customer_id, "due_date": day(14)}
+            self.assertEqual(requests.post(f"{BASE_URL}/checkouts", json=checkout_data).status_code, 201)
+
+        response = requests.get(f"{BASE_URL}/analytics/top-titles")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["titles"], [
+            {"isbn": "9780060850524", "title": "Brave New World", "checkouts": 3},
+            {"isbn": "9780547928227", "title": "The Hobbit", "checkouts": 2}])
+
+        # both copies of The Hobbit were out every day of the last ten
+        response = requests.get(f"{BASE_URL}/analytics/utilization", params={"from": day(-9)})
+        books = [(book["isbn"], book["days_on_loan"], book["utilization"]) for book in response.json()["books"]]
+        self.assertEqual(books, [("9780547928227", 20, 1.0), ("9780060850524", 7, 0.35)])
+
+        response = requests.get(f"{BASE_URL}/analytics/loan-durations")
+        self.assertEqual(response.json()["returns"], 2)
+        self.assertEqual(response.json()["mean_days"], 7.0)
+        self.assertEqual(response.json()["percentiles"]["50"], 7.0)
+
+        # one loan came back late and one is still out
+        response = requests.get(f"{BASE_URL}/analytics/overdue")
+        self.assertEqual(response.json()["to"], day(-1))
+        self.assertEqual(response.json()["returned_late"], 1)
+        self.assertEqual(response.json()["outstanding"], 1)
+        self.assertEqual(response.json()["overdue_rate"], 1.0)
+        response = requests.get(f"{BASE_URL}/analytics/overdue", params={"isbn": "9780060850524"})
+        self.assertEqual(response.json()["due"], 0)
+
+        response = requests.get(f"{BASE_URL}/analytics/overdue", params={"from": day(0)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_customer_books_follow_checkouts(self):
+        """Test that a customer's books are kept up to date as books are checked out and returned"""
+        isbns = ["9780140449136", "9780140447934", "9780140449266"]
+        for isbn in isbns:
+            requests.post(f"{BASE_URL}/books", json={"title": f"Classic {isbn}", "author": "Penguin", "isbn": isbn,
+                                                     "copies": 1})
+        customer_data = {"name": "Lev", "email": "lev@example.com", "customer_id": "CUST060"}
+        requests.post(f"{BASE_URL}/customers", json=customer_data)
+        self.assertEqual(requests.get(f"{BASE_URL}/customers/CUST060/books").json(), [])
+
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        for isbn in isbns:
+            requests.post(f"{BASE_URL}/checkouts", json={"isbn": isbn, "customer_id": "CUST060", "due_date": due_date})
+        requests.post(f"{BASE_URL}/returns", json={"isbn": isbns[1], "customer_id": "CUST060"})
+
+        response = requests.get(f"{BASE_URL}/customers/CUST060/books")
+        self.assertEqual(response.status_code, 200)
+        today = datetime.now().strftime("%Y-%m-%d")
+        self.assertEqual(response.json(), [
+            {"isbn": isbn, "title": f"Classic {isbn}", "author": "Penguin", "checkout_date": today, "due_date": due_date}
+            for isbn in (isbns[0], isbns[2])])
+
+        requests.post(f"{BASE_URL}/returns/batch", json=[{"isbn": isbn, "customer_id": "CUST060"}
+                                                        for isbn in (isbns[0], isbns[2])])
+        self.assertEqual(requests.get(f"{BASE_URL}/customers/CUST060/books").json(), [])
+
+    def test_idempotent_retries(self):
+        """Test that a checkout or return retried with the same Idempotency-Key is only made once"""
+        requests.post(f"{BASE_URL}/books", json={"title": "Middlemarch", "author": "George Eliot",
+                                                 "isbn": "9780141439549", "copies": 2})
+        requests.post(f"{BASE_URL}/customers", json={"name": "Dorothea", "email": "dorothea@example.com",
+                                                     "customer_id": "CUST061"})
+        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d")
+        checkout_data = {"isbn": "9780141439549", "customer_id": "CUST061", "due_date": due_date}
+
+        # keys outlive resets, so every run uses new ones
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        first = requests.post(f"{BASE_URL}/checkouts", json=checkout_data, headers=headers)
+        retry = requests.post(f"{BASE_URL}/checkouts", json=checkout_data, headers=headers)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json()["checkout_id"], first.json()["checkout_id"])
+        self.assertEqual(retry.headers.get("Idempotent-Replayed"), "true")
+        self.assertEqual(requests.get(f"{BASE_URL}/books/9780141439549").json()["available_copies"], 1)
+
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        return_data = {"isbn": "9780141439549", "customer_id": "CUST061"}
+        first = requests.post(f"{BASE_URL}/returns", json=return_data, headers=headers)
+        retry = requests.post(f"{BASE_URL}/returns", json=return_data, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(requests.get(f"{BASE_URL}/books/9780141439549").json()["available_copies"], 2)
+
+        # without the key the same return is a new request, and there is nothing left to return
+        response = requests.post(f"{BASE_URL}/returns", json=return_data)
+        self.assertEqual(response.status_code, 409)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test the Library Management System API")
     parser.add_argument("--url", type=str, default=BASE_URL, help="Base URL of the API")
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Tests for the storage backends and the write-ahead log.
+These use the collections directly rather than the app, so every backend is covered whatever LIBRARY_STORAGE is.
+"""
+
+import fcntl
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from werkzeug.exceptions import HTTPException
+
+from api.analytics import CirculationLog, overdue_loans
+from models import Books, Customers, Checkouts, Checkout, Holds
+from storage import Persistence, WriteAheadLog, SQLiteEngine, SQLiteBooks, SQLiteCustomers, SQLiteCheckouts
+from storage import SharedRegion, SharedBooks, SharedCustomers, SharedCheckouts
+from storage import ColumnarBooks, ColumnarCustomers, ColumnarCheckouts
+
+CHECKOUT_LIMIT = 5
+SHARED_CAPACITY = 64
+
+def open_shared(path):
+    region = SharedRegion(path, SHARED_CAPACITY, SHARED_CAPACITY, CHECKOUT_LIMIT)
+    books = SharedBooks(region)
+    customers = SharedCustomers(region, CHECKOUT_LIMIT)
+    return region, books, customers, SharedCheckouts(region, books, customers)
+
+def checkout_in_worker(path, worker, count):
+    """checks out count books for CUST1 in a process of its own, returns the ids of the checkouts made"""
+    region, books, customers, checkouts = open_shared(path)
+    made = []
+    for i in range(count):
+        checkout = Checkout(books.get_book("HOT"), customers.get_customer("CUST1"), "HOT", "CUST1",
+                            date.today() + timedelta(days=i + 1), checkout_id=f"CKO{worker}{i}")
+        try:
+            checkouts.add_checkout(checkout)
+            made.append(checkout.checkout_id)
+        except HTTPException:
+            pass
+    region.close()
+    return made
+
+def lock_is_held(path, offset):
+    """whether another process holds the record lock at offset, checked from a process of its own"""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+def memory_library():
+    return Books(), Customers(), Checkouts()
+
+def columnar_library():
+    books, customers = ColumnarBooks(), ColumnarCustomers()
+    return books, customers, ColumnarCheckouts(books, customers)
+
+class InMemoryStorageTest(unittest.TestCase):
+    """runs each test on the memory and columnar backends"""
+
+    def libraries(self):
+        for make_library in (memory_library, columnar_library):
+            with self.subTest(backend=make_library.__name__):
+                yield make_library()
+
+    def checkout(self, library, isbn, customer_id, due_date):
+        books, customers, checkouts = library
+        checkout = Checkout(books.get_book(isbn), customers.get_customer(customer_id), isbn, customer_id, due_date)
+        checkouts.add_checkout(checkout)
+        return checkout
+
+    def test_due_date_index(self):
+        """Test that checkouts page by due date, within a day too, and leave the index when returned"""
+        today = date.today()
+        for library in self.libraries():
+            books, customers, checkouts = library
+            for isbn in ("A", "B", "C"):
+                books.add_book(f"Book {isbn}", "Author", isbn, 3)
+            for customer_id in ("CUST1", "CUST2", "CUST3"):
+                customers.add_customer(customer_id, f"{customer_id}@example.com", customer_id)
+            for isbn in ("A", "B", "C"):
+                for customer_id, days in (("CUST1", 7), ("CUST2", 3), ("CUST3", 7)):
+                    self.checkout(library, isbn, customer_id, today + timedelta(days=days))
+
+            def due_pages(start, end, limit):
+                pages, after = [], None
+                while True:
+                    page = checkouts.get_by_due_date(start, end, after, limit)
+                    pages.append([(c.due_date, c.isbn, c.customer_id) for c in page])
+                    if len(page) < limit:
+                        return pages
+                    after = (page[-1].due_date, page[-1].checkout_id)
+
+            pages = due_pages(None, None, 2)
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+            listed = [item for page in pages for item in page]
+            self.assertEqual(sorted(listed), sorted(set(listed)))
+            self.assertEqual([item[0] for item in listed], [today + timedelta(days=3)] * 3 + [today + timedelta(days=7)] * 6)
+            self.assertEqual(len(checkouts.get_by_due_date(today + timedelta(days=4), today + timedelta(days=8), None, 10)), 6)
+
+            for isbn in ("A", "B", "C"):
+                checkouts.return_book(isbn, "CUST2")
+            checkouts.return_book("B", "CUST1")
+            listed = [item for page in due_pages(None, None, 4) for item in page]
+            self.assertEqual(sorted(listed), sorted([(today + timedelta(days=7), isbn, customer_id)
+                                                     for isbn in ("A", "B", "C") for customer_id in ("CUST1", "CUST3")
+                                                     if (isbn, customer_id) != ("B", "CUST1")]))
+            self.assertEqual(checkouts.get_by_due_date(None, today + timedelta(days=7), None, 10), [])
+
+    def test_search_intersects_terms(self):
+        """Test that a book matching every word is found when each word alone matches many other books"""
+        for books, _, _ in self.libraries():
+            for i in range(300):
+                books.add_book(f"Harry {i}", "Author", f"H{i}", 1)
+                books.add_book(f"{i} Potter", "Author", f"P{i}", 1)
+            books.add_book("Harry Potter and the Goblet of Fire", "J.K. Rowling", "HP", 1)
+            self.assertEqual([book.isbn for book in books.search("harry potter", "", 10)], ["HP"])
+            self.assertEqual([book.isbn for book in books.search("potter", "rowl", 10)], ["HP"])
+
+    def test_pages_skip_returned_checkouts(self):
+        """Test that checkouts page in the order they were made while most of them are returned"""
+        today = date.today()
+        for library in self.libraries():
+            books, customers, checkouts = library
+            books.add_book("Book", "Author", "A", 40)
+            for i in range(40):
+                customers.add_customer(f"Customer {i}", f"cust{i}@example.com", f"CUST{i}")
+                self.checkout(library, "A", f"CUST{i}", today + timedelta(days=i % 3))
+
+            def listed():
+                customer_ids, after = [], None
+                while page := list(checkouts.page_checkouts(after, 3)):
+                    self.assertLessEqual(len(page), 3)
+                    customer_ids += [checkout.customer_id for _, checkout in page]
+                    after = page[-1][0]
+                return customer_ids
+
+            kept = [f"CUST{i}" for i in range(40)]
+            for i in list(range(0, 40, 2)) + list(range(1, 30, 2)):
+                checkouts.return_book("A", f"CUST{i}")
+                kept.remove(f"CUST{i}")
+                self.assertEqual(listed(), kept)
+            self.assertEqual(checkouts.count_active(), 5)
+            self.assertEqual(books.get_book("A").available_copies, 35)
+
+    def test_columnar_reuses_returned_rows(self):
+        """Test that the columnar store reuses the rows of returned checkouts and keeps the allocator's ids"""
+        library = columnar_library()
+        books, customers, checkouts = library
+        books.add_book("Book", "Author", "A", 10)
+        for i in range(10):
+            customers.add_customer(f"Customer {i}", f"cust{i}@example.com", f"CUST{i}")
+
+        due_date = date.today() + timedelta(days=7)
+        returned: list[str] = []
+        for _ in range(5):
+            made = [self.checkout(library, "A", f"CUST{i}", due_date) for i in range(10)]
+            for checkout in made:
+                self.assertEqual(checkouts.get_by_id(checkout.checkout_id).customer_id, checkout.customer_id)
+            for checkout in made[::2] + made[1::2]:
+                checkouts.return_book("A", checkout.customer_id)
+            returned += [checkout.checkout_id for checkout in made]
+        self.assertEqual(len(set(returned)), 50)
+        self.assertEqual(len(checkouts._numbers), 10)
+        for checkout_id in returned:
+            self.assertRaises(KeyError, checkouts.get_by_id, checkout_id)
+
+        # reused rows are listed in the order their checkouts were made, not by row
+        made = [self.checkout(library, "A", f"CUST{i}", due_date) for i in (3, 1, 4, 0, 5, 9, 2)]
+        self.assertEqual([checkout.checkout_id for _, checkout in checkouts.page_checkouts(None, 10)],
+                         [checkout.checkout_id for checkout in made])
+        self.assertEqual([checkout.checkout_id for checkout in checkouts.get_by_due_date(None, None, None, 10)],
+                         sorted((checkout.checkout_id for checkout in made), key=lambda i: int(i[3:])))
+        self.assertRaises(ValueError, checkouts.get_by_due_date, None, None, (due_date, "CKO1x"), 10)
+        self.assertEqual(books.get_book("A").available_copies, 3)
+
+        # ids keep coming from the allocator after a reset, and an id in use can't be added twice
+        checkouts.reset()
+        again = self.checkout(library, "A", "CUST0", due_date)
+        self.assertNotIn(again.checkout_id, returned + [checkout.checkout_id for checkout in made])
+        duplicate = Checkout(books.get_book("A"), customers.get_customer("CUST1"), "A", "CUST1", due_date,
+                             checkout_id=again.checkout_id)
+        with self.assertRaises(HTTPException) as raised:
+            checkouts.add_checkout(duplicate)
+        self.assertEqual(raised.exception.code, 409)
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.due_date = date.today() + timedelta(days=14)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_library(self, snapshot_interval):
+        persistence = Persistence(WriteAheadLog(self.directory.name), snapshot_interval)
+        library = Books(persistence), Customers(persistence), Checkouts(persistence)
+        persistence.recover(*library)
+        return persistence, library
+
+    def files(self, prefix):
+        return sorted(name for name in os.listdir(self.directory.name) if name.startswith(prefix))
+
+    def snapshot_lsns(self):
+        return [int(name.removeprefix("snapshot-").removesuffix(".jsonl")) for name in self.files("snapshot-")]
+
+    def test_recovers_snapshot_and_log(self):
+        """Test that a restart restores the library from the latest snapshot and the log written after it"""
+        persistence, (books, customers, checkouts) = self.open_library(snapshot_interval=6)
+        for isbn in ("A", "B", "C"):
+            books.add_book(f"Book {isbn}", "Author", isbn, 2)
+        for customer_id in ("CUST1", "CUST2"):
+            customers.add_customer(customer_id, f"{customer_id}@example.com", customer_id)
+        for isbn, customer_id in (("A", "CUST1"), ("A", "CUST2"), ("B", "CUST1")):
+            checkouts.add_checkout(Checkout(books.get_book(isbn), customers.get_customer(customer_id),
+                                            isbn, customer_id, self.due_date))
+        checkouts.return_book("A", "CUST2")
+        customers.add_customer("Renamed", "renamed@example.com", "CUST2")
+        persistence.close()
+
+        # the snapshot after the sixth mutation replaced every file before it
+        self.assertEqual(len(self.files("snapshot-")), 1)
+        self.assertEqual(len(self.files("wal-")), 1)
+
+        # a crash partway through writing a record leaves a torn line, it and anything after it are dropped
+        segment = os.path.join(self.directory.name, self.files("wal-")[-1])
+        with open(segment, "ab") as f:
+            f.write(b'{"lsn":99,"op":"add_book","title":"Torn"')
+
+        persistence, (books, customers, checkouts) = self.open_library(snapshot_interval=6)
+        self.assertEqual([(book.isbn, book.available_copies) for book in books.get_books()],
+                         [("A", 1), ("B", 1), ("C", 2)])
+        self.assertEqual(customers.get_customer("CUST2").name, "Renamed")
+        self.assertEqual(customers.get_customer("CUST1").checkouts, 2)
+        self.assertEqual(sorted(checkout.isbn for checkout in checkouts.get_by_customer_id("CUST1")), ["A", "B"])
+        self.assertFalse(checkouts.contains_isbn_cust_id("A", "CUST2"))
+        # only the four records logged after the snapshot count towards the next one
+        self.assertEqual(persistence.wal.replayed, 4)
+
+        # so the next snapshot is due after two more mutations, not straight away
+        books.add_book("Book D", "Author", "D", 1)
+        persistence.wal.wait(11)
+        self.assertEqual(self.snapshot_lsns(), [6])
+        books.add_book("Book E", "Author", "E", 1)
+        persistence.close()
+        self.assertEqual(self.snapshot_lsns(), [12])
+
+        persistence, (books, customers, checkouts) = self.open_library(snapshot_interval=6)
+        self.assertEqual(len(books.get_books()), 5)
+        self.assertEqual(checkouts.count_active(), 2)
+        self.assertEqual(persistence.wal.replayed, 0)
+        persistence.close()
+
+    def test_recovers_holds(self):
+        """Test that a restart restores each hold queue in order and the copies set aside for ready holds"""
+        def open_holds():
+            persistence = Persistence(WriteAheadLog(self.directory.name), snapshot_interval=8)
+            books, customers, checkouts = Books(persistence), Customers(persistence), Checkouts(persistence)
+            holds = Holds(journal=persistence)
+            persistence.recover(books, customers, checkouts, holds)
+            return persistence, holds
+
+        persistence, holds = open_holds()
+        placed_at = datetime(2024, 1, 1, 9, 30)
+        placed = [holds.place("A", customer_id, placed_at) for customer_id in ("CUST1", "CUST2", "CUST3", "CUST4")]
+        holds.allocate("A", lambda customer_id: customer_id != "CUST1", placed_at)
+        holds.remove(placed[2])
+        persistence.close()
+
+        # restored from the log, then from the snapshot taken after the eighth mutation
+        for _ in range(2):
+            persistence, holds = open_holds()
+            self.assertEqual([(hold.hold_id, hold.status) for hold in holds.get_holds()],
+                             [(placed[0].hold_id, "waiting"), (placed[1].hold_id, "ready"),
+                              (placed[3].hold_id, "waiting")])
+            self.assertEqual(holds.get_by_id(placed[1].hold_id).expires_at, placed_at + holds.pickup_window)
+            self.assertEqual(holds.reserved("A"), 1)
+            self.assertEqual(holds.position(holds.get_by_id(placed[3].hold_id)), 2)
+            # new holds are numbered after the restored ones
+            self.assertEqual(holds.place("A", "CUST5", placed_at).hold_id, "HLD5")
+            holds.remove(holds.get_by_id("HLD5"))
+            persistence.close()
+        self.assertEqual(len(self.files("snapshot-")), 1)
+
+    def test_recovers_circulation_history(self):
+        """Test that a restart brings back returned loans in the circulation history, from the log and a snapshot"""
+        def open_history():
+            persistence = Persistence(WriteAheadLog(self.directory.name), snapshot_interval=6)
+            books, customers, checkouts = Books(persistence), Customers(persistence), Checkouts(persistence)
+            circulation = CirculationLog(journal=persistence)
+            persistence.recover(books, customers, checkouts, circulation=circulation)
+            return persistence, circulation
+
+        def events(circulation):
+            history = circulation.snapshot()
+            return ([(history.isbn(isbn), day, due) for isbn, day, due in
+                     zip(history.checkout_isbn, history.checkout_day, history.checkout_due)],
+                    [(history.isbn(isbn), day, start, due) for isbn, day, start, due in
+                     zip(history.return_isbn, history.return_day, history.return_start, history.return_due)])
+
+        persistence, circulation = open_history()
+        today, overdue = date.today(), date.today() - timedelta(days=6)
+        for isbn in ("A", "B", "A"):
+            circulation.checked_out(isbn, today - timedelta(days=20), overdue)
+        circulation.returned("A", today - timedelta(days=20), overdue, today - timedelta(days=2))
+        expected = events(circulation)
+        persistence.close()
+
+        # restored from the log
+        persistence, circulation = open_history()
+        self.assertEqual(events(circulation), expected)
+        self.assertEqual(overdue_loans(circulation.snapshot(), overdue, overdue),
+                         {"due": 3, "returned_on_time": 0, "returned_late": 1, "outstanding": 2})
+        circulation.checked_out("C", today, today + timedelta(days=14))
+        circulation.returned("C", today, today + timedelta(days=14), today)
+        expected = events(circulation)
+        persistence.close()
+
+        # restored from the snapshot taken after the sixth mutation
+        self.assertEqual(self.snapshot_lsns(), [6])
+        persistence, circulation = open_history()
+        self.assertEqual(events(circulation), expected)
+        self.assertEqual(persistence.wal.replayed, 0)
+        persistence.close()
+
+class SQLiteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "library.db")
+        self.engines = []
+        self.due_date = date.today() + timedelta(days=14)
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+        self.directory.cleanup()
+
+    def open_library(self):
+        """stores on their own engine, each stands in for another process sharing the database"""
+        engine = SQLiteEngine(self.path)
+        self.engines.append(engine)
+        return SQLiteBooks(engine), SQLiteCustomers(engine), SQLiteCheckouts(engine, CHECKOUT_LIMIT)
+
+    def checkout(self, library, isbn, customer_id, due_date=None):
+        books, customers, checkouts = library
+        checkout = Checkout(books.get_book(isbn), customers.get_customer(customer_id), isbn, customer_id,
+                            due_date or self.due_date)
+        checkouts.add_checkout(checkout)
+        return checkout
+
+    def test_limits_hold_across_processes(self):
+        """Test that processes sharing a database can't take more copies or checkouts than the limits allow"""
+        first, second = self.open_library(), self.open_library()
+        first[0].add_book("Book", "Author", "HOT", 20)
+        first[1].add_customer("Customer", "customer@example.com", "CUST1")
+
+        def checkout(i):
+            # the customer's count was read before any checkout, so only the database can refuse them
+            try:
+                return self.checkout((first, second)[i % 2], "HOT", "CUST1").checkout_id
+            except HTTPException as e:
+                return e.code
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(checkout, range(12)))
+        self.assertEqual(sum(1 for result in results if result == 409), 12 - CHECKOUT_LIMIT)
+        self.assertEqual(second[1].get_customer("CUST1").checkouts, CHECKOUT_LIMIT)
+        self.assertEqual(second[0].get_book("HOT").available_copies, 20 - CHECKOUT_LIMIT)
+        self.assertEqual(len(set(results)), CHECKOUT_LIMIT + 1)
+
+        # a checkout made by one process is returned by the other
+        second[2].return_book("HOT", "CUST1")
+        self.assertEqual(first[2].count_active(), CHECKOUT_LIMIT - 1)
+        self.assertEqual(first[0].get_book("HOT").available_copies, 20 - CHECKOUT_LIMIT + 1)
+
+    def test_due_date_pages(self):
+        """Test that checkouts page by due date and that cursors naming other ids are refused"""
+        library = self.open_library()
+        library[0].add_book("Book", "Author", "BOOK", 5)
+        for customer_id in ("CUST1", "CUST2"):
+            library[1].add_customer(customer_id, f"{customer_id}@example.com", customer_id)
+        made = [self.checkout(library, "BOOK", customer_id, self.due_date + timedelta(days=days))
+                for customer_id, days in (("CUST1", 2), ("CUST2", 1), ("CUST1", 1), ("CUST2", 3))]
+
+        checkouts = library[2]
+        first = checkouts.get_by_due_date(None, None, None, 2)
+        self.assertEqual([c.checkout_id for c in first], [made[1].checkout_id, made[2].checkout_id])
+        rest = checkouts.get_by_due_date(None, None, (first[-1].due_date, first[-1].checkout_id), 10)
+        self.assertEqual([c.checkout_id for c in rest], [made[0].checkout_id, made[3].checkout_id])
+        before = checkouts.get_by_due_date(None, self.due_date + timedelta(days=2), None, 10)
+        self.assertEqual([c.checkout_id for c in before], [c.checkout_id for c in first])
+
+        with self.assertRaises(ValueError):
+            checkouts.get_by_due_date(None, None, (self.due_date, "x"), 10)
+        with self.assertRaises(KeyError):
+            checkouts.get_by_id("x")
+
+class SharedStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "library")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_slot_lock_held_while_checkouts_change(self):
+        """Test that other workers stay locked out of a customer's rows until a checkout or return is written"""
+        region, books, customers, checkouts = open_shared(self.path)
+        books.add_book("Book", "Author", "HOT", 10)
+        customers.add_customer("Customer", "customer@example.com", "CUST1")
+        slot = customers.get_customer("CUST1")._slot
+        table = region.customers
+        held = []
+
+        def add(slot, deltas):
+            add_counters(slot, deltas)
+            held.append(pool.apply(lock_is_held, (self.path, table._lock_base + slot)))
+
+        add_counters = table._add
+        with multiprocessing.get_context("spawn").Pool(1) as pool, mock.patch.object(table, "_add", add):
+            checkouts.add_checkout(Checkout(books.get_book("HOT"), customers.get_customer("CUST1"), "HOT", "CUST1",
+                                            date.today() + timedelta(days=14)))
+            checkouts.return_book("HOT", "CUST1")
+        self.assertEqual(held, [True, True])
+        self.assertEqual(customers.get_customer("CUST1").checkouts, 0)
+        region.close()
+
+    def test_workers_share_checkouts(self):
+        """Test that checkouts made by one worker process are seen, limited and returned by the others"""
+        region, books, customers, checkouts = open_shared(self.path)
+        books.add_book("Book", "Author", "HOT", 10)
+        customers.add_customer("Customer", "customer@example.com", "CUST1")
+
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            made = pool.starmap(checkout_in_worker, [(self.path, worker, 4) for worker in (1, 2)])
+        made = sorted(made[0] + made[1])
+        # each worker tried four, the customer's limit stops them at five between them
+        self.assertEqual(len(made), CHECKOUT_LIMIT)
+        self.assertEqual(customers.get_customer("CUST1").checkouts, CHECKOUT_LIMIT)
+        self.assertEqual(books.get_book("HOT").available_copies, 10 - CHECKOUT_LIMIT)
+        self.assertEqual(checkouts.count_active(), CHECKOUT_LIMIT)
+        self.assertEqual(sorted(c.checkout_id for c in checkouts.get_by_customer_id("CUST1")), made)
+        self.assertEqual(sorted(c.checkout_id for c in checkouts.get_by_isbn("HOT")), made)
+        self.assertEqual(checkouts.get_by_id(made[0]).customer_id, "CUST1")
+
+        # listings page through every worker's checkouts
+        page = list(checkouts.page_checkouts(None, 3))
+        page += list(checkouts.page_checkouts(page[-1][0], 3))
+        self.assertEqual(sorted(checkout.checkout_id for _, checkout in page), made)
+        due = checkouts.get_by_due_date(None, None, None, 2)
+        due += checkouts.get_by_due_date(None, None, (due[-1].due_date, due[-1].checkout_id), 10)
+        self.assertEqual([(c.due_date, c.checkout_id) for c in due], sorted((c.due_date, c.checkout_id) for c in due))
+        self.assertEqual(len(due), CHECKOUT_LIMIT)
+
+        # this worker returns a checkout another one made
+        self.assertTrue(checkouts.contains_isbn_cust_id("HOT", "CUST1"))
+        checkouts.return_book("HOT", "CUST1")
+        self.assertEqual(customers.get_customer("CUST1").checkouts, CHECKOUT_LIMIT - 1)
+        self.assertEqual(books.get_book("HOT").available_copies, 10 - CHECKOUT_LIMIT + 1)
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            self.assertEqual(len(pool.apply(checkout_in_worker, (self.path, 3, 2))), 1)
+
+        checkouts.reset()
+        self.assertEqual(checkouts.count_active(), 0)
+        self.assertEqual(checkouts.get_by_customer_id("CUST1"), [])
+        region.close()
+
+if __name__ == "__main__":
+    unittest.main()